@@ -1,12 +1,13 @@
 import os
+import signal
 import asyncio
 from pyrogram import Client
 from dotenv import load_dotenv
 from loguru import logger
 
 # Import modules
-from config import setup_logging
-from database import init_db
+from config import setup_logging, PYROGRAM_WORKERS
+from database import init_db, flush_writes
 from handlers import register_handlers
 from scheduler import setup_scheduler
 from keep_alive import keep_alive
@@ -22,7 +23,8 @@ bot = Client(
     "LinkGuardRobot",
     api_id=os.getenv("API_ID"),
     api_hash=os.getenv("API_HASH"),
-    bot_token=os.getenv("BOT_TOKEN")
+    bot_token=os.getenv("BOT_TOKEN"),
+    workers=PYROGRAM_WORKERS
 )
 
 # Main function to start the bot
@@ -68,8 +70,14 @@ async def main():
     # Keep the bot running
     await asyncio.Event().wait()
 
+# Treat SIGTERM like Ctrl+C so cleanup (including the write flush) runs
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
 # Entry point
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
     try:
         loop = asyncio.get_event_loop()
         loop.run_until_complete(main())
@@ -79,6 +87,13 @@ if __name__ == "__main__":
         logger.critical(f"Bot stopped due to critical error: {e}")
     finally:
         # Ensure proper cleanup
+        try:
+            # Write buffered bookkeeping (titles, caches) before exiting
+            loop.run_until_complete(flush_writes())
+            logger.info("Buffered database writes flushed")
+        except Exception as e:
+            logger.error(f"Failed to flush buffered database writes: {e}")
+        
         try:
             loop.run_until_complete(bot.stop())
             logger.info("Bot stopped gracefully")
@@ -0,0 +1,317 @@
+import asyncio
+import csv
+import io
+import json
+import uuid
+from loguru import logger
+
+from database import import_linked_channels
+from rate_limiter import api_call
+from refresh_jobs import report_progress, edit_job_message
+from chat_cache import get_chat
+from utils import (
+    resolve_channel_id,
+    is_user_admin,
+    is_bot_admin_with_permissions,
+    is_broadcast_channel,
+    MAIN_CHANNEL_PRIVILEGES,
+    PRIVATE_CHANNEL_PRIVILEGES
+)
+from config import IMPORT_MAX_ROWS, IMPORT_CONCURRENCY, IMPORT_STAGGER_SECONDS
+
+# Error for files that can't be imported at all
+class ImportFileError(Exception):
+    pass
+
+# Parse an uploaded file
+def parse_import_file(file_name, content):
+    """Get (line, main channel, private channel, message ID) rows from CSV or JSON content"""
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ImportFileError("The file must be UTF-8 text")
+    
+    if (file_name or "").lower().endswith(".json"):
+        rows = parse_json_rows(text)
+    else:
+        rows = parse_csv_rows(text)
+    
+    if not rows:
+        raise ImportFileError("The file doesn't contain any rows")
+    
+    if len(rows) > IMPORT_MAX_ROWS:
+        raise ImportFileError(f"The file has {len(rows)} rows; at most {IMPORT_MAX_ROWS} can be imported at once")
+    
+    return rows
+
+def parse_csv_rows(text):
+    rows = []
+    
+    for line, fields in enumerate(csv.reader(io.StringIO(text)), 1):
+        fields = [field.strip() for field in fields]
+        
+        if not any(fields):
+            continue
+        
+        # Skip a header row
+        if line == 1 and len(fields) >= 3 and not fields[2].isdigit():
+            continue
+        
+        fields += [""] * (3 - len(fields))
+        rows.append((line, fields[0], fields[1], fields[2]))
+    
+    return rows
+
+def parse_json_rows(text):
+    try:
+        items = json.loads(text)
+    except ValueError as e:
+        raise ImportFileError(f"The file isn't valid JSON: {e}")
+    
+    if not isinstance(items, list):
+        raise ImportFileError("The JSON file must contain a list of rows")
+    
+    rows = []
+    
+    for line, item in enumerate(items, 1):
+        # Objects with named fields or [main, private, message_id] lists
+        if isinstance(item, dict):
+            fields = [item.get("main_channel"), item.get("private_channel"), item.get("message_id")]
+        elif isinstance(item, list):
+            fields = (item + [None] * 3)[:3]
+        else:
+            fields = [None] * 3
+        
+        rows.append((line, *("" if field is None else str(field).strip() for field in fields)))
+    
+    return rows
+
+# Validate one row
+async def validate_row(client, user_id, row):
+    """Check a row like the /add steps do, returning a result dict with either the link or an error"""
+    line, main_text, private_text, message_id_text = row
+    result = {"line": line}
+    
+    if not message_id_text.isdigit():
+        result["error"] = "message ID must be a number"
+        return result
+    
+    message_id = int(message_id_text)
+    
+    main_channel_id, private_channel_id = await asyncio.gather(
+        resolve_channel_id(client, main_text),
+        resolve_channel_id(client, private_text)
+    )
+    
+    if not main_channel_id:
+        result["error"] = f"couldn't find public channel {main_text or '(empty)'}"
+        return result
+    
+    if not private_channel_id:
+        result["error"] = f"couldn't find private channel {private_text or '(empty)'}"
+        return result
+    
+    try:
+        main_chat = await get_chat(client, main_channel_id)
+    except Exception:
+        main_chat = None
+    
+    if main_chat is not None and not is_broadcast_channel(main_chat):
+        result["error"] = "the public chat must be a channel, not a group"
+        return result
+    
+    if not await is_bot_admin_with_permissions(client, main_channel_id, MAIN_CHANNEL_PRIVILEGES):
+        result["error"] = "the bot needs 'Edit Messages' in the public channel"
+        return result
+    
+    if not await is_bot_admin_with_permissions(client, private_channel_id, PRIVATE_CHANNEL_PRIVILEGES):
+        result["error"] = "the bot needs 'Invite Users' in the private channel"
+        return result
+    
+    # Checked after the bot, whose rights are needed to look up the user's status
+    if not await is_user_admin(client, user_id, main_channel_id) or not await is_user_admin(client, user_id, private_channel_id):
+        result["error"] = "you are not an admin in both channels"
+        return result
+    
+    try:
+        message = await api_call(client, "get_messages", chat_id=main_channel_id, message_ids=message_id)
+        if message is None or getattr(message, "empty", False):
+            raise ValueError("empty message")
+    except Exception:
+        result["error"] = f"message {message_id} not found in the public channel"
+        return result
+    
+    try:
+        main_chat = await get_chat(client, main_channel_id)
+        private_chat = await get_chat(client, private_channel_id)
+    except Exception:
+        main_chat = None
+        private_chat = None
+    
+    result["link"] = {
+        "main_channel_id": main_channel_id,
+        "private_channel_id": private_channel_id,
+        "message_id": message_id,
+        "main_chat": main_chat,
+        "private_chat": private_chat
+    }
+    return result
+
+# Import a parsed file
+async def import_rows(client, user_id, rows, on_checked=None):
+    """Validate rows concurrently and upsert the valid ones in one bulk write, returning per-row results"""
+    semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+    
+    async def validate(row):
+        async with semaphore:
+            try:
+                return await validate_row(client, user_id, row)
+            except Exception as e:
+                logger.error(f"Error validating import row {row[0]} for user {user_id}: {e}")
+                return {"line": row[0], "error": "unexpected error"}
+            finally:
+                if on_checked:
+                    on_checked()
+    
+    results = await asyncio.gather(*(validate(row) for row in rows))
+    
+    # One link per public channel; the first row wins
+    seen = {}
+    links = []
+    for result in results:
+        link = result.get("link")
+        if not link:
+            continue
+        
+        first_line = seen.get(link["main_channel_id"])
+        if first_line is not None:
+            del result["link"]
+            result["error"] = f"public channel already used on line {first_line}"
+            continue
+        
+        seen[link["main_channel_id"]] = result["line"]
+        links.append(link)
+    
+    saved = await import_linked_channels(user_id, links, IMPORT_STAGGER_SECONDS)
+    
+    for result in results:
+        link = result.get("link")
+        if link and link["main_channel_id"] not in saved:
+            del result["link"]
+            result["error"] = "couldn't save to the database"
+    
+    return results
+
+# Build the per-row report
+def format_import_report(results):
+    imported = [result for result in results if result.get("link")]
+    
+    report = f"📥 **Import finished:** {len(imported)} of {len(results)} row(s) linked\n\n"
+    
+    for result in results:
+        link = result.get("link")
+        
+        if link:
+            main_name = getattr(link["main_chat"], "title", None) or link["main_channel_id"]
+            private_name = getattr(link["private_chat"], "title", None) or link["private_channel_id"]
+            report += f"✅ Row {result['line']}: {main_name} → {private_name}\n"
+        else:
+            report += f"❌ Row {result['line']}: {result['error']}\n"
+    
+    if imported:
+        report += f"\nThe first refreshes are spread {IMPORT_STAGGER_SECONDS}s apart. Use /status to follow them."
+    
+    return report
+
+# Running import job by user, so each user has at most one import at a time
+import_jobs = {}
+
+# Background import job
+class ImportJob:
+    """A user's /import run, reporting progress by editing one message"""
+    
+    def __init__(self, user_id, chat_id, message_id, rows):
+        self.job_id = uuid.uuid4().hex[:8]
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.rows = rows
+        self.checked = 0
+        self.results = None
+        self.finished = False
+        self.task = None
+    
+    def row_checked(self):
+        self.checked += 1
+    
+    def keyboard(self):
+        return None
+    
+    def report(self):
+        return format_import_report(self.results)
+    
+    def render(self):
+        """Build the progress text, or the report once it fits in a message"""
+        if not self.finished:
+            return f"🔄 Checking {len(self.rows)} row(s)...\n\nProgress: {self.checked}/{len(self.rows)} row(s)"
+        
+        if self.results is None:
+            return "❌ The import failed. Please try again later."
+        
+        report = self.report()
+        
+        # Long reports go out as a file to stay under the message size limit
+        if len(report) <= 4000:
+            return report
+        
+        return report.split("\n", 1)[0]
+
+# Start an import in the background
+def submit_import_job(client, user_id, message, rows):
+    """Start importing rows, reporting into message, or return the user's running import"""
+    job = import_jobs.get(user_id)
+    if job:
+        return job, False
+    
+    job = ImportJob(user_id, message.chat.id, message.id, rows)
+    import_jobs[user_id] = job
+    
+    job.task = asyncio.create_task(run_import_job(client, job))
+    logger.info(f"Started import job {job.job_id} for user {user_id} with {len(rows)} row(s)")
+    return job, True
+
+# Run an import job
+async def run_import_job(client, job):
+    """Validate and save the job's rows while a reporter edits the progress message"""
+    reporter = asyncio.create_task(report_progress(client, job))
+    
+    try:
+        job.results = await import_rows(client, job.user_id, job.rows, on_checked=job.row_checked)
+    
+    except Exception as e:
+        logger.error(f"Error in import job {job.job_id}: {e}")
+    
+    finally:
+        job.finished = True
+        
+        reporter.cancel()
+        try:
+            await reporter
+        except asyncio.CancelledError:
+            pass
+        
+        await edit_job_message(client, job)
+        
+        if job.results is not None and len(job.report()) > 4000:
+            report_file = io.BytesIO(job.report().replace("**", "").encode("utf-8"))
+            report_file.name = "import_report.txt"
+            
+            try:
+                await api_call(client, "send_document", chat_id=job.chat_id, document=report_file)
+            except Exception as e:
+                logger.error(f"Could not send the report of import job {job.job_id}: {e}")
+        
+        if import_jobs.get(job.user_id) is job:
+            del import_jobs[job.user_id]
+        
+        logger.info(f"Import job {job.job_id} finished: {job.checked} of {len(job.rows)} row(s) checked")
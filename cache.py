@@ -0,0 +1,87 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+# Marker for cache misses, so None can be cached
+MISSING = object()
+
+# TTL + LRU cache
+class TTLCache:
+    """In-memory cache with per-entry expiry and least-recently-used eviction"""
+    
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def get(self, key, default=MISSING):
+        """Get a cached value, or default if it is missing or expired"""
+        entry = self.entries.get(key)
+        
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return default
+        
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+    
+    def set(self, key, value, ttl=None):
+        """Cache a value, evicting the least recently used entries past max_size"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    def delete(self, key):
+        self.entries.pop(key, None)
+    
+    def clear(self):
+        self.entries.clear()
+    
+    def stats(self, reset=False):
+        """Get hit/miss counters and the current size, optionally starting the counters over"""
+        total = self.hits + self.misses
+        stats = {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+        
+        if reset:
+            self.hits = 0
+            self.misses = 0
+        
+        return stats
+
+# Single-flight call coalescing
+class SingleFlight:
+    """Lets concurrent callers with the same key share one in-flight call"""
+    
+    def __init__(self):
+        self.calls = {}
+    
+    def in_flight(self, key):
+        return key in self.calls
+    
+    async def run(self, key, func, *args, **kwargs):
+        """Run func once per key at a time; later callers await the same result"""
+        task = self.calls.get(key)
+        
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        
+        # Shield so one caller's cancellation doesn't cancel the shared call
+        return await asyncio.shield(task)
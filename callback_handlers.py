@@ -1,9 +1,26 @@
+import math
 from pyrogram import Client
 from pyrogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from loguru import logger
 
-from database import get_user_linked_channels, get_channel_by_ids
+from database import get_channel_by_ids, LISTING_FIELDS
 from utils import update_channel_invite_link
+from refresh_jobs import submit_refresh_job, cancel_refresh_job, running_refresh_job
+from chat_cache import get_listing_titles
+from rate_limiter import api_call, user_refresh_quota, channel_refresh_quota
+from state_store import state_store, ConversationState
+from listings import parse_page_callback, render_status_page, render_remove_page
+
+# Manual refreshes share the API budget with scheduled ones, so they are rationed
+def refresh_quota_wait(user_id, main_channel_id=None):
+    """Get the seconds until the user (and channel) may refresh again, or 0"""
+    return max(
+        user_refresh_quota.retry_after(user_id),
+        channel_refresh_quota.retry_after(main_channel_id) if main_channel_id is not None else 0
+    )
+
+async def answer_quota_exceeded(callback_query, wait):
+    await callback_query.answer(f"⏳ Too many refreshes. Try again in {math.ceil(wait)} s.", show_alert=True)
 
 # Main callback query handler
 async def callback_query_handler(client: Client, callback_query: CallbackQuery):
@@ -21,6 +38,12 @@ async def callback_query_handler(client: Client, callback_query: CallbackQuery):
     elif data == "refresh_all":
         await refresh_all_callback(client, callback_query)
     
+    elif data.startswith(("status_next_", "status_prev_", "remove_next_", "remove_prev_")):
+        await page_callback(client, callback_query)
+    
+    elif data.startswith("cancel_job_"):
+        await cancel_job_callback(client, callback_query, data[len("cancel_job_"):])
+    
     elif data.startswith("update_"):
         # Extract channel ID from callback data
         try:
@@ -41,7 +64,8 @@ async def help_callback(client: Client, callback_query: CallbackQuery):
     help_text += "🔹 /help - Show this help message\n"
     help_text += "🔹 /add - Link your public and private channels\n"
     help_text += "🔹 /remove - Unlink previously linked channels\n"
-    help_text += "🔹 /status - Check your linked channels and next update time\n\n"
+    help_text += "🔹 /status - Check your linked channels and next update time\n"
+    help_text += "🔹 /import - Link many channel pairs from a CSV or JSON file\n\n"
     
     help_text += "**Required Permissions:**\n"
     help_text += "For this bot to work properly, it needs to be an admin with these permissions:\n"
@@ -74,14 +98,8 @@ async def add_callback(client: Client, callback_query: CallbackQuery):
     
     user_id = callback_query.from_user.id
     
-    # We need to import this at runtime to avoid circular imports
-    from handlers import user_states
-    
     # Set user state to waiting for main channel
-    user_states[user_id] = {
-        "state": "waiting_main_channel",
-        "data": {}
-    }
+    await state_store.set(user_id, ConversationState("waiting_main_channel"))
     
     instructions = "🔄 **Channel Linking Process**\n\n"
     instructions += "Please follow these steps:\n\n"
@@ -94,64 +112,74 @@ async def add_callback(client: Client, callback_query: CallbackQuery):
 
 # Refresh all callback
 async def refresh_all_callback(client: Client, callback_query: CallbackQuery):
-    """Handle refresh all button callback"""
+    """Handle refresh all button callback by starting a background job"""
     user_id = callback_query.from_user.id
     
-    # Get user's linked channels
-    channels = await get_user_linked_channels(user_id)
+    if running_refresh_job(user_id):
+        await callback_query.answer("A refresh is already running. Please wait for it to finish or cancel it first.", show_alert=True)
+        return
     
-    if not channels:
-        await callback_query.answer("You don't have any linked channels")
-        await callback_query.message.reply("❌ You don't have any linked channels to refresh.")
+    wait = refresh_quota_wait(user_id)
+    if wait > 0:
+        await answer_quota_exceeded(callback_query, wait)
         return
     
     await callback_query.answer("Refreshing all your linked channels...")
     
-    # Update message to show progress
-    await callback_query.message.reply(
-        f"🔄 **Refreshing invite links...**\n\n"
-        f"Please wait while I update {len(channels)} channel(s)."
-    )
+    # The job reports its progress by editing this message
+    progress_message = await callback_query.message.reply("🔄 **Refreshing invite links...**")
     
-    # Process each channel
-    success_count = 0
-    error_count = 0
+    job, started = submit_refresh_job(client, user_id, progress_message)
     
-    for channel in channels:
-        try:
-            # Extract channel data
-            main_channel_id = channel["main_channel_id"]
-            private_channel_id = channel["private_channel_id"]
-            message_id = channel["message_id"]
-            
-            # Update invite link
-            success = await update_channel_invite_link(
-                client,
-                user_id,
-                main_channel_id,
-                private_channel_id,
-                message_id
-            )
-            
-            if success:
-                success_count += 1
-            else:
-                error_count += 1
-        
-        except Exception as e:
-            logger.error(f"Error refreshing channel: {e}")
-            error_count += 1
+    # Only a job that actually started uses up quota (channels are charged as the job reaches them)
+    if started:
+        user_refresh_quota.hit(user_id)
+
+# Cancel job callback
+async def cancel_job_callback(client: Client, callback_query: CallbackQuery, job_id):
+    """Handle the cancel button of a running refresh job"""
+    if cancel_refresh_job(job_id, callback_query.from_user.id):
+        await callback_query.answer("Cancelling refresh...")
+    else:
+        await callback_query.answer("This refresh is no longer running")
+
+# Listing page callback
+async def page_callback(client: Client, callback_query: CallbackQuery):
+    """Handle the prev/next buttons of /status and /remove"""
+    user_id = callback_query.from_user.id
+    parsed = parse_page_callback(callback_query.data)
     
-    # Update message with results
-    result_text = f"✅ **Refresh Complete**\n\n"
-    result_text += f"Successfully updated: {success_count} channel(s)\n"
+    if parsed is None:
+        await callback_query.answer("Invalid callback data")
+        return
+    
+    listing, after, before = parsed
     
-    if error_count > 0:
-        result_text += f"Failed to update: {error_count} channel(s)\n"
+    if listing == "remove":
+        page = await render_remove_page(client, user_id, after, before)
+    else:
+        page = await render_status_page(client, user_id, after, before)
     
-    result_text += "\nUse /status to see the updated information."
+    if page is None:
+        await callback_query.answer("No more linked channels")
+        return
     
-    await callback_query.message.reply(result_text)
+    await callback_query.answer()
+    
+    # Numbers sent for /remove refer to the page on screen
+    if listing == "remove":
+        page, channel_ids = page[:2], page[2]
+        await state_store.set(user_id, ConversationState("waiting_remove_selection", channel_ids=channel_ids))
+    
+    response, keyboard = page
+    await api_call(
+        client,
+        "edit_message_text",
+        chat_id=callback_query.message.chat.id,
+        message_id=callback_query.message.id,
+        text=response,
+        reply_markup=keyboard
+    )
 
 # Update single callback
 async def update_single_callback(client: Client, callback_query: CallbackQuery, main_channel_id):
@@ -159,13 +187,22 @@ async def update_single_callback(client: Client, callback_query: CallbackQuery,
     user_id = callback_query.from_user.id
     
     # Get channel data
-    channel = await get_channel_by_ids(user_id, main_channel_id)
+    channel = await get_channel_by_ids(user_id, main_channel_id, LISTING_FIELDS)
     
     if not channel:
         await callback_query.answer("Channel not found or you don't have permission")
         await callback_query.message.reply("❌ Channel not found.")
         return
     
+    # Charged only once the user is known to own the link
+    wait = refresh_quota_wait(user_id, main_channel_id)
+    if wait > 0:
+        await answer_quota_exceeded(callback_query, wait)
+        return
+    
+    user_refresh_quota.hit(user_id)
+    channel_refresh_quota.hit(main_channel_id)
+    
     await callback_query.answer("Refreshing invite link...")
     
     # Update message to show progress
@@ -189,16 +226,10 @@ async def update_single_callback(client: Client, callback_query: CallbackQuery,
         )
         
         if success:
-            # Try to get channel names
-            try:
-                main_chat = await client.get_chat(main_channel_id)
-                private_chat = await client.get_chat(private_channel_id)
-                
-                main_name = main_chat.title or f"Channel {main_channel_id}"
-                private_name = private_chat.title or f"Channel {private_channel_id}"
-            except Exception:
-                main_name = f"Channel {main_channel_id}"
-                private_name = f"Channel {private_channel_id}"
+            # Use the stored channel names, looking up only missing ones
+            titles = await get_listing_titles(client, [channel])
+            main_name = titles.get(main_channel_id, f"Channel {main_channel_id}")
+            private_name = titles.get(private_channel_id, f"Channel {private_channel_id}")
             
             # Update message with results
             result_text = f"✅ **Invite Link Updated Successfully**\n\n"
@@ -0,0 +1,115 @@
+import asyncio
+from loguru import logger
+
+from cache import TTLCache, SingleFlight, MISSING
+from rate_limiter import api_call
+from database import store_chat_info
+from config import CHAT_CACHE_SIZE, CHAT_CACHE_TTL_SECONDS, TITLE_LOOKUP_CONCURRENCY, TITLE_LOOKUP_TIMEOUT
+
+# Chat metadata cache
+chat_cache = TTLCache(CHAT_CACHE_SIZE, CHAT_CACHE_TTL_SECONDS)
+
+# Concurrent lookups of the same chat share one get_chat call
+chat_lookups = SingleFlight()
+
+# Get chat metadata through the cache
+async def get_chat(client, chat_id):
+    """Get a chat, calling Telegram only on a cache miss"""
+    chat = chat_cache.get(chat_id)
+    if chat is not MISSING:
+        return chat
+    
+    return await chat_lookups.run(chat_id, fetch_chat, client, chat_id)
+
+async def fetch_chat(client, chat_id):
+    chat = await api_call(client, "get_chat", chat_id=chat_id)
+    remember_chat(chat)
+    return chat
+
+# Store a chat we already have
+def remember_chat(chat):
+    """Put a chat object into the cache under its ID"""
+    if chat is not None and getattr(chat, "id", None) is not None:
+        chat_cache.set(chat.id, chat)
+
+# Drop a chat from the cache
+def forget_chat(chat_id):
+    chat_cache.delete(chat_id)
+
+# Report cache effectiveness
+async def report_chat_cache():
+    """Log the chat cache hit rate since the last report"""
+    stats = chat_cache.stats(reset=True)
+    
+    if stats["hits"] or stats["misses"]:
+        logger.info(
+            f"Chat cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+            f"{stats['size']} chats cached"
+        )
+
+# Lookups that missed a listing deadline, kept referenced until they finish
+background_lookups = set()
+
+def finish_background_lookup(task):
+    background_lookups.discard(task)
+    
+    # Retrieve the outcome so failures aren't reported as unhandled
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Background chat lookup failed: {task.exception()}")
+
+# Get many chats at once
+async def get_chats(client, chat_ids, timeout=TITLE_LOOKUP_TIMEOUT, concurrency=TITLE_LOOKUP_CONCURRENCY):
+    """Look up chats concurrently, leaving out any that fail or miss the deadline"""
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def lookup(chat_id):
+        async with semaphore:
+            return await get_chat(client, chat_id)
+    
+    tasks = {chat_id: asyncio.ensure_future(lookup(chat_id)) for chat_id in dict.fromkeys(chat_ids)}
+    
+    if not tasks:
+        return {}
+    
+    done, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+    
+    # Late and still-queued lookups finish in the background and warm the cache
+    for task in pending:
+        background_lookups.add(task)
+        task.add_done_callback(finish_background_lookup)
+    
+    chats = {}
+    for chat_id, task in tasks.items():
+        if task in done and not task.cancelled() and task.exception() is None and task.result():
+            chats[chat_id] = task.result()
+    
+    if pending:
+        logger.debug(f"{len(pending)} of {len(tasks)} chat lookups missed the {timeout}s deadline")
+    
+    return chats
+
+# Get titles for a channel listing
+async def get_listing_titles(client, channels):
+    """Use the titles stored with each link, looking up (and storing) only the missing ones"""
+    titles = {}
+    missing = []
+    
+    for channel in channels:
+        for role in ("main_channel", "private_channel"):
+            chat_id = channel[f"{role}_id"]
+            title = channel.get(f"{role}_title")
+            
+            if title:
+                titles[chat_id] = title
+            else:
+                missing.append(chat_id)
+    
+    if missing:
+        chats = await get_chats(client, missing)
+        
+        for chat_id, chat in chats.items():
+            if chat.title:
+                titles[chat_id] = chat.title
+                store_chat_info(chat)
+    
+    return titles
@@ -1,5 +1,6 @@
 import os
 import sys
+import socket
 from loguru import logger
 from dotenv import load_dotenv
 
@@ -9,8 +10,122 @@ load_dotenv()
 # Link update configuration
 UPDATE_INTERVAL_HOURS = 6
 
+# Number of concurrent workers refreshing due links
+REFRESH_WORKERS = int(os.getenv("REFRESH_WORKERS", "5"))
+
+# Pyrogram update workers and per-user dispatch workers running handlers
+PYROGRAM_WORKERS = int(os.getenv("PYROGRAM_WORKERS", "8"))
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "16"))
+
+# Manual refreshes allowed per user and per channel in any sliding window of this many seconds
+MANUAL_USER_QUOTA = int(os.getenv("MANUAL_USER_QUOTA", "10"))
+MANUAL_CHANNEL_QUOTA = int(os.getenv("MANUAL_CHANNEL_QUOTA", "3"))
+MANUAL_QUOTA_WINDOW_SECONDS = int(os.getenv("MANUAL_QUOTA_WINDOW_SECONDS", "3600"))
+
+# Manual "Refresh Now" jobs (concurrent refreshes per job and seconds between progress edits)
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "3"))
+JOB_PROGRESS_SECONDS = 3
+
+# Deadlines are spread over this many minutes before the interval ends
+SCHEDULE_JITTER_MINUTES = int(os.getenv("SCHEDULE_JITTER_MINUTES", "60"))
+
+# Target number of link refreshes per minute
+SCHEDULE_MINUTE_CAPACITY = int(os.getenv("SCHEDULE_MINUTE_CAPACITY", "20"))
+
+# Telegram user IDs allowed to run maintenance commands
+OWNER_IDS = [int(owner_id) for owner_id in os.getenv("OWNER_IDS", "").split(",") if owner_id.strip()]
+
+# Identity of this bot instance when several share one database
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Seconds a claimed link stays reserved for the instance refreshing it
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", "300"))
+
+# Minutes between sweeps for due links this instance has not scheduled
+RECONCILE_MINUTES = int(os.getenv("RECONCILE_MINUTES", "15"))
+
+# Minutes to wait before retrying a link whose refresh failed (doubles per failure)
+FAILED_RETRY_MINUTES = 5
+
+# Consecutive failures before a link is quarantined, and how often it is probed then
+QUARANTINE_AFTER_FAILURES = int(os.getenv("QUARANTINE_AFTER_FAILURES", "5"))
+QUARANTINE_PROBE_HOURS = int(os.getenv("QUARANTINE_PROBE_HOURS", "24"))
+
+# Background revocation of replaced invite links
+REVOKE_WORKERS = int(os.getenv("REVOKE_WORKERS", "2"))
+REVOKE_RATE = float(os.getenv("REVOKE_RATE", "5"))
+REVOKE_MAX_ATTEMPTS = 10
+REVOKE_POLL_SECONDS = 5
+
+# Chat metadata cache (entries and seconds before a title is fetched again)
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "5000"))
+CHAT_CACHE_TTL_SECONDS = int(os.getenv("CHAT_CACHE_TTL_SECONDS", "3600"))
+
+# Channel inputs that failed to resolve are not retried for this long
+NEGATIVE_CACHE_SIZE = 10000
+NEGATIVE_CACHE_TTL_SECONDS = int(os.getenv("NEGATIVE_CACHE_TTL_SECONDS", "300"))
+
+# Conversation state storage ("memory" or "mongo"), minutes before an abandoned step expires
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_TTL_MINUTES = int(os.getenv("STATE_TTL_MINUTES", "30"))
+STATE_CACHE_SIZE = 10000
+
+# Chat member snapshots used for permission checks (entries and seconds before rechecking)
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", "10000"))
+MEMBER_CACHE_TTL_SECONDS = int(os.getenv("MEMBER_CACHE_TTL_SECONDS", "600"))
+
+# Invite hashes kept in memory in front of the invite hash index
+INVITE_HASH_CACHE_SIZE = 10000
+
+# Resolved usernames shared through the database (hours before re-resolving)
+USERNAME_CACHE_TTL_HOURS = int(os.getenv("USERNAME_CACHE_TTL_HOURS", "24"))
+USERNAME_CACHE_SIZE = 2000
+
+# /import limits (rows per file, rows validated at once, seconds between first refreshes, file size in bytes)
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "500"))
+IMPORT_CONCURRENCY = int(os.getenv("IMPORT_CONCURRENCY", "5"))
+IMPORT_STAGGER_SECONDS = int(os.getenv("IMPORT_STAGGER_SECONDS", "30"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", "1048576"))
+
+# Links shown per page of /status and /remove
+LISTING_PAGE_SIZE = 10
+
+# Concurrent title lookups per listing and seconds before falling back to IDs
+TITLE_LOOKUP_CONCURRENCY = int(os.getenv("TITLE_LOOKUP_CONCURRENCY", "10"))
+TITLE_LOOKUP_TIMEOUT = float(os.getenv("TITLE_LOOKUP_TIMEOUT", "3"))
+
+# Telegram API rate limits (calls per second and burst size)
+API_METHOD_RATE = float(os.getenv("API_METHOD_RATE", "20"))
+API_METHOD_BURST = int(os.getenv("API_METHOD_BURST", "20"))
+API_CHAT_RATE = float(os.getenv("API_CHAT_RATE", "1"))
+API_CHAT_BURST = int(os.getenv("API_CHAT_BURST", "3"))
+
+# Number of times a call is retried after a FloodWait
+API_FLOOD_RETRIES = 2
+
+# Longest FloodWait (seconds) a call sleeps through; longer waits pause the bucket and fail the call
+API_FLOOD_MAX_WAIT = int(os.getenv("API_FLOOD_MAX_WAIT", "30"))
+
 # MongoDB collections
 COLLECTION_CHANNELS = "linked_channels"
+COLLECTION_MIGRATIONS = "schema_migrations"
+COLLECTION_REVOCATIONS = "pending_revocations"
+COLLECTION_INVITE_HASHES = "invite_hashes"
+COLLECTION_USERNAMES = "resolved_usernames"
+COLLECTION_STATES = "conversation_states"
+
+# Days an invite hash stays in the lookup index
+INVITE_HASH_TTL_DAYS = 30
+
+# Number of documents fetched per cursor batch
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "500"))
+
+# Buffered refresh results are written once this many queue up or after this many seconds
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_FLUSH_SECONDS = float(os.getenv("WRITE_FLUSH_SECONDS", "2"))
+
+# Writes a refresh waits on are flushed together after at most this many seconds
+WRITE_COMMIT_SECONDS = float(os.getenv("WRITE_COMMIT_SECONDS", "0.05"))
 
 # Setup logging configuration
 def setup_logging():
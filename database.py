@@ -1,13 +1,189 @@
 import os
+import asyncio
 import motor.motor_asyncio
-from pymongo.errors import ConnectionFailure
+from pymongo import ASCENDING, ReturnDocument, UpdateOne, UpdateMany, DeleteOne
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
 from loguru import logger
-from config import COLLECTION_CHANNELS
+from config import COLLECTION_CHANNELS, COLLECTION_MIGRATIONS, COLLECTION_REVOCATIONS, DB_BATCH_SIZE
+from config import COLLECTION_STATES, COLLECTION_INVITE_HASHES, INVITE_HASH_TTL_DAYS, COLLECTION_USERNAMES, USERNAME_CACHE_TTL_HOURS, INSTANCE_ID, LEASE_SECONDS
+from config import LISTING_PAGE_SIZE, WRITE_BATCH_SIZE, WRITE_FLUSH_SECONDS, WRITE_COMMIT_SECONDS, REVOKE_MAX_ATTEMPTS, QUARANTINE_AFTER_FAILURES
+from deadline_queue import deadline_queue
+from schedule_policy import pick_next_update_time, spread_deadlines, failure_backoff
 
 # MongoDB client
 client = None
 db = None
 
+# Fields the scheduler needs to refresh a link
+REFRESH_FIELDS = {
+    "_id": 0,
+    "user_id": 1,
+    "main_channel_id": 1,
+    "private_channel_id": 1,
+    "message_id": 1,
+    "current_invite_link": 1,
+    "pending_invite_links": 1,
+    "next_update_time": 1,
+    "failure_count": 1,
+    "lease_token": 1,
+    "lease_expires_at": 1
+}
+
+# Fields shown in channel listings
+LISTING_FIELDS = {
+    "_id": 0,
+    "user_id": 1,
+    "main_channel_id": 1,
+    "private_channel_id": 1,
+    "message_id": 1,
+    "last_update_time": 1,
+    "next_update_time": 1,
+    "main_channel_title": 1,
+    "private_channel_title": 1
+}
+
+# Fields for a page of a listing, with _id as the page cursor
+PAGE_FIELDS = {**LISTING_FIELDS, "_id": 1}
+
+# Fields that make up a refresh lease
+LEASE_FIELDS = {"lease_owner": "", "lease_expires_at": "", "lease_token": ""}
+
+# Fields tracking consecutive refresh failures
+FAILURE_FIELDS = {"failure_count": "", "last_error": "", "quarantined": "", "quarantined_at": ""}
+
+# Links are paused while the bot lacks admin rights in any chat listed in paused_chats
+NOT_PAUSED = {"paused_chats.0": {"$exists": False}}
+
+# State a (re)linked pair starts over without: its chats were just checked, so no pause, failures or lease
+RELINK_FIELDS = {"paused_chats": "", "paused_at": "", **FAILURE_FIELDS, **LEASE_FIELDS}
+
+# Write error codes worth retrying on the next flush
+RETRYABLE_WRITE_ERRORS = {112, 11600, 11602, 189, 91}
+
+# Write-behind buffer
+class WriteBuffer:
+    """Collects write operations per collection and flushes them with bulk_write"""
+    
+    def __init__(self, max_size, max_delay, commit_delay):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.commit_delay = commit_delay
+        self.operations = {}
+        self.size = 0
+        self.lock = asyncio.Lock()
+        self.timer = None
+        self.commit_timer = None
+        self.tasks = set()
+        self.failed = 0
+    
+    def add(self, collection, operation, future=None):
+        """Queue a write; it is flushed on the size or time threshold"""
+        self.operations.setdefault(collection, []).append((operation, future))
+        self.size += 1
+        
+        if self.size >= self.max_size:
+            self._spawn(self.flush())
+        else:
+            self._arm()
+    
+    async def commit(self, collection, operation):
+        """Queue a write and wait for its flush, returning whether it was written.
+        Writes committed within commit_delay of each other share one bulk_write"""
+        future = asyncio.get_running_loop().create_future()
+        self.add(collection, operation, future)
+        
+        if self.commit_timer is None:
+            self.commit_timer = self._spawn(self._commit_later())
+        
+        return await future
+    
+    def _spawn(self, coroutine):
+        # Keep a reference so the task isn't garbage-collected mid-flight
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+    
+    def _arm(self):
+        if self.timer is None:
+            self.timer = self._spawn(self._flush_later())
+    
+    def _requeue(self, collection, batch):
+        self.operations.setdefault(collection, [])[:0] = batch
+        self.size += len(batch)
+    
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        self.timer = None
+        await self.flush()
+    
+    async def _commit_later(self):
+        await asyncio.sleep(self.commit_delay)
+        self.commit_timer = None
+        await self.flush()
+    
+    async def flush(self):
+        """Write every queued operation, one bulk_write per collection"""
+        async with self.lock:
+            operations = self.operations
+            self.operations = {}
+            self.size = 0
+            
+            for collection, batch in operations.items():
+                failed = set()
+                
+                try:
+                    result = await db[collection].bulk_write([operation for operation, _ in batch], ordered=False)
+                    logger.debug(f"Flushed {len(batch)} writes to {collection} ({result.modified_count} modified)")
+                
+                except BulkWriteError as e:
+                    # Retry transient failures; report every other failed operation
+                    retry = []
+                    for error in e.details.get("writeErrors", []):
+                        operation, future = batch[error["index"]]
+                        failed.add(error["index"])
+                        
+                        # Committed writes are never retried behind their waiter's back
+                        if future is None and error.get("code") in RETRYABLE_WRITE_ERRORS:
+                            retry.append((operation, future))
+                        else:
+                            self.failed += 1
+                            logger.error(f"Buffered write to {collection} failed ({error.get('code')}: {error.get('errmsg')}): {operation}")
+                    
+                    if retry:
+                        logger.warning(f"Retrying {len(retry)} buffered writes to {collection} on the next flush")
+                        self._requeue(collection, retry)
+                
+                except Exception as e:
+                    # Keep the writes for the next flush, failing the committed ones
+                    logger.error(f"Error flushing {len(batch)} writes to {collection}: {e}")
+                    failed = set(range(len(batch)))
+                    self._requeue(collection, [entry for entry in batch if entry[1] is None])
+                
+                for index, (_, future) in enumerate(batch):
+                    if future is not None and not future.done():
+                        future.set_result(index not in failed)
+            
+            # Writes put back for a retry need a timer of their own
+            if self.size:
+                self._arm()
+
+# Global write-behind buffer instance
+write_buffer = WriteBuffer(WRITE_BATCH_SIZE, WRITE_FLUSH_SECONDS, WRITE_COMMIT_SECONDS)
+
+# Flush buffered writes
+async def flush_writes():
+    """Flush every buffered write, used on shutdown"""
+    if db is None:
+        return
+    
+    if write_buffer.timer:
+        write_buffer.timer.cancel()
+        write_buffer.timer = None
+    
+    await write_buffer.flush()
+
 # Initialize database connection
 async def init_db():
     global client, db
@@ -51,6 +227,64 @@ async def init_db():
         logger.error(f"Error initializing database: {e}")
         raise
 
+# Managed index definitions
+INDEXES = [
+    {
+        "collection": COLLECTION_CHANNELS,
+        "keys": [("user_id", ASCENDING), ("main_channel_id", ASCENDING)],
+        "name": "user_id_main_channel_id",
+        "options": {"unique": True}
+    },
+    {
+        "collection": COLLECTION_CHANNELS,
+        "keys": [("user_id", ASCENDING), ("_id", ASCENDING)],
+        "name": "user_id__id",
+        "options": {}
+    },
+    {
+        "collection": COLLECTION_CHANNELS,
+        "keys": [("next_update_time", ASCENDING)],
+        "name": "next_update_time",
+        "options": {}
+    },
+    {
+        "collection": COLLECTION_CHANNELS,
+        "keys": [("main_channel_id", ASCENDING)],
+        "name": "main_channel_id",
+        "options": {}
+    },
+    {
+        "collection": COLLECTION_CHANNELS,
+        "keys": [("private_channel_id", ASCENDING)],
+        "name": "private_channel_id",
+        "options": {}
+    },
+    {
+        "collection": COLLECTION_REVOCATIONS,
+        "keys": [("next_attempt_at", ASCENDING)],
+        "name": "next_attempt_at",
+        "options": {}
+    },
+    {
+        "collection": COLLECTION_INVITE_HASHES,
+        "keys": [("created_at", ASCENDING)],
+        "name": "created_at_ttl",
+        "options": {"expireAfterSeconds": INVITE_HASH_TTL_DAYS * 24 * 3600}
+    },
+    {
+        "collection": COLLECTION_USERNAMES,
+        "keys": [("resolved_at", ASCENDING)],
+        "name": "resolved_at_ttl",
+        "options": {"expireAfterSeconds": USERNAME_CACHE_TTL_HOURS * 3600}
+    },
+    {
+        "collection": COLLECTION_STATES,
+        "keys": [("expires_at", ASCENDING)],
+        "name": "expires_at_ttl",
+        "options": {"expireAfterSeconds": 0}
+    }
+]
+
 # Create database indexes
 async def create_indexes():
     try:
@@ -64,26 +298,157 @@ async def create_indexes():
             await db.create_collection(COLLECTION_CHANNELS)
             logger.info(f"Created collection {COLLECTION_CHANNELS}")
         
-        # Skip index creation for now - we'll let MongoDB create them automatically
-        # This avoids potential issues with index creation
-        logger.info("Skipping explicit index creation to avoid potential issues")
-        return
+        # Apply data migrations the indexes depend on
+        await run_migrations()
+        
+        for index in INDEXES:
+            await ensure_index(index)
+        
+        # Warn if the hot queries are not backed by an index
+        await check_query_plans()
         
     except Exception as e:
         logger.error(f"Error setting up database collections: {e}")
         # Continue execution even if collection setup fails
         # The application can still function without explicit collections
 
+async def ensure_index(index):
+    """Create a managed index, rebuilding it if an older definition conflicts"""
+    collection = db[index["collection"]]
+    
+    try:
+        await collection.create_index(index["keys"], name=index["name"], background=True, **index["options"])
+    
+    except OperationFailure as e:
+        # IndexOptionsConflict / IndexKeySpecsConflict: replace the old definition
+        if e.code not in (85, 86):
+            logger.error(f"Error creating index {index['name']} on {index['collection']}: {e}")
+            return
+        
+        logger.warning(f"Index {index['name']} on {index['collection']} changed, rebuilding it")
+        
+        try:
+            # The old definition may use the same name or the same keys under another name
+            existing = await collection.index_information()
+            keys = [tuple(key) for key in index["keys"]]
+            
+            for name, info in existing.items():
+                if name != "_id_" and (name == index["name"] or [tuple(key) for key in info["key"]] == keys):
+                    await collection.drop_index(name)
+            
+            await collection.create_index(index["keys"], name=index["name"], background=True, **index["options"])
+        
+        except OperationFailure as e:
+            logger.error(f"Error rebuilding index {index['name']} on {index['collection']}: {e}")
+            return
+    
+    logger.debug(f"Index {index['name']} on {index['collection']} is in place")
+
+# Migrations
+async def migrate_remove_duplicate_links():
+    """Keep only the newest document per (user_id, main_channel_id) before the unique index"""
+    pipeline = [
+        {"$sort": {"updated_at": -1}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "main_channel_id": "$main_channel_id"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    
+    removed = 0
+    async for group in db[COLLECTION_CHANNELS].aggregate(pipeline, allowDiskUse=True):
+        result = await db[COLLECTION_CHANNELS].delete_many({"_id": {"$in": group["ids"][1:]}})
+        removed += result.deleted_count
+    
+    if removed:
+        logger.warning(f"Removed {removed} duplicate linked channel documents")
+
+MIGRATIONS = [
+    ("0001_remove_duplicate_links", migrate_remove_duplicate_links)
+]
+
+async def run_migrations():
+    """Run every migration that has not been recorded as applied yet"""
+    applied = {
+        migration["_id"]
+        async for migration in db[COLLECTION_MIGRATIONS].find({}, {"_id": 1})
+    }
+    
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        
+        logger.info(f"Running database migration {name}")
+        await migration()
+        
+        from datetime import datetime
+        await db[COLLECTION_MIGRATIONS].update_one(
+            {"_id": name},
+            {"$set": {"applied_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+# Hot queries that must be served by an index
+def hot_queries():
+    from datetime import datetime
+    return [
+        (COLLECTION_CHANNELS, {"next_update_time": {"$lte": datetime.utcnow()}}),
+        (COLLECTION_CHANNELS, {"user_id": 0, "main_channel_id": 0}),
+        (COLLECTION_CHANNELS, {"user_id": 0}),
+        (COLLECTION_CHANNELS, {"user_id": 0, "_id": {"$gt": ObjectId()}}),
+        (COLLECTION_CHANNELS, {"main_channel_id": 0}),
+        (COLLECTION_CHANNELS, {"private_channel_id": 0})
+    ]
+
+def plan_stages(plan):
+    """Collect every stage name in an explain() plan tree"""
+    stages = [plan.get("stage")]
+    for child_key in ("inputStage", "inputStages", "queryPlan"):
+        child = plan.get(child_key)
+        if isinstance(child, dict):
+            stages.extend(plan_stages(child))
+        elif isinstance(child, list):
+            for item in child:
+                stages.extend(plan_stages(item))
+    return stages
+
+async def check_query_plans():
+    """Warn when a hot query would scan the whole collection"""
+    for collection_name, query in hot_queries():
+        try:
+            explanation = await db[collection_name].find(query).explain()
+            winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+            
+            if "COLLSCAN" in plan_stages(winning_plan):
+                logger.warning(f"Query {query} on {collection_name} is not index-backed (COLLSCAN)")
+            else:
+                logger.debug(f"Query {query} on {collection_name} uses an index")
+        
+        except Exception as e:
+            logger.warning(f"Could not explain query {query} on {collection_name}: {e}")
+
 # Channel operations
-async def add_linked_channels(user_id, main_channel_id, private_channel_id, message_id):
+# Stored title and username fields of a chat in a given role
+def chat_fields(role, chat):
+    if chat is None:
+        return {}
+    
+    return {
+        f"{role}_title": getattr(chat, "title", None),
+        f"{role}_username": getattr(chat, "username", None)
+    }
+
+async def add_linked_channels(user_id, main_channel_id, private_channel_id, message_id, main_chat=None, private_chat=None):
     """Add or update linked channels for a user"""
     try:
         # Current timestamp
-        from datetime import datetime, timedelta
+        from datetime import datetime
         now = datetime.utcnow()
         
-        # Calculate next update time (6 hours from now)
-        next_update = now + timedelta(hours=6)
+        # Calculate next update time (spread over the last part of the interval)
+        next_update = pick_next_update_time(now)
         
         # Prepare document
         document = {
@@ -95,16 +460,22 @@ async def add_linked_channels(user_id, main_channel_id, private_channel_id, mess
             "last_update_time": now,
             "next_update_time": next_update,
             "created_at": now,
-            "updated_at": now
+            "updated_at": now,
+            # Denormalized so listings don't need Telegram calls
+            **chat_fields("main_channel", main_chat),
+            **chat_fields("private_channel", private_chat)
         }
         
         # Insert or update document
         result = await db[COLLECTION_CHANNELS].update_one(
             {"user_id": user_id, "main_channel_id": main_channel_id},
-            {"$set": document},
+            {"$set": document, "$unset": RELINK_FIELDS},
             upsert=True
         )
         
+        # Keep the in-process schedule in sync
+        deadline_queue.schedule((user_id, main_channel_id), next_update)
+        
         logger.info(f"Linked channels added/updated for user {user_id}")
         return True
     
@@ -112,6 +483,123 @@ async def add_linked_channels(user_id, main_channel_id, private_channel_id, mess
         logger.error(f"Error adding linked channels: {e}")
         return False
 
+async def import_linked_channels(user_id, links, stagger_seconds):
+    """Upsert many linked channels with one bulk write, returning the main channel ids that were saved"""
+    if not links:
+        return set()
+    
+    try:
+        from datetime import datetime, timedelta
+        now = datetime.utcnow()
+        
+        keys = [(user_id, link["main_channel_id"]) for link in links]
+        deadlines = spread_deadlines(keys, now, timedelta(seconds=stagger_seconds * len(keys)))
+        
+        # Links already stored keep their invite link and schedule unless they now point elsewhere
+        existing = {}
+        cursor = db[COLLECTION_CHANNELS].find(
+            {"user_id": user_id, "main_channel_id": {"$in": [link["main_channel_id"] for link in links]}},
+            {
+                "main_channel_id": 1,
+                "private_channel_id": 1,
+                "message_id": 1,
+                "current_invite_link": 1,
+                "pending_invite_links": 1,
+                "paused_chats": 1,
+                "quarantined": 1
+            }
+        )
+        async for document in cursor:
+            existing[document["main_channel_id"]] = document
+        
+        operations = []
+        imported = []
+        for link, (key, next_update) in zip(links, deadlines):
+            fields = {
+                "private_channel_id": link["private_channel_id"],
+                "message_id": link["message_id"],
+                "updated_at": now,
+                **chat_fields("main_channel", link.get("main_chat")),
+                **chat_fields("private_channel", link.get("private_chat"))
+            }
+            first_run = {
+                "current_invite_link": None,  # Will be set during first update
+                "last_update_time": now,
+                "next_update_time": next_update,
+                "created_at": now
+            }
+            
+            stored = existing.get(link["main_channel_id"])
+            reschedule = stored is None
+            unset = dict(RELINK_FIELDS)
+            
+            if stored is not None and stored.get("private_channel_id") != link["private_channel_id"]:
+                # The old links belong to another private channel; keep them valid until the replacement is published
+                old_links = [stored.get("current_invite_link"), *(stored.get("pending_invite_links") or [])]
+                delay = (next_update - now).total_seconds() + LEASE_SECONDS
+                
+                queued = [
+                    await enqueue_revocation(stored["private_channel_id"], old_link, delay_seconds=delay)
+                    for old_link in old_links if old_link
+                ]
+                if not all(queued):
+                    continue
+                
+                fields["current_invite_link"] = None
+                del first_run["current_invite_link"]
+                unset["pending_invite_links"] = ""
+                reschedule = True
+            
+            elif stored is not None and stored.get("message_id") != link["message_id"]:
+                # Same private channel, so the next rotation revokes the current link as usual
+                reschedule = True
+            
+            elif stored is not None and (stored.get("paused_chats") or stored.get("quarantined")):
+                # Paused and quarantined links are off the schedule until now
+                reschedule = True
+            
+            if stored is not None and reschedule:
+                # Publish into the new target on the staggered deadline instead of the old schedule
+                fields["next_update_time"] = next_update
+                del first_run["next_update_time"]
+            
+            operations.append(
+                UpdateOne(
+                    {"user_id": user_id, "main_channel_id": link["main_channel_id"]},
+                    {"$set": fields, "$setOnInsert": first_run, "$unset": unset},
+                    upsert=True
+                )
+            )
+            imported.append((key, next_update, reschedule))
+        
+        failed = set()
+        try:
+            if operations:
+                await db[COLLECTION_CHANNELS].bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Unordered, so every operation without a write error went through
+            for error in e.details.get("writeErrors", []):
+                failed.add(error["index"])
+                logger.error(f"Error importing linked channel {imported[error['index']][0]} ({error.get('code')}: {error.get('errmsg')})")
+        
+        saved = set()
+        for index, (key, next_update, reschedule) in enumerate(imported):
+            if index in failed:
+                continue
+            
+            saved.add(key[1])
+            
+            # Keep the in-process schedule in sync
+            if reschedule:
+                deadline_queue.schedule(key, next_update)
+        
+        logger.info(f"Imported {len(saved)} of {len(links)} linked channels for user {user_id}")
+        return saved
+    
+    except Exception as e:
+        logger.error(f"Error importing linked channels: {e}")
+        return set()
+
 async def remove_linked_channels(user_id, main_channel_id):
     """Remove linked channels for a user"""
     try:
@@ -119,6 +607,9 @@ async def remove_linked_channels(user_id, main_channel_id):
             {"user_id": user_id, "main_channel_id": main_channel_id}
         )
         
+        # Keep the in-process schedule in sync
+        deadline_queue.remove((user_id, main_channel_id))
+        
         if result.deleted_count > 0:
             logger.info(f"Linked channels removed for user {user_id}")
             return True
@@ -130,22 +621,55 @@ async def remove_linked_channels(user_id, main_channel_id):
         logger.error(f"Error removing linked channels: {e}")
         return False
 
-async def get_user_linked_channels(user_id):
-    """Get all linked channels for a user"""
+async def iter_user_linked_channels(user_id, batch_size=DB_BATCH_SIZE, projection=LISTING_FIELDS):
+    """Stream the linked channels of a user in batches"""
     try:
-        cursor = db[COLLECTION_CHANNELS].find({"user_id": user_id})
-        channels = await cursor.to_list(length=None)
-        return channels
+        cursor = db[COLLECTION_CHANNELS].find({"user_id": user_id}, projection).batch_size(batch_size)
+        async for channel in cursor:
+            yield channel
     
     except Exception as e:
-        logger.error(f"Error getting linked channels for user {user_id}: {e}")
-        return []
+        # Re-raise so callers never mistake a cut-off stream for the full list
+        logger.error(f"Error streaming linked channels for user {user_id}: {e}")
+        raise
+
+async def get_user_links_page(user_id, after=None, before=None, limit=LISTING_PAGE_SIZE):
+    """Get one page of a user's links by _id range, returning (channels, has_prev, has_next)"""
+    try:
+        query = {"user_id": user_id}
+        
+        # Walk backwards from the first link of the current page for "prev"
+        if before is not None:
+            query["_id"] = {"$lt": before}
+            direction = -1
+        else:
+            if after is not None:
+                query["_id"] = {"$gt": after}
+            direction = 1
+        
+        # One extra document tells whether there is another page in this direction
+        cursor = db[COLLECTION_CHANNELS].find(query, PAGE_FIELDS).sort("_id", direction).limit(limit + 1)
+        channels = await cursor.to_list(length=limit + 1)
+        
+        more = len(channels) > limit
+        channels = channels[:limit]
+        
+        if direction == -1:
+            channels.reverse()
+            return channels, more, True
+        
+        return channels, after is not None, more
+    
+    except Exception as e:
+        logger.error(f"Error getting linked channels page for user {user_id}: {e}")
+        return [], False, False
 
-async def get_channel_by_ids(user_id, main_channel_id):
+async def get_channel_by_ids(user_id, main_channel_id, projection=None):
     """Get linked channel by user_id and main_channel_id"""
     try:
         channel = await db[COLLECTION_CHANNELS].find_one(
-            {"user_id": user_id, "main_channel_id": main_channel_id}
+            {"user_id": user_id, "main_channel_id": main_channel_id},
+            projection
         )
         return channel
     
@@ -153,46 +677,607 @@ async def get_channel_by_ids(user_id, main_channel_id):
         logger.error(f"Error getting channel: {e}")
         return None
 
-async def update_invite_link(user_id, main_channel_id, invite_link):
-    """Update invite link for a linked channel"""
-    try:
-        from datetime import datetime, timedelta
-        now = datetime.utcnow()
-        next_update = now + timedelta(hours=6)
-        
-        result = await db[COLLECTION_CHANNELS].update_one(
+async def stage_rotation(user_id, main_channel_id, private_channel_id, invite_link, retiring_links, delay_seconds):
+    """Persist a rotation before it is published, returning whether every write went through.
+    The retiring links get deferred revocations and the new link is recorded as pending, so a
+    crash or lost lease from here on can't leave either untracked"""
+    commits = [
+        write_buffer.commit(COLLECTION_REVOCATIONS, revocation_upsert(private_channel_id, link, delay_seconds))
+        for link in retiring_links
+    ]
+    
+    # Not guarded by the lease: the link must be found again whoever holds the link now
+    commits.append(write_buffer.commit(
+        COLLECTION_CHANNELS,
+        UpdateOne(
             {"user_id": user_id, "main_channel_id": main_channel_id},
+            {"$addToSet": {"pending_invite_links": invite_link}}
+        )
+    ))
+    
+    return all(await asyncio.gather(*commits))
+
+def update_invite_link(user_id, main_channel_id, invite_link, lease_token, main_chat=None, retired_links=()):
+    """Queue the new invite link of a linked channel, releasing its refresh lease when the write is flushed"""
+    from datetime import datetime
+    now = datetime.utcnow()
+    next_update = pick_next_update_time(now)
+    
+    # Buffered: the new link is already pending, so if this write is lost (or the claim was
+    # lost) the next rotation still revokes it, and the lease simply runs out
+    write_buffer.add(
+        COLLECTION_CHANNELS,
+        UpdateOne(
+            # Only the holder of this claim may store its result
+            {"user_id": user_id, "main_channel_id": main_channel_id, "lease_token": lease_token},
             {
                 "$set": {
                     "current_invite_link": invite_link,
                     "last_update_time": now,
                     "next_update_time": next_update,
-                    "updated_at": now
+                    "updated_at": now,
+                    # Refresh the stored title while we have it
+                    **chat_fields("main_channel", main_chat)
+                },
+                # Release the refresh lease and clear failures in the same write
+                "$unset": {**LEASE_FIELDS, **FAILURE_FIELDS},
+                # The new link is now tracked as current; retired ones are in the revocation queue
+                "$pull": {"pending_invite_links": {"$in": [invite_link, *retired_links]}}
+            }
+        )
+    )
+    
+    # Keep the in-process schedule in sync
+    deadline_queue.schedule((user_id, main_channel_id), next_update)
+    
+    logger.info(f"Invite link updated for user {user_id} and channel {main_channel_id}")
+
+async def claim_link(user_id, main_channel_id, due_only=True):
+    """Atomically take the refresh lease of a link, returning the document or None"""
+    try:
+        import uuid
+        from datetime import datetime, timedelta
+        now = datetime.utcnow()
+        
+        query = {
+            "user_id": user_id,
+            "main_channel_id": main_channel_id,
+            # Free, or left behind by an instance that crashed
+            "$or": [
+                {"lease_expires_at": None},
+                {"lease_expires_at": {"$lte": now}}
+            ]
+        }
+        
+        query.update(NOT_PAUSED)
+        
+        if due_only:
+            query["next_update_time"] = {"$lte": now}
+        
+        channel = await db[COLLECTION_CHANNELS].find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "lease_owner": INSTANCE_ID,
+                    "lease_token": uuid.uuid4().hex,
+                    "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS)
+                }
+            },
+            projection=REFRESH_FIELDS,
+            return_document=ReturnDocument.AFTER
+        )
+        return channel
+    
+    except Exception as e:
+        logger.error(f"Error claiming link for user {user_id} and channel {main_channel_id}: {e}")
+        return None
+
+async def claim_links(keys):
+    """Take the refresh lease of every due, free link among keys in two round trips"""
+    if not keys:
+        return []
+    
+    try:
+        import uuid
+        from datetime import datetime, timedelta
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        
+        await db[COLLECTION_CHANNELS].update_many(
+            {
+                "$and": [
+                    {"$or": [{"user_id": user_id, "main_channel_id": main_channel_id} for user_id, main_channel_id in keys]},
+                    {"$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lte": now}}]}
+                ],
+                "next_update_time": {"$lte": now},
+                **NOT_PAUSED
+            },
+            {
+                "$set": {
+                    "lease_owner": INSTANCE_ID,
+                    "lease_token": token,
+                    "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS)
                 }
             }
         )
         
-        if result.modified_count > 0:
-            logger.info(f"Invite link updated for user {user_id} and channel {main_channel_id}")
-            return True
-        else:
-            logger.warning(f"No linked channels found for update")
+        cursor = db[COLLECTION_CHANNELS].find({"lease_token": token}, REFRESH_FIELDS)
+        return await cursor.to_list(length=None)
+    
+    except Exception as e:
+        logger.error(f"Error claiming {len(keys)} links: {e}")
+        return []
+
+async def renew_lease(channel):
+    """Extend the refresh lease of a claimed link, returning False if the claim was lost"""
+    try:
+        from datetime import datetime, timedelta
+        expires_at = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+        
+        result = await db[COLLECTION_CHANNELS].update_one(
+            {
+                "user_id": channel["user_id"],
+                "main_channel_id": channel["main_channel_id"],
+                "lease_token": channel.get("lease_token")
+            },
+            {"$set": {"lease_expires_at": expires_at}}
+        )
+        
+        if result.matched_count == 0:
             return False
+        
+        channel["lease_expires_at"] = expires_at
+        return True
     
     except Exception as e:
-        logger.error(f"Error updating invite link: {e}")
+        logger.error(f"Error renewing lease for user {channel['user_id']} and channel {channel['main_channel_id']}: {e}")
         return False
 
-async def get_channels_for_update():
-    """Get all channels that need to be updated"""
+def record_refresh_failure(user_id, main_channel_id, error, failure_count, lease_token):
+    """Queue a failed refresh: release the lease and back off, quarantining repeat offenders"""
+    from datetime import datetime
+    now = datetime.utcnow()
+    next_update, quarantined = failure_backoff(now, failure_count)
+    
+    fields = {
+        "failure_count": failure_count,
+        "last_error": error,
+        "last_failure_time": now,
+        "next_update_time": next_update,
+        "quarantined": quarantined
+    }
+    
+    if quarantined and failure_count == QUARANTINE_AFTER_FAILURES:
+        fields["quarantined_at"] = now
+        logger.warning(f"Quarantined link for user {user_id} and channel {main_channel_id} after {failure_count} failures")
+    
+    # Buffered with the other refresh outcomes; the retry is due well after the next flush
+    write_buffer.add(
+        COLLECTION_CHANNELS,
+        UpdateOne(
+            {"user_id": user_id, "main_channel_id": main_channel_id, "lease_token": lease_token},
+            {"$set": fields, "$unset": LEASE_FIELDS}
+        )
+    )
+    
+    # Keep the in-process schedule in sync
+    deadline_queue.schedule((user_id, main_channel_id), next_update)
+
+async def release_quarantine(chat_id):
+    """Reset failures of every link using a chat and schedule them right away"""
+    try:
+        from datetime import datetime
+        now = datetime.utcnow()
+        
+        query = {
+            "$or": [{"main_channel_id": chat_id}, {"private_channel_id": chat_id}],
+            "failure_count": {"$gt": 0}
+        }
+        
+        cursor = db[COLLECTION_CHANNELS].find(query, {"_id": 0, "user_id": 1, "main_channel_id": 1})
+        keys = [(channel["user_id"], channel["main_channel_id"]) async for channel in cursor]
+        
+        if not keys:
+            return 0
+        
+        await db[COLLECTION_CHANNELS].update_many(
+            query,
+            {
+                "$set": {"next_update_time": now},
+                "$unset": FAILURE_FIELDS
+            }
+        )
+        
+        for key in keys:
+            deadline_queue.schedule(key, now)
+        
+        logger.info(f"Released {len(keys)} failing links using chat {chat_id}")
+        return len(keys)
+    
+    except Exception as e:
+        logger.error(f"Error releasing quarantine for chat {chat_id}: {e}")
+        return 0
+
+async def pause_links(chat_id):
+    """Pause every link using a chat and drop them from the schedule"""
     try:
         from datetime import datetime
         now = datetime.utcnow()
         
-        cursor = db[COLLECTION_CHANNELS].find({"next_update_time": {"$lte": now}})
+        query = {"$or": [{"main_channel_id": chat_id}, {"private_channel_id": chat_id}]}
+        
+        cursor = db[COLLECTION_CHANNELS].find(query, {"_id": 0, "user_id": 1, "main_channel_id": 1})
+        keys = [(channel["user_id"], channel["main_channel_id"]) async for channel in cursor]
+        
+        if not keys:
+            return 0
+        
+        await db[COLLECTION_CHANNELS].update_many(
+            query,
+            {"$addToSet": {"paused_chats": chat_id}, "$set": {"paused_at": now}}
+        )
+        
+        for key in keys:
+            deadline_queue.remove(key)
+        
+        logger.info(f"Paused {len(keys)} links using chat {chat_id}")
+        return len(keys)
+    
+    except Exception as e:
+        logger.error(f"Error pausing links for chat {chat_id}: {e}")
+        return 0
+
+async def resume_links(chat_id):
+    """Lift the pause a chat put on its links and refresh the ones no other chat still pauses"""
+    try:
+        from datetime import datetime
+        now = datetime.utcnow()
+        
+        query = {
+            "$or": [{"main_channel_id": chat_id}, {"private_channel_id": chat_id}],
+            "paused_chats": chat_id
+        }
+        
+        cursor = db[COLLECTION_CHANNELS].find(query, {"_id": 0, "user_id": 1, "main_channel_id": 1, "paused_chats": 1})
         channels = await cursor.to_list(length=None)
-        return channels
+        
+        if not channels:
+            return 0
+        
+        # One pipeline update pulls the chat and makes fully resumed links due now
+        await db[COLLECTION_CHANNELS].update_many(
+            query,
+            [
+                {"$set": {"paused_chats": {"$setDifference": ["$paused_chats", [chat_id]]}}},
+                {"$set": {
+                    "next_update_time": {
+                        "$cond": [{"$eq": [{"$size": "$paused_chats"}, 0]}, now, "$next_update_time"]
+                    }
+                }}
+            ]
+        )
+        
+        resumed = [
+            (channel["user_id"], channel["main_channel_id"])
+            for channel in channels
+            if channel["paused_chats"] == [chat_id]
+        ]
+        
+        for key in resumed:
+            deadline_queue.schedule(key, now)
+        
+        logger.info(f"Resumed {len(resumed)} of {len(channels)} links paused by chat {chat_id}")
+        return len(resumed)
+    
+    except Exception as e:
+        logger.error(f"Error resuming links for chat {chat_id}: {e}")
+        return 0
+
+async def get_link_schedules(keys):
+    """Get the next update time and lease expiry of several links, leaving out paused ones"""
+    if not keys:
+        return []
+    
+    try:
+        cursor = db[COLLECTION_CHANNELS].find(
+            {
+                "$or": [{"user_id": user_id, "main_channel_id": main_channel_id} for user_id, main_channel_id in keys],
+                **NOT_PAUSED
+            },
+            {"_id": 0, "user_id": 1, "main_channel_id": 1, "next_update_time": 1, "lease_expires_at": 1}
+        )
+        return await cursor.to_list(length=None)
+    
+    except Exception as e:
+        logger.error(f"Error getting link schedules: {e}")
+        return []
+
+def store_chat_info(chat):
+    """Queue a title/username refresh for every link using a chat"""
+    for role in ("main_channel", "private_channel"):
+        write_buffer.add(
+            COLLECTION_CHANNELS,
+            UpdateMany({f"{role}_id": chat.id}, {"$set": chat_fields(role, chat)})
+        )
+
+async def iter_channels_for_update(batch_size=DB_BATCH_SIZE):
+    """Stream the unclaimed channels that need to be updated in batches"""
+    try:
+        from datetime import datetime
+        now = datetime.utcnow()
+        
+        cursor = db[COLLECTION_CHANNELS].find(
+            {
+                "next_update_time": {"$lte": now},
+                "$or": [
+                    {"lease_expires_at": None},
+                    {"lease_expires_at": {"$lte": now}}
+                ],
+                **NOT_PAUSED
+            },
+            REFRESH_FIELDS
+        ).batch_size(batch_size)
+        
+        async for channel in cursor:
+            yield channel
+    
+    except Exception as e:
+        logger.error(f"Error streaming channels for update: {e}")
+        raise
+
+async def iter_schedule_entries(batch_size=DB_BATCH_SIZE, sort=False):
+    """Stream the refresh deadline of every active linked channel in batches"""
+    try:
+        cursor = db[COLLECTION_CHANNELS].find(
+            NOT_PAUSED,
+            {"_id": 0, "user_id": 1, "main_channel_id": 1, "next_update_time": 1}
+        ).batch_size(batch_size)
+        
+        if sort:
+            cursor = cursor.sort("next_update_time", 1)
+        
+        async for entry in cursor:
+            yield entry
+    
+    except Exception as e:
+        logger.error(f"Error streaming schedule entries: {e}")
+        raise
+
+async def rebalance_schedule():
+    """Re-spread the next update time of every linked channel across the update interval"""
+    try:
+        from datetime import datetime
+        now = datetime.utcnow()
+        
+        # Keep the current order so overdue links still go first
+        keys = [
+            (entry["user_id"], entry["main_channel_id"])
+            async for entry in iter_schedule_entries(sort=True)
+        ]
+        
+        assignments = spread_deadlines(keys, now)
+        
+        operations = [
+            UpdateOne(
+                {"user_id": user_id, "main_channel_id": main_channel_id},
+                {"$set": {"next_update_time": next_update}}
+            )
+            for (user_id, main_channel_id), next_update in assignments
+        ]
+        
+        # Write in chunks to keep each request small
+        for start in range(0, len(operations), 1000):
+            await db[COLLECTION_CHANNELS].bulk_write(operations[start:start + 1000], ordered=False)
+        
+        for key, next_update in assignments:
+            deadline_queue.schedule(key, next_update)
+        
+        logger.info(f"Rebalanced update schedule for {len(assignments)} linked channels")
+        return len(assignments)
+    
+    except Exception as e:
+        logger.error(f"Error rebalancing update schedule: {e}")
+        return 0
+
+# Revocation queue operations
+def revocation_upsert(private_channel_id, invite_link, delay_seconds=0):
+    """Build the write that queues an invite link for revocation, keyed by the link so queuing twice is harmless"""
+    from datetime import datetime, timedelta
+    now = datetime.utcnow()
+    
+    return UpdateOne(
+        {"_id": invite_link},
+        {
+            "$setOnInsert": {
+                "private_channel_id": private_channel_id,
+                "attempts": 0,
+                "next_attempt_at": now + timedelta(seconds=delay_seconds),
+                "created_at": now
+            }
+        },
+        upsert=True
+    )
+
+async def enqueue_revocation(private_channel_id, invite_link, delay_seconds=0):
+    """Persist an invite link for background revocation, returning whether it was stored"""
+    try:
+        # Written directly: a revocation lost in a crash would leave the link valid forever
+        await db[COLLECTION_REVOCATIONS].bulk_write([revocation_upsert(private_channel_id, invite_link, delay_seconds)])
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error queuing revocation of {invite_link}: {e}")
+        return False
+
+def expedite_revocation(invite_link):
+    """Make a deferred revocation due now (if this write is lost it just waits out its delay)"""
+    from datetime import datetime
+    
+    write_buffer.add(
+        COLLECTION_REVOCATIONS,
+        UpdateOne({"_id": invite_link, "attempts": 0}, {"$set": {"next_attempt_at": datetime.utcnow()}})
+    )
+
+async def cancel_revocation(invite_link):
+    """Drop a deferred revocation whose link is still in use"""
+    try:
+        await db[COLLECTION_REVOCATIONS].delete_one({"_id": invite_link, "lease_owner": None})
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error cancelling revocation of {invite_link}: {e}")
+        return False
+
+async def claim_revocations(limit):
+    """Take the lease of up to limit due revocations"""
+    try:
+        import uuid
+        from datetime import datetime, timedelta
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        
+        due = {
+            "next_attempt_at": {"$lte": now},
+            "$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lte": now}}]
+        }
+        
+        cursor = db[COLLECTION_REVOCATIONS].find(due, {"_id": 1}).sort("next_attempt_at", 1).limit(limit)
+        ids = [revocation["_id"] async for revocation in cursor]
+        
+        if not ids:
+            return []
+        
+        await db[COLLECTION_REVOCATIONS].update_many(
+            {"_id": {"$in": ids}, **due},
+            {
+                "$set": {
+                    "lease_owner": INSTANCE_ID,
+                    "lease_token": token,
+                    "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS)
+                }
+            }
+        )
+        
+        cursor = db[COLLECTION_REVOCATIONS].find({"lease_token": token})
+        return await cursor.to_list(length=None)
+    
+    except Exception as e:
+        logger.error(f"Error claiming revocations: {e}")
+        return []
+
+def complete_revocation(invite_link):
+    """Drop a revocation that went through"""
+    write_buffer.add(COLLECTION_REVOCATIONS, DeleteOne({"_id": invite_link}))
+
+def retry_revocation(revocation):
+    """Reschedule a failed revocation with exponential backoff, giving up after the last attempt"""
+    from datetime import datetime, timedelta
+    attempts = revocation.get("attempts", 0) + 1
+    
+    if attempts >= REVOKE_MAX_ATTEMPTS:
+        logger.error(f"Giving up revoking {revocation['_id']} in channel {revocation['private_channel_id']} after {attempts} attempts")
+        complete_revocation(revocation["_id"])
+        return
+    
+    delay = min(60 * 2 ** (attempts - 1), 6 * 3600)
+    
+    write_buffer.add(
+        COLLECTION_REVOCATIONS,
+        UpdateOne(
+            {"_id": revocation["_id"]},
+            {
+                "$set": {"attempts": attempts, "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)},
+                "$unset": LEASE_FIELDS
+            }
+        )
+    )
+
+# Invite hash index operations
+def store_invite_hash(invite_hash, chat_id):
+    """Queue an invite hash -> chat ID mapping for the lookup index"""
+    from datetime import datetime
+    
+    write_buffer.add(
+        COLLECTION_INVITE_HASHES,
+        UpdateOne(
+            {"_id": invite_hash},
+            {"$set": {"chat_id": chat_id, "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+    )
+
+async def get_invite_hash_chat_id(invite_hash):
+    """Get the chat ID an invite hash belongs to, or None if it is unknown"""
+    try:
+        entry = await db[COLLECTION_INVITE_HASHES].find_one({"_id": invite_hash}, {"chat_id": 1})
+        return entry["chat_id"] if entry else None
+    
+    except Exception as e:
+        logger.error(f"Error looking up invite hash: {e}")
+        return None
+
+# Username resolution cache operations
+def store_username(username, chat_id):
+    """Queue a username -> chat ID resolution for the shared cache"""
+    from datetime import datetime
+    
+    write_buffer.add(
+        COLLECTION_USERNAMES,
+        UpdateOne(
+            {"_id": username},
+            {"$set": {"chat_id": chat_id, "resolved_at": datetime.utcnow()}},
+            upsert=True
+        )
+    )
+
+async def get_username_chat_id(username):
+    """Get the chat ID a username resolved to, or None if it is unknown or stale"""
+    try:
+        from datetime import datetime, timedelta
+        
+        # The TTL monitor runs about once a minute, so skip entries it hasn't removed yet
+        fresh_after = datetime.utcnow() - timedelta(hours=USERNAME_CACHE_TTL_HOURS)
+        entry = await db[COLLECTION_USERNAMES].find_one(
+            {"_id": username, "resolved_at": {"$gt": fresh_after}},
+            {"chat_id": 1}
+        )
+        return entry["chat_id"] if entry else None
+    
+    except Exception as e:
+        logger.error(f"Error looking up username: {e}")
+        return None
+
+# Conversation state operations
+async def get_conversation_state(user_id):
+    """Get the unexpired conversation state document of a user, or None"""
+    try:
+        from datetime import datetime
+        
+        return await db[COLLECTION_STATES].find_one(
+            {"_id": user_id, "expires_at": {"$gt": datetime.utcnow()}}
+        )
+    
+    except Exception as e:
+        logger.error(f"Error getting conversation state: {e}")
+        return None
+
+async def set_conversation_state(user_id, fields):
+    """Store the conversation state of a user (fields must include expires_at)"""
+    try:
+        # Written directly so the user's next message sees it on any instance
+        await db[COLLECTION_STATES].replace_one({"_id": user_id}, fields, upsert=True)
+        return True
+    
+    except Exception as e:
+        logger.error(f"Error storing conversation state: {e}")
+        return False
+
+async def delete_conversation_state(user_id):
+    """Delete the conversation state of a user, returning whether one existed"""
+    try:
+        result = await db[COLLECTION_STATES].delete_one({"_id": user_id})
+        return result.deleted_count > 0
     
     except Exception as e:
-        logger.error(f"Error getting channels for update: {e}")
-        return []
\ No newline at end of file
+        logger.error(f"Error deleting conversation state: {e}")
+        return False
\ No newline at end of file
@@ -0,0 +1,126 @@
+import asyncio
+import heapq
+import itertools
+from datetime import datetime
+
+# Longest time the dispatcher sleeps before re-checking the clock
+MAX_WAIT_SECONDS = 60
+
+# Truncate a deadline to its minute
+def minute_of(deadline):
+    return deadline.replace(second=0, microsecond=0)
+
+# Deadline queue
+class DeadlineQueue:
+    """Min-heap of link refresh deadlines keyed by (user_id, main_channel_id)"""
+    
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.minute_load = {}
+    
+    def __len__(self):
+        return len(self.deadlines)
+    
+    def schedule(self, key, deadline):
+        """Set (or move) the refresh deadline of a link"""
+        if deadline is None:
+            deadline = datetime.utcnow()
+        
+        self._untrack(key)
+        self.deadlines[key] = deadline
+        self._track(deadline, 1)
+        heapq.heappush(self.heap, (deadline, next(self.counter), key))
+        
+        # Drop stale entries once they outnumber live ones
+        if len(self.heap) > 2 * len(self.deadlines) + 1000:
+            self._compact()
+        
+        self.wakeup.set()
+    
+    def remove(self, key):
+        """Forget a link; its heap entries are skipped lazily"""
+        self._untrack(key)
+        self.deadlines.pop(key, None)
+    
+    def get(self, key):
+        """Get the scheduled deadline of a link"""
+        return self.deadlines.get(key)
+    
+    def load_at(self, minute):
+        """Get the number of links due within the given minute"""
+        return self.minute_load.get(minute_of(minute), 0)
+    
+    def clear(self):
+        self.heap = []
+        self.deadlines = {}
+        self.minute_load = {}
+        self.wakeup.set()
+    
+    def _track(self, deadline, delta):
+        minute = minute_of(deadline)
+        load = self.minute_load.get(minute, 0) + delta
+        if load > 0:
+            self.minute_load[minute] = load
+        else:
+            self.minute_load.pop(minute, None)
+    
+    def _untrack(self, key):
+        deadline = self.deadlines.get(key)
+        if deadline is not None:
+            self._track(deadline, -1)
+    
+    def _compact(self):
+        self.heap = [(deadline, next(self.counter), key) for key, deadline in self.deadlines.items()]
+        heapq.heapify(self.heap)
+    
+    def _discard_stale(self):
+        while self.heap:
+            deadline, _, key = self.heap[0]
+            if self.deadlines.get(key) == deadline:
+                return
+            heapq.heappop(self.heap)
+    
+    def next_deadline(self):
+        """Get the earliest pending deadline, or None if nothing is scheduled"""
+        self._discard_stale()
+        return self.heap[0][0] if self.heap else None
+    
+    def pop_due(self, now):
+        """Remove and return the keys of every link due at or before now"""
+        due = []
+        
+        while True:
+            self._discard_stale()
+            if not self.heap or self.heap[0][0] > now:
+                return due
+            
+            _, _, key = heapq.heappop(self.heap)
+            self._untrack(key)
+            del self.deadlines[key]
+            due.append(key)
+    
+    async def wait_due(self):
+        """Sleep until at least one link is due and return the due keys"""
+        while True:
+            now = datetime.utcnow()
+            due = self.pop_due(now)
+            if due:
+                return due
+            
+            self.wakeup.clear()
+            
+            next_deadline = self.next_deadline()
+            timeout = MAX_WAIT_SECONDS
+            if next_deadline is not None:
+                timeout = min(max((next_deadline - now).total_seconds(), 0), MAX_WAIT_SECONDS)
+            
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+# Global deadline queue instance
+deadline_queue = DeadlineQueue()
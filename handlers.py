@@ -1,5 +1,5 @@
 from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, ChatMemberUpdated
 from pyrogram.errors import ChatAdminRequired, UserNotParticipant, ChannelInvalid
 from pyrogram.enums import ChatMemberStatus
 from datetime import datetime
@@ -9,18 +9,32 @@ import os
 from database import (
     add_linked_channels,
     remove_linked_channels,
-    get_user_linked_channels,
-    get_channel_by_ids
+    get_channel_by_ids,
+    rebalance_schedule,
+    release_quarantine,
+    pause_links,
+    resume_links,
+    store_chat_info,
+    LISTING_FIELDS
 )
 from utils import (
     is_user_admin,
     is_bot_admin_with_permissions,
+    is_broadcast_channel,
+    MAIN_CHANNEL_PRIVILEGES,
+    PRIVATE_CHANNEL_PRIVILEGES,
+    resolve_channel_id,
     update_channel_invite_link
 )
+from rate_limiter import api_call
+from chat_cache import get_chat, get_listing_titles, remember_chat
+from listings import render_status_page, render_remove_page
+from bulk_import import parse_import_file, submit_import_job, import_jobs, ImportFileError
+from member_cache import remember_member
+from state_store import state_store, ConversationState
+from user_dispatcher import per_user
 from callback_handlers import callback_query_handler
-
-# User states for conversation handling
-user_states = {}
+from config import OWNER_IDS, IMPORT_MAX_ROWS, IMPORT_MAX_BYTES
 
 # Initialize BOT_USERNAME here
 BOT_USERNAME = None
@@ -31,6 +45,7 @@ def register_handlers(bot):
     
     # Start command handler
     @bot.on_message(filters.command("start") & filters.private)
+    @per_user
     async def _start_command(client, message):
         user_id = message.from_user.id
         user_name = message.from_user.first_name
@@ -39,7 +54,7 @@ def register_handlers(bot):
         global BOT_USERNAME
         if BOT_USERNAME is None:
             try:
-                me = await client.get_me()
+                me = await api_call(client, "get_me")
                 BOT_USERNAME = me.username
                 logger.info(f"Bot username set to @{BOT_USERNAME}")
             except Exception as e:
@@ -72,6 +87,7 @@ def register_handlers(bot):
     
     # Help command handler
     @bot.on_message(filters.command("help") & filters.private)
+    @per_user
     async def _help_command(client, message):
         help_text = "📚 **Link Guard Robot Help**\n\n"
         help_text += "**Available Commands:**\n\n"
@@ -79,7 +95,8 @@ def register_handlers(bot):
         help_text += "🔹 /help - Show this help message\n"
         help_text += "🔹 /add - Link your public and private channels\n"
         help_text += "🔹 /remove - Unlink previously linked channels\n"
-        help_text += "🔹 /status - Check your linked channels and next update time\n\n"
+        help_text += "🔹 /status - Check your linked channels and next update time\n"
+        help_text += "🔹 /import - Link many channel pairs from a CSV or JSON file\n\n"
         
         help_text += "**Required Permissions:**\n"
         help_text += "For this bot to work properly, it needs to be an admin with these permissions:\n"
@@ -108,14 +125,12 @@ def register_handlers(bot):
     
     # Add command handler
     @bot.on_message(filters.command("add") & filters.private)
+    @per_user
     async def _add_command(client, message):
         user_id = message.from_user.id
         
         # Set user state to waiting for main channel
-        user_states[user_id] = {
-            "state": "waiting_main_channel",
-            "data": {}
-        }
+        await state_store.set(user_id, ConversationState("waiting_main_channel"))
         
         instructions = "🔄 **Channel Linking Process**\n\n"
         instructions += "Please follow these steps:\n\n"
@@ -128,39 +143,65 @@ def register_handlers(bot):
     
     # Remove command handler
     @bot.on_message(filters.command("remove") & filters.private)
+    @per_user
     async def _remove_command(client, message):
         await remove_command(client, message)
     
     # Status command handler
     @bot.on_message(filters.command("status") & filters.private)
+    @per_user
     async def _status_command(client, message):
         await status_command(client, message)
     
+    # Import command handler
+    @bot.on_message(filters.command("import") & filters.private)
+    @per_user
+    async def _import_command(client, message):
+        await import_command(client, message)
+    
+    # Rebalance command handler (owners only)
+    @bot.on_message(filters.command("rebalance") & filters.private)
+    @per_user
+    async def _rebalance_command(client, message):
+        await rebalance_command(client, message)
+    
     # Handle conversation states
-    @bot.on_message(filters.private & ~filters.command(["start", "help", "add", "remove", "status", "cancel"]))
+    @bot.on_message(filters.private & ~filters.command(["start", "help", "add", "remove", "status", "import", "cancel", "rebalance"]))
+    @per_user
     async def _conversation_handler(client, message):
         await handle_conversation(client, message)
     
     # Add cancel command handler
     @bot.on_message(filters.command("cancel") & filters.private)
+    @per_user
     async def _cancel_command(client, message):
         user_id = message.from_user.id
         
-        # Check if user has an active state
-        if user_id in user_states:
-            # Clear user state
-            del user_states[user_id]
+        # Clear user state if there is an active one
+        if await state_store.delete(user_id):
             await message.reply("❌ Operation cancelled. What would you like to do now?")
         else:
             await message.reply("There's no active operation to cancel.")
     
     # Add ping command to test bot responsiveness
     @bot.on_message(filters.command("ping") & filters.private)
+    @per_user
     async def _ping_command(client, message):
         await message.reply("Pong! Bot is working correctly! 🤖")
     
+    # Channel title changes
+    @bot.on_message(filters.new_chat_title)
+    async def _chat_title_changed(client, message):
+        await chat_title_changed(client, message)
+    
+    # Chat member updates (the bot's own admin rights)
+    @bot.on_chat_member_updated()
+    async def _chat_member_updated(client, update):
+        await chat_member_updated(client, update)
+    
     # Register callback handler from callback_handlers.py
     @bot.on_callback_query()
+    @per_user
     async def _callback_handler(client, callback_query):
         await callback_query_handler(client, callback_query)
 
@@ -204,7 +245,8 @@ async def help_command(client: Client, message: Message):
     help_text += "🔹 /help - Show this help message\n"
     help_text += "🔹 /add - Link your public and private channels\n"
     help_text += "🔹 /remove - Unlink previously linked channels\n"
-    help_text += "🔹 /status - Check your linked channels and next update time\n\n"
+    help_text += "🔹 /status - Check your linked channels and next update time\n"
+    help_text += "🔹 /import - Link many channel pairs from a CSV or JSON file\n\n"
     
     help_text += "**Required Permissions:**\n"
     help_text += "For this bot to work properly, it needs to be an admin with these permissions:\n"
@@ -237,10 +279,7 @@ async def add_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Set user state to waiting for main channel
-    user_states[user_id] = {
-        "state": "waiting_main_channel",
-        "data": {}
-    }
+    await state_store.set(user_id, ConversationState("waiting_main_channel"))
     
     instructions = "🔄 **Channel Linking Process**\n\n"
     instructions += "Please follow these steps:\n\n"
@@ -260,149 +299,178 @@ async def remove_command(client: Client, message: Message):
     """Handle /remove command"""
     user_id = message.from_user.id
     
-    # Get user's linked channels
-    channels = await get_user_linked_channels(user_id)
+    # Only the first page of the user's links is fetched
+    page = await render_remove_page(client, user_id)
     
-    if not channels:
+    if page is None:
         await message.reply("❌ You don't have any linked channels yet. Use /add to link channels.")
         return
     
-    # Set user state to waiting for channel selection
-    user_states[user_id] = {
-        "state": "waiting_remove_selection",
-        "data": {"channels": channels}
-    }
+    response, keyboard, channel_ids = page
     
-    # Create message with channel list
-    response = "🗑 **Remove Linked Channels**\n\n"
-    response += "Please send the number of the channel pair you want to remove:\n\n"
+    # Set user state to waiting for channel selection, keeping only the IDs on this page
+    await state_store.set(user_id, ConversationState("waiting_remove_selection", channel_ids=channel_ids))
     
-    for i, channel in enumerate(channels, 1):
-        main_channel_id = channel["main_channel_id"]
-        private_channel_id = channel["private_channel_id"]
-        
-        # Try to get channel names
-        try:
-            main_channel = await client.get_chat(main_channel_id)
-            private_channel = await client.get_chat(private_channel_id)
-            
-            main_name = main_channel.title or f"Channel {main_channel_id}"
-            private_name = private_channel.title or f"Channel {private_channel_id}"
-            
-            response += f"**{i}.** Public: {main_name} | Private: {private_name}\n"
-        except Exception:
-            # Fallback to IDs if names can't be retrieved
-            response += f"**{i}.** Public: {main_channel_id} | Private: {private_channel_id}\n"
-    
-    response += "\nOr send /cancel to abort."
-    
-    await message.reply(response)
+    await message.reply(response, reply_markup=keyboard)
 
 # Status command handler
 async def status_command(client: Client, message: Message):
     """Handle /status command"""
     user_id = message.from_user.id
     
-    # Get user's linked channels
-    channels = await get_user_linked_channels(user_id)
+    # Only the first page of the user's links is fetched
+    page = await render_status_page(client, user_id)
     
-    if not channels:
+    if page is None:
         await message.reply("❌ You don't have any linked channels yet. Use /add to link channels.")
         return
     
-    # Create message with channel status
-    response = "📊 **Your Linked Channels Status**\n\n"
-    
-    for i, channel in enumerate(channels, 1):
-        main_channel_id = channel["main_channel_id"]
-        private_channel_id = channel["private_channel_id"]
-        message_id = channel["message_id"]
-        last_update = channel.get("last_update_time")
-        next_update = channel.get("next_update_time")
-        
-        # Try to get channel names
-        try:
-            main_channel = await client.get_chat(main_channel_id)
-            private_channel = await client.get_chat(private_channel_id)
-            
-            main_name = main_channel.title or f"Channel {main_channel_id}"
-            private_name = private_channel.title or f"Channel {private_channel_id}"
-            
-            response += f"**{i}. Channel Pair:**\n"
-            response += f"📢 **Public:** {main_name}\n"
-            response += f"🔒 **Private:** {private_name}\n"
-            response += f"📝 **Message ID:** {message_id}\n"
-            
-            if last_update:
-                response += f"🕒 **Last Update:** {last_update.strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
-            
-            if next_update:
-                response += f"⏰ **Next Update:** {next_update.strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
-            
-            response += "\n"
-        except Exception as e:
-            # Fallback to IDs if names can't be retrieved
-            response += f"**{i}. Channel Pair:**\n"
-            response += f"📢 **Public:** {main_channel_id}\n"
-            response += f"🔒 **Private:** {private_channel_id}\n"
-            response += f"📝 **Message ID:** {message_id}\n"
-            
-            if last_update:
-                response += f"🕒 **Last Update:** {last_update.strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
-            
-            if next_update:
-                response += f"⏰ **Next Update:** {next_update.strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
-            
-            response += "\n"
-    
-    # Add refresh button
-    keyboard = InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton("🔄 Refresh Now", callback_data="refresh_all")
-            ]
-        ]
-    )
+    response, keyboard = page
     
     await message.reply(response, reply_markup=keyboard)
 
+# Import command handler
+async def import_command(client: Client, message: Message):
+    """Handle /import command"""
+    user_id = message.from_user.id
+    
+    await state_store.set(user_id, ConversationState("waiting_import_file"))
+    
+    instructions = "📥 **Import Channel Pairs**\n\n"
+    instructions += "Send me a CSV or JSON file with one channel pair per row:\n\n"
+    instructions += "**CSV:** `public channel,private channel,message ID`\n"
+    instructions += "**JSON:** `[{\"main_channel\": \"@mychannel\", \"private_channel\": \"-1001234567890\", \"message_id\": 123}]`\n\n"
+    instructions += "Channels can be usernames, IDs or links. I must be an admin in every channel, "
+    instructions += "with 'Edit Messages' in public channels and 'Invite Users' in private ones.\n\n"
+    instructions += f"Up to {IMPORT_MAX_ROWS} rows per file. Send /cancel to abort."
+    
+    await message.reply(instructions)
+
+# Handle import file
+async def handle_import_file(client: Client, message: Message, user_id, conversation):
+    """Handle the file sent after /import"""
+    document = message.document
+    
+    if not document:
+        await message.reply("❌ Please send the channel pairs as a CSV or JSON file.\n\nSend /cancel to abort.")
+        return
+    
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.reply("❌ The file is too large. Please split it into smaller files.\n\nSend /cancel to abort.")
+        return
+    
+    try:
+        content = await api_call(client, "download_media", message=message, in_memory=True)
+        rows = parse_import_file(document.file_name, bytes(content.getbuffer()))
+    except ImportFileError as e:
+        await message.reply(f"❌ {e}.\n\nSend /cancel to abort.")
+        return
+    
+    if user_id in import_jobs:
+        await message.reply("⏳ Your previous import is still running. Please wait for its report.\n\nSend /cancel to abort.")
+        return
+    
+    # The file is accepted; further messages start a new conversation
+    await state_store.delete(user_id)
+    
+    progress_message = await message.reply(f"🔄 Checking {len(rows)} row(s)...")
+    
+    # Validation runs in the background so this user's other updates aren't held up behind it
+    submit_import_job(client, user_id, progress_message, rows)
+
+# Rebalance command handler
+async def rebalance_command(client: Client, message: Message):
+    """Handle /rebalance command"""
+    user_id = message.from_user.id
+    
+    if user_id not in OWNER_IDS:
+        return
+    
+    await message.reply("🔄 Rebalancing the update schedule...")
+    
+    count = await rebalance_schedule()
+    
+    await message.reply(f"✅ Update schedule rebalanced for {count} linked channel(s).")
+
+# Chat title change handler
+async def chat_title_changed(client: Client, message: Message):
+    """Keep stored and cached titles in sync when a channel is renamed"""
+    chat = message.chat
+    
+    if not chat:
+        return
+    
+    logger.info(f"Chat {chat.id} was renamed to {message.new_chat_title}")
+    
+    chat.title = message.new_chat_title
+    remember_chat(chat)
+    store_chat_info(chat)
+
+# Chat member update handler
+async def chat_member_updated(client: Client, update: ChatMemberUpdated):
+    """Track membership changes in a channel and react to changes of the bot's own role"""
+    new_member = update.new_chat_member
+    member = new_member or update.old_chat_member
+    chat_id = update.chat.id
+    
+    # Keep the permission snapshot of whoever changed up to date
+    if member and member.user:
+        remember_member(chat_id, member.user.id, new_member)
+    
+    if not member or not member.user or not member.user.is_self:
+        return
+    
+    # Resume paused links and retry failing ones right away once the bot is an admin again
+    if new_member and new_member.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER):
+        logger.info(f"Bot is an admin in chat {chat_id} again")
+        await resume_links(chat_id)
+        await release_quarantine(chat_id)
+    else:
+        # Demoted or removed: stop refreshing until the rights come back
+        logger.info(f"Bot lost admin rights in chat {chat_id}")
+        await pause_links(chat_id)
+
 # Handle conversation states
 async def handle_conversation(client: Client, message: Message):
     """Handle conversation states for multi-step commands"""
     user_id = message.from_user.id
     
     # Check if user has an active state
-    if user_id not in user_states:
+    conversation = await state_store.get(user_id)
+    
+    if conversation is None:
         # No active state, ignore message
         return
     
-    state = user_states[user_id]["state"]
-    data = user_states[user_id]["data"]
+    state = conversation.state
     
     logger.debug(f"Handling conversation for user {user_id} in state {state}")
     
     # Handle cancel command
     if message.text and message.text.lower() == "/cancel":
-        del user_states[user_id]
+        await state_store.delete(user_id)
         await message.reply("❌ Operation cancelled.")
         return
     
     try:
         # Handle different states
         if state == "waiting_main_channel":
-            await handle_main_channel_input(client, message, user_id, data)
+            await handle_main_channel_input(client, message, user_id, conversation)
         
         elif state == "waiting_private_channel":
-            await handle_private_channel_input(client, message, user_id, data)
+            await handle_private_channel_input(client, message, user_id, conversation)
         
         elif state == "waiting_message_id":
-            await handle_message_id_input(client, message, user_id, data)
+            await handle_message_id_input(client, message, user_id, conversation)
+        
+        elif state == "waiting_import_file":
+            await handle_import_file(client, message, user_id, conversation)
         
         elif state == "waiting_remove_selection":
-            await handle_remove_selection(client, message, user_id, data)
+            await handle_remove_selection(client, message, user_id, conversation)
         else:
             logger.warning(f"Unknown state {state} for user {user_id}")
-            del user_states[user_id]
+            await state_store.delete(user_id)
             await message.reply("❌ An error occurred with your current operation. Please try again.")
     except Exception as e:
         logger.error(f"Error in conversation handler for user {user_id}: {e}")
@@ -412,7 +480,7 @@ async def handle_conversation(client: Client, message: Message):
         )
 
 # Handle main channel input
-async def handle_main_channel_input(client: Client, message: Message, user_id, data):
+async def handle_main_channel_input(client: Client, message: Message, user_id, conversation):
     """Handle main channel input from user"""
     # Try to extract channel ID from message
     channel_id = None
@@ -425,7 +493,6 @@ async def handle_main_channel_input(client: Client, message: Message, user_id, d
     # Check if message contains a channel username or ID
     elif message.text:
         # Use the new helper function to resolve channel ID
-        from utils import resolve_channel_id
         channel_id = await resolve_channel_id(client, message.text.strip())
 
     
@@ -442,19 +509,21 @@ async def handle_main_channel_input(client: Client, message: Message, user_id, d
         )
         return
     
-    # Check if user is admin in the channel
-    is_admin = await is_user_admin(client, user_id, channel_id)
+    # Links edit a message posted in the public channel, which only broadcast channels allow
+    try:
+        chat = await get_chat(client, channel_id)
+    except Exception:
+        chat = None
     
-    if not is_admin:
+    if chat is not None and not is_broadcast_channel(chat):
         await message.reply(
-            "❌ You are not an admin in this channel.\n\n"
-            "Please make sure you are an admin in the channel and try again.\n\n"
+            "❌ The public channel must be a channel, not a group.\n\n"
             "Send /cancel to abort."
         )
         return
     
-    # Check if bot is admin in the channel with required permissions
-    is_bot_admin = await is_bot_admin_with_permissions(client, channel_id)
+    # Check the bot first: without its rights the user's status can't be looked up either
+    is_bot_admin = await is_bot_admin_with_permissions(client, channel_id, MAIN_CHANNEL_PRIVILEGES)
     
     if not is_bot_admin:
         await message.reply(
@@ -464,13 +533,25 @@ async def handle_main_channel_input(client: Client, message: Message, user_id, d
         )
         return
     
+    # Check if user is admin in the channel
+    is_admin = await is_user_admin(client, user_id, channel_id)
+    
+    if not is_admin:
+        await message.reply(
+            "❌ You are not an admin in this channel.\n\n"
+            "Please make sure you are an admin in the channel and try again.\n\n"
+            "Send /cancel to abort."
+        )
+        return
+    
     # Store main channel ID and move to next state
-    data["main_channel_id"] = channel_id
-    user_states[user_id]["state"] = "waiting_private_channel"
+    conversation.main_channel_id = channel_id
+    conversation.state = "waiting_private_channel"
+    await state_store.set(user_id, conversation)
     
     # Try to get channel name
     try:
-        chat = await client.get_chat(channel_id)
+        chat = await get_chat(client, channel_id)
         channel_name = chat.title or f"Channel {channel_id}"
     except Exception:
         channel_name = f"Channel {channel_id}"
@@ -489,7 +570,7 @@ async def handle_main_channel_input(client: Client, message: Message, user_id, d
     )
 
 # Handle private channel input
-async def handle_private_channel_input(client: Client, message: Message, user_id, data):
+async def handle_private_channel_input(client: Client, message: Message, user_id, conversation):
     """Handle private channel input from user"""
     # Try to extract channel ID from message
     channel_id = None
@@ -502,7 +583,6 @@ async def handle_private_channel_input(client: Client, message: Message, user_id
     # Check if message contains a channel username, ID, or link
     elif message.text:
         # Use the new helper function to resolve channel ID
-        from utils import resolve_channel_id
         channel_id = await resolve_channel_id(client, message.text.strip())
         if channel_id:
             logger.info(f"Successfully resolved private channel ID: {channel_id}")
@@ -521,35 +601,36 @@ async def handle_private_channel_input(client: Client, message: Message, user_id
         )
         return
     
-    # Check if user is admin in the channel
-    is_admin = await is_user_admin(client, user_id, channel_id)
+    # Check the bot first: without its rights the user's status can't be looked up either
+    is_bot_admin = await is_bot_admin_with_permissions(client, channel_id, PRIVATE_CHANNEL_PRIVILEGES)
     
-    if not is_admin:
+    if not is_bot_admin:
         await message.reply(
-            "❌ You are not an admin in this channel.\n\n"
-            "Please make sure you are an admin in the channel and try again.\n\n"
+            "❌ I am not an admin in this channel or don't have the required permissions.\n\n"
+            "Please add me as an admin with 'Invite Users' permission and try again.\n\n"
             "Send /cancel to abort."
         )
         return
     
-    # Check if bot is admin in the channel with required permissions
-    is_bot_admin = await is_bot_admin_with_permissions(client, channel_id)
+    # Check if user is admin in the channel
+    is_admin = await is_user_admin(client, user_id, channel_id)
     
-    if not is_bot_admin:
+    if not is_admin:
         await message.reply(
-            "❌ I am not an admin in this channel or don't have the required permissions.\n\n"
-            "Please add me as an admin with 'Invite Users' permission and try again.\n\n"
+            "❌ You are not an admin in this channel.\n\n"
+            "Please make sure you are an admin in the channel and try again.\n\n"
             "Send /cancel to abort."
         )
         return
     
     # Store private channel ID and move to next state
-    data["private_channel_id"] = channel_id
-    user_states[user_id]["state"] = "waiting_message_id"
+    conversation.private_channel_id = channel_id
+    conversation.state = "waiting_message_id"
+    await state_store.set(user_id, conversation)
     
     # Try to get channel name
     try:
-        chat = await client.get_chat(channel_id)
+        chat = await get_chat(client, channel_id)
         channel_name = chat.title or f"Channel {channel_id}"
     except Exception:
         channel_name = f"Channel {channel_id}"
@@ -562,12 +643,12 @@ async def handle_private_channel_input(client: Client, message: Message, user_id
     )
 
 # Handle message ID input
-async def handle_message_id_input(client: Client, message: Message, user_id, data):
+async def handle_message_id_input(client: Client, message: Message, user_id, conversation):
     """Handle message ID input from user"""
     # Try to extract message ID from text
     message_id = None
-    main_channel_id = data["main_channel_id"]
-    private_channel_id = data["private_channel_id"]
+    main_channel_id = conversation.main_channel_id
+    private_channel_id = conversation.private_channel_id
     
     # Check if it's a message link
     if message.text and "t.me/" in message.text:
@@ -623,7 +704,7 @@ async def handle_message_id_input(client: Client, message: Message, user_id, dat
     
     # Try to get the message to verify it exists
     try:
-        await client.get_messages(main_channel_id, message_id)
+        await api_call(client, "get_messages", chat_id=main_channel_id, message_ids=message_id)
     except Exception:
         await message.reply(
             "❌ I couldn't find that message in the public channel.\n\n"
@@ -632,29 +713,38 @@ async def handle_message_id_input(client: Client, message: Message, user_id, dat
         )
         return
     
-    # Add linked channels to database
-    success = await add_linked_channels(user_id, main_channel_id, private_channel_id, message_id)
+    # Try to get channel names (cached from the previous steps)
+    try:
+        main_chat = await get_chat(client, main_channel_id)
+        private_chat = await get_chat(client, private_channel_id)
+        
+        main_name = main_chat.title or f"Channel {main_channel_id}"
+        private_name = private_chat.title or f"Channel {private_channel_id}"
+    except Exception:
+        main_chat = None
+        private_chat = None
+        main_name = f"Channel {main_channel_id}"
+        private_name = f"Channel {private_channel_id}"
+    
+    # Add linked channels to database, storing the names for later listings
+    success = await add_linked_channels(
+        user_id,
+        main_channel_id,
+        private_channel_id,
+        message_id,
+        main_chat=main_chat,
+        private_chat=private_chat
+    )
     
     if not success:
         await message.reply(
             "❌ There was an error linking your channels. Please try again later."
         )
-        del user_states[user_id]
+        await state_store.delete(user_id)
         return
     
     # Clear user state
-    del user_states[user_id]
-    
-    # Try to get channel names
-    try:
-        main_chat = await client.get_chat(main_channel_id)
-        private_chat = await client.get_chat(private_channel_id)
-        
-        main_name = main_chat.title or f"Channel {main_channel_id}"
-        private_name = private_chat.title or f"Channel {private_channel_id}"
-    except Exception:
-        main_name = f"Channel {main_channel_id}"
-        private_name = f"Channel {private_channel_id}"
+    await state_store.delete(user_id)
     
     # Send success message
     success_message = f"✅ **Channels successfully linked!**\n\n"
@@ -679,7 +769,7 @@ async def handle_message_id_input(client: Client, message: Message, user_id, dat
     await update_channel_invite_link(client, user_id, main_channel_id, private_channel_id, message_id)
 
 # Handle remove selection
-async def handle_remove_selection(client: Client, message: Message, user_id, data):
+async def handle_remove_selection(client: Client, message: Message, user_id, conversation):
     """Handle channel removal selection"""
     # Check if input is a valid number
     if not message.text or not message.text.strip().isdigit():
@@ -690,26 +780,32 @@ async def handle_remove_selection(client: Client, message: Message, user_id, dat
         return
     
     selection = int(message.text.strip())
-    channels = data["channels"]
+    channel_ids = conversation.channel_ids
     
     # Check if selection is valid
-    if selection < 1 or selection > len(channels):
+    if selection < 1 or selection > len(channel_ids):
         await message.reply(
-            f"❌ Please send a number between 1 and {len(channels)}.\n\n"
+            f"❌ Please send a number between 1 and {len(channel_ids)}.\n\n"
             "Send /cancel to abort."
         )
         return
     
-    # Get selected channel
-    selected_channel = channels[selection - 1]
-    main_channel_id = selected_channel["main_channel_id"]
+    # Get selected channel (the state only keeps IDs)
+    main_channel_id = channel_ids[selection - 1]
+    selected_channel = await get_channel_by_ids(user_id, main_channel_id, LISTING_FIELDS)
+    
+    if not selected_channel:
+        await state_store.delete(user_id)
+        await message.reply("❌ These channels are no longer linked. Use /remove to see your current list.")
+        return
+    
     private_channel_id = selected_channel["private_channel_id"]
     
     # Remove linked channels from database
     success = await remove_linked_channels(user_id, main_channel_id)
     
     # Clear user state
-    del user_states[user_id]
+    await state_store.delete(user_id)
     
     if not success:
         await message.reply(
@@ -717,16 +813,10 @@ async def handle_remove_selection(client: Client, message: Message, user_id, dat
         )
         return
     
-    # Try to get channel names
-    try:
-        main_chat = await client.get_chat(main_channel_id)
-        private_chat = await client.get_chat(private_channel_id)
-        
-        main_name = main_chat.title or f"Channel {main_channel_id}"
-        private_name = private_chat.title or f"Channel {private_channel_id}"
-    except Exception:
-        main_name = f"Channel {main_channel_id}"
-        private_name = f"Channel {private_channel_id}"
+    # Use the stored channel names, looking up only missing ones
+    titles = await get_listing_titles(client, [selected_channel])
+    main_name = titles.get(main_channel_id, f"Channel {main_channel_id}")
+    private_name = titles.get(private_channel_id, f"Channel {private_channel_id}")
     
     # Send success message
     success_message = f"✅ **Channels successfully unlinked!**\n\n"
@@ -0,0 +1,114 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from database import get_user_links_page
+from chat_cache import get_listing_titles
+
+# Parse the page cursor of a listing callback ("<listing>_<next|prev>_<_id>")
+def parse_page_callback(data):
+    """Get (listing, after, before) from page button data, or None if it is malformed"""
+    try:
+        listing, direction, cursor = data.split("_", 2)
+        cursor = ObjectId(cursor)
+    except (ValueError, InvalidId):
+        return None
+    
+    if direction == "next":
+        return listing, cursor, None
+    
+    if direction == "prev":
+        return listing, None, cursor
+    
+    return None
+
+# Build the prev/next buttons of a page
+def page_buttons(listing, channels, has_prev, has_next):
+    buttons = []
+    
+    if has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"{listing}_prev_{channels[0]['_id']}"))
+    
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"{listing}_next_{channels[-1]['_id']}"))
+    
+    return buttons
+
+# Render one page of /status
+async def render_status_page(client, user_id, after=None, before=None):
+    """Get (text, keyboard) for a page of the user's link status, or None if there are no links"""
+    channels, has_prev, has_next = await get_user_links_page(user_id, after, before)
+    
+    if not channels:
+        return None
+    
+    response = "📊 **Your Linked Channels Status**\n\n"
+    
+    # Use stored channel names, looking up only the missing ones on this page
+    titles = await get_listing_titles(client, channels)
+    
+    for i, channel in enumerate(channels, 1):
+        main_channel_id = channel["main_channel_id"]
+        private_channel_id = channel["private_channel_id"]
+        message_id = channel["message_id"]
+        last_update = channel.get("last_update_time")
+        next_update = channel.get("next_update_time")
+        
+        # Fallback to IDs if names can't be retrieved in time
+        main_name = titles.get(main_channel_id, main_channel_id)
+        private_name = titles.get(private_channel_id, private_channel_id)
+        
+        response += f"**{i}. Channel Pair:**\n"
+        response += f"📢 **Public:** {main_name}\n"
+        response += f"🔒 **Private:** {private_name}\n"
+        response += f"📝 **Message ID:** {message_id}\n"
+        
+        if last_update:
+            response += f"🕒 **Last Update:** {last_update.strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
+        
+        if next_update:
+            response += f"⏰ **Next Update:** {next_update.strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
+        
+        response += "\n"
+    
+    rows = []
+    
+    navigation = page_buttons("status", channels, has_prev, has_next)
+    if navigation:
+        rows.append(navigation)
+    
+    # Add refresh button
+    rows.append([InlineKeyboardButton("🔄 Refresh Now", callback_data="refresh_all")])
+    
+    return response, InlineKeyboardMarkup(rows)
+
+# Render one page of /remove
+async def render_remove_page(client, user_id, after=None, before=None):
+    """Get (text, keyboard, main channel IDs) for a page of the removal list, or None if there are no links"""
+    channels, has_prev, has_next = await get_user_links_page(user_id, after, before)
+    
+    if not channels:
+        return None
+    
+    response = "🗑 **Remove Linked Channels**\n\n"
+    response += "Please send the number of the channel pair you want to remove:\n\n"
+    
+    # Use stored channel names, looking up only the missing ones on this page
+    titles = await get_listing_titles(client, channels)
+    
+    for i, channel in enumerate(channels, 1):
+        main_channel_id = channel["main_channel_id"]
+        private_channel_id = channel["private_channel_id"]
+        
+        # Fallback to IDs if names can't be retrieved in time
+        main_name = titles.get(main_channel_id, main_channel_id)
+        private_name = titles.get(private_channel_id, private_channel_id)
+        
+        response += f"**{i}.** Public: {main_name} | Private: {private_name}\n"
+    
+    response += "\nOr send /cancel to abort."
+    
+    navigation = page_buttons("remove", channels, has_prev, has_next)
+    keyboard = InlineKeyboardMarkup([navigation]) if navigation else None
+    
+    return response, keyboard, [channel["main_channel_id"] for channel in channels]
@@ -0,0 +1,42 @@
+from pyrogram import errors
+
+from cache import TTLCache, SingleFlight, MISSING
+from rate_limiter import api_call
+from config import MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL_SECONDS
+
+# Chat member snapshots keyed by (chat_id, user_id); None means not a member
+member_cache = TTLCache(MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL_SECONDS)
+
+# Concurrent lookups of the same member share one get_chat_member call
+member_lookups = SingleFlight()
+
+# Get a member snapshot through the cache
+async def get_member(client, chat_id, user_id):
+    """Get a user's membership in a chat, or None if they aren't a member"""
+    member = member_cache.get((chat_id, user_id))
+    if member is not MISSING:
+        return member
+    
+    return await member_lookups.run((chat_id, user_id), fetch_member, client, chat_id, user_id)
+
+async def fetch_member(client, chat_id, user_id):
+    try:
+        member = await api_call(client, "get_chat_member", chat_id=chat_id, user_id=user_id)
+    except errors.UserNotParticipant:
+        member = None
+    
+    remember_member(chat_id, user_id, member)
+    return member
+
+# Get a member snapshot only if it is already cached
+def cached_member(chat_id, user_id):
+    """Get a cached membership snapshot without calling Telegram, or MISSING"""
+    return member_cache.get((chat_id, user_id))
+
+# Store a member snapshot we already have (e.g. from a ChatMemberUpdated update)
+def remember_member(chat_id, user_id, member):
+    member_cache.set((chat_id, user_id), member)
+
+# Drop a member snapshot from the cache
+def forget_member(chat_id, user_id):
+    member_cache.delete((chat_id, user_id))
@@ -0,0 +1,203 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from pyrogram import errors
+from loguru import logger
+
+from config import (
+    API_METHOD_RATE,
+    API_METHOD_BURST,
+    API_CHAT_RATE,
+    API_CHAT_BURST,
+    API_FLOOD_RETRIES,
+    API_FLOOD_MAX_WAIT,
+    MANUAL_USER_QUOTA,
+    MANUAL_CHANNEL_QUOTA,
+    MANUAL_QUOTA_WINDOW_SECONDS
+)
+
+# Maximum number of per-chat buckets kept in memory (least recently used are evicted)
+MAX_CHAT_BUCKETS = 10000
+
+# Number of quota keys kept before expired ones are pruned
+MAX_QUOTA_KEYS = 10000
+
+# Token bucket
+class TokenBucket:
+    """Token bucket that can be paused when Telegram asks us to wait"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    async def acquire(self, max_wait=None):
+        """Wait until a token is available and take it, failing fast if a pause outlasts max_wait"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+
+                # Honor pauses requested by FloodWait
+                if now < self.paused_until:
+                    remaining = self.paused_until - now
+                    if max_wait is not None and remaining > max_wait:
+                        raise errors.FloodWait(value=math.ceil(remaining))
+
+                    await asyncio.sleep(remaining)
+                    continue
+
+                self._refill(now)
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for the given number of seconds"""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = now
+
+# Rate limiter for Telegram API calls
+class RateLimiter:
+    """Shared budget for Telegram API calls with per-method and per-chat buckets"""
+
+    def __init__(self, method_rate, method_burst, chat_rate, chat_burst, flood_retries, flood_max_wait):
+        self.method_rate = method_rate
+        self.method_burst = method_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.flood_retries = flood_retries
+        self.flood_max_wait = flood_max_wait
+        self.method_buckets = {}
+        self.chat_buckets = OrderedDict()
+
+    def _method_bucket(self, method):
+        bucket = self.method_buckets.get(method)
+        if bucket is None:
+            bucket = TokenBucket(self.method_rate, self.method_burst)
+            self.method_buckets[method] = bucket
+        return bucket
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+
+            # Bound memory even when many chats stay active
+            while len(self.chat_buckets) > MAX_CHAT_BUCKETS:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def call(self, client, method, **kwargs):
+        """Call a Pyrogram client method once both its buckets allow it"""
+        chat_id = kwargs.get("chat_id")
+        func = getattr(client, method)
+
+        attempt = 0
+        while True:
+            # Take the chat token first so a paused chat doesn't hold a method token
+            chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+            # A bucket paused for longer than we are willing to wait fails the call right away
+            if chat_bucket:
+                await chat_bucket.acquire(self.flood_max_wait)
+
+            method_bucket = self._method_bucket(method)
+            await method_bucket.acquire(self.flood_max_wait)
+
+            try:
+                return await func(**kwargs)
+
+            except errors.FloodWait as e:
+                wait_seconds = e.value if isinstance(e.value, (int, float)) else 1
+
+                # Pause only the bucket the flood applies to
+                (chat_bucket or method_bucket).pause(wait_seconds)
+
+                # Long waits are left to the bucket so workers and handlers aren't stuck sleeping
+                if wait_seconds > self.flood_max_wait or attempt >= self.flood_retries:
+                    logger.warning(f"FloodWait of {wait_seconds}s on {method} for chat {chat_id}, giving up")
+                    raise
+
+                attempt += 1
+                logger.warning(f"FloodWait of {wait_seconds}s on {method} for chat {chat_id}, retrying ({attempt}/{self.flood_retries})")
+
+# Sliding-window quota
+class SlidingWindowQuota:
+    """Allows each key at most `limit` hits in any `window` seconds"""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.hits = {}
+
+    def _recent(self, key, now):
+        hits = self.hits.get(key)
+        if hits is None:
+            return None
+
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+
+        if not hits:
+            del self.hits[key]
+            return None
+
+        return hits
+
+    def retry_after(self, key):
+        """Get the seconds until key may be hit again, or 0 if it may be hit now"""
+        now = time.monotonic()
+        hits = self._recent(key, now)
+
+        if hits is None or len(hits) < self.limit:
+            return 0
+
+        return hits[0] + self.window - now
+
+    def hit(self, key):
+        """Record a hit for key"""
+        now = time.monotonic()
+
+        if len(self.hits) >= MAX_QUOTA_KEYS and key not in self.hits:
+            self._prune(now)
+
+        self.hits.setdefault(key, deque()).append(now)
+
+    def _prune(self, now):
+        for key in list(self.hits):
+            self._recent(key, now)
+
+# Global limiter instance
+limiter = RateLimiter(
+    API_METHOD_RATE,
+    API_METHOD_BURST,
+    API_CHAT_RATE,
+    API_CHAT_BURST,
+    API_FLOOD_RETRIES,
+    API_FLOOD_MAX_WAIT
+)
+
+# Helper to call a Telegram API method through the global limiter
+async def api_call(client, method, **kwargs):
+    """Call a Pyrogram client method through the shared rate limiter"""
+    return await limiter.call(client, method, **kwargs)
+
+# Manual refresh quotas, separate from the scheduled rotations' budget
+user_refresh_quota = SlidingWindowQuota(MANUAL_USER_QUOTA, MANUAL_QUOTA_WINDOW_SECONDS)
+channel_refresh_quota = SlidingWindowQuota(MANUAL_CHANNEL_QUOTA, MANUAL_QUOTA_WINDOW_SECONDS)
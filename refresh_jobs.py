@@ -0,0 +1,208 @@
+import asyncio
+import uuid
+from pyrogram import errors
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from loguru import logger
+
+from database import iter_user_linked_channels
+from rate_limiter import api_call, channel_refresh_quota
+from utils import update_channel_invite_link
+from config import JOB_CONCURRENCY, JOB_PROGRESS_SECONDS
+
+# Running jobs by job ID
+jobs = {}
+
+# Running job ID by user, so each user has at most one bulk refresh at a time
+user_jobs = {}
+
+# Manual bulk refresh job
+class RefreshJob:
+    """A user's "Refresh Now" run, reporting progress by editing one message"""
+    
+    def __init__(self, user_id, chat_id, message_id):
+        self.job_id = uuid.uuid4().hex[:8]
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.total = 0
+        self.success = 0
+        self.failed = 0
+        self.skipped = 0
+        self.cancelled = False
+        self.load_failed = False
+        self.finished = False
+        self.task = None
+    
+    @property
+    def done(self):
+        return self.success + self.failed + self.skipped
+    
+    def keyboard(self):
+        if self.finished:
+            return None
+        
+        return InlineKeyboardMarkup(
+            [[InlineKeyboardButton("✖️ Cancel", callback_data=f"cancel_job_{self.job_id}")]]
+        )
+    
+    def render(self):
+        """Build the progress text for the job message"""
+        if self.load_failed:
+            return "❌ Couldn't load your linked channels. Please try again later."
+        
+        if self.finished and not self.total:
+            return "❌ You don't have any linked channels to refresh."
+        
+        if not self.finished:
+            text = f"🔄 **Refreshing invite links...**\n\n"
+            text += f"Progress: {self.done}/{self.total or '?'} channel(s)\n"
+        elif self.cancelled:
+            text = f"✖️ **Refresh Cancelled**\n\n"
+            text += f"Stopped after {self.done} of {self.total} channel(s)\n"
+        else:
+            text = f"✅ **Refresh Complete**\n\n"
+        
+        text += f"Successfully updated: {self.success} channel(s)\n"
+        
+        if self.failed > 0:
+            text += f"Failed to update: {self.failed} channel(s)\n"
+        
+        if self.skipped > 0:
+            text += f"Skipped (refreshed too often): {self.skipped} channel(s)\n"
+        
+        if self.finished:
+            text += "\nUse /status to see the updated information."
+        
+        return text
+
+# Start a bulk refresh in the background
+def submit_refresh_job(client, user_id, message):
+    """Start a refresh-all job reporting into message, or return the user's running job"""
+    job_id = user_jobs.get(user_id)
+    if job_id in jobs:
+        return jobs[job_id], False
+    
+    job = RefreshJob(user_id, message.chat.id, message.id)
+    jobs[job.job_id] = job
+    user_jobs[user_id] = job.job_id
+    
+    job.task = asyncio.create_task(run_refresh_job(client, job))
+    logger.info(f"Started refresh job {job.job_id} for user {user_id}")
+    return job, True
+
+# Get a user's running job
+def running_refresh_job(user_id):
+    return jobs.get(user_jobs.get(user_id))
+
+# Cancel a running job
+def cancel_refresh_job(job_id, user_id):
+    """Ask a job to stop after the refreshes already in progress; only its owner may cancel it"""
+    job = jobs.get(job_id)
+    
+    if not job or job.user_id != user_id:
+        return False
+    
+    job.cancelled = True
+    return True
+
+# Run a bulk refresh job
+async def run_refresh_job(client, job):
+    """Refresh every link of the job's user with bounded concurrency"""
+    reporter = None
+    
+    try:
+        try:
+            channels = [channel async for channel in iter_user_linked_channels(job.user_id)]
+        except Exception:
+            job.load_failed = True
+            raise
+        
+        job.total = len(channels)
+        
+        # Progress edits run on their own so a slow edit or FloodWait never holds up refreshes
+        reporter = asyncio.create_task(report_progress(client, job))
+        
+        pending = iter(channels)
+        
+        async def worker():
+            for channel in pending:
+                if job.cancelled:
+                    return
+                
+                # Channels over their manual refresh quota wait for the scheduler
+                if channel_refresh_quota.retry_after(channel["main_channel_id"]) > 0:
+                    job.skipped += 1
+                    continue
+                
+                channel_refresh_quota.hit(channel["main_channel_id"])
+                
+                try:
+                    success = await update_channel_invite_link(
+                        client,
+                        job.user_id,
+                        channel["main_channel_id"],
+                        channel["private_channel_id"],
+                        channel["message_id"]
+                    )
+                except Exception as e:
+                    logger.error(f"Error refreshing channel in job {job.job_id}: {e}")
+                    success = False
+                
+                if success:
+                    job.success += 1
+                else:
+                    job.failed += 1
+        
+        await asyncio.gather(*(worker() for _ in range(min(JOB_CONCURRENCY, job.total))))
+    
+    except Exception as e:
+        logger.error(f"Error in refresh job {job.job_id}: {e}")
+    
+    finally:
+        job.finished = True
+        
+        if reporter is not None:
+            reporter.cancel()
+            try:
+                await reporter
+            except asyncio.CancelledError:
+                pass
+        
+        await edit_job_message(client, job)
+        
+        jobs.pop(job.job_id, None)
+        if user_jobs.get(job.user_id) == job.job_id:
+            del user_jobs[job.user_id]
+        
+        logger.info(f"Refresh job {job.job_id} finished: {job.success} ok, {job.failed} failed, {job.skipped} skipped of {job.total}")
+
+# Show job progress
+async def report_progress(client, job):
+    """Edit the job message every JOB_PROGRESS_SECONDS while its counters change"""
+    shown = None
+    
+    while True:
+        text = job.render()
+        
+        if text != shown:
+            await edit_job_message(client, job)
+            shown = text
+        
+        await asyncio.sleep(JOB_PROGRESS_SECONDS)
+
+async def edit_job_message(client, job):
+    try:
+        await api_call(
+            client,
+            "edit_message_text",
+            chat_id=job.chat_id,
+            message_id=job.message_id,
+            text=job.render(),
+            reply_markup=job.keyboard()
+        )
+    
+    except errors.MessageNotModified:
+        pass
+    
+    except Exception as e:
+        logger.debug(f"Could not update progress of job {job.job_id}: {e}")
@@ -0,0 +1,52 @@
+import asyncio
+from loguru import logger
+
+from database import claim_revocations, complete_revocation, retry_revocation
+from rate_limiter import TokenBucket
+from utils import revoke_invite_link
+from config import REVOKE_WORKERS, REVOKE_RATE, REVOKE_POLL_SECONDS
+
+# Revocation worker tasks
+revocation_workers = []
+
+# Revocation budget, separate from the refresh path
+revoke_bucket = TokenBucket(REVOKE_RATE, max(int(REVOKE_RATE), 1))
+
+# Start the revocation workers
+def start_revocation_workers(bot):
+    if revocation_workers:
+        return
+    
+    for worker_id in range(REVOKE_WORKERS):
+        task = asyncio.create_task(revocation_worker(bot, worker_id))
+        revocation_workers.append(task)
+    
+    logger.info(f"Started {REVOKE_WORKERS} revocation workers")
+
+# Revocation worker
+async def revocation_worker(bot, worker_id):
+    """Drain persisted revocations, retrying failures with backoff"""
+    while True:
+        try:
+            revocations = await claim_revocations(limit=10)
+            
+            if not revocations:
+                await asyncio.sleep(REVOKE_POLL_SECONDS)
+                continue
+            
+            for revocation in revocations:
+                await revoke_bucket.acquire()
+                
+                revoked = await revoke_invite_link(bot, revocation["private_channel_id"], revocation["_id"])
+                
+                if revoked:
+                    complete_revocation(revocation["_id"])
+                else:
+                    retry_revocation(revocation)
+        
+        except asyncio.CancelledError:
+            raise
+        
+        except Exception as e:
+            logger.error(f"Error in revocation worker {worker_id}: {e}")
+            await asyncio.sleep(REVOKE_POLL_SECONDS)
@@ -0,0 +1,70 @@
+import random
+from datetime import timedelta
+
+from deadline_queue import deadline_queue, minute_of
+from config import UPDATE_INTERVAL_HOURS, SCHEDULE_JITTER_MINUTES, SCHEDULE_MINUTE_CAPACITY
+from config import FAILED_RETRY_MINUTES, QUARANTINE_AFTER_FAILURES, QUARANTINE_PROBE_HOURS
+
+# Pick the next update time for a link
+def pick_next_update_time(now, delay=None):
+    """Pick a jittered deadline in the least crowded minute before now + delay"""
+    if delay is None:
+        delay = timedelta(hours=UPDATE_INTERVAL_HOURS)
+    
+    # Deadlines only move earlier so a link never outlives the update interval
+    latest = now + delay
+    window = max(min(SCHEDULE_JITTER_MINUTES, int(delay.total_seconds() // 60)), 0)
+    
+    # Start at a random minute of the window and walk it for free capacity
+    offset = random.randint(0, window)
+    best_minute = None
+    best_load = None
+    
+    for step in range(window + 1):
+        candidate = minute_of(latest - timedelta(minutes=(offset + step) % (window + 1)))
+        load = deadline_queue.load_at(candidate)
+        
+        if load < SCHEDULE_MINUTE_CAPACITY:
+            best_minute = candidate
+            break
+        
+        if best_load is None or load < best_load:
+            best_minute = candidate
+            best_load = load
+    
+    deadline = best_minute + timedelta(seconds=random.uniform(0, 59))
+    
+    # Keep the deadline inside [now, now + delay]
+    return max(min(deadline, latest), now)
+
+# Spread a list of links evenly across the update interval
+def spread_deadlines(keys, now, delay=None):
+    """Assign evenly spaced, lightly jittered deadlines to the given links in order"""
+    if delay is None:
+        delay = timedelta(hours=UPDATE_INTERVAL_HOURS)
+    
+    if not keys:
+        return []
+    
+    step = delay / len(keys)
+    deadlines = []
+    
+    for i, key in enumerate(keys):
+        jitter = step * random.random()
+        deadlines.append((key, now + step * i + jitter))
+    
+    return deadlines
+
+# Pick the retry time for a failing link
+def failure_backoff(now, failure_count):
+    """Get (next_update_time, quarantined) after the given number of consecutive failures"""
+    if failure_count >= QUARANTINE_AFTER_FAILURES:
+        return now + timedelta(hours=QUARANTINE_PROBE_HOURS), True
+    
+    delay = timedelta(minutes=FAILED_RETRY_MINUTES * 2 ** max(failure_count - 1, 0))
+    delay = min(delay, timedelta(hours=UPDATE_INTERVAL_HOURS))
+    
+    # Jitter so channels that broke together don't retry together
+    delay = delay * random.uniform(0.9, 1.1)
+    
+    return now + delay, False
@@ -1,30 +1,75 @@
 import asyncio
+import time
 from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from loguru import logger
 
-from database import get_channels_for_update
+from database import claim_links, get_link_schedules, iter_channels_for_update, iter_schedule_entries
+from deadline_queue import deadline_queue
 from utils import update_channel_invite_link
-from config import UPDATE_INTERVAL_HOURS
+from revocation_queue import start_revocation_workers
+from user_dispatcher import report_dispatch_queues
+from chat_cache import report_chat_cache
+from config import UPDATE_INTERVAL_HOURS, REFRESH_WORKERS, FAILED_RETRY_MINUTES, RECONCILE_MINUTES, INSTANCE_ID
+
+# Most due links claimed per database round trip
+CLAIM_BATCH_SIZE = 100
+
+# Attempts at loading the deadline queue at startup
+LOAD_ATTEMPTS = 3
 
 # Global scheduler instance
 scheduler = None
 
+# Refresh worker pool; links are only claimed for idle workers so no lease runs out in the queue
+refresh_queue = None
+idle_workers = None
+refresh_workers = []
+
+# Deadline dispatcher task
+dispatcher_task = None
+
+# Refresh counters since the last throughput report
+refresh_stats = {"success": 0, "failed": 0, "since": time.monotonic()}
+
 # Setup scheduler
 async def setup_scheduler(bot):
-    global scheduler
+    global scheduler, dispatcher_task
     
     # Create scheduler if it doesn't exist
     if scheduler is None:
         scheduler = AsyncIOScheduler()
         
-        # Add job to check for updates every 5 minutes
+        # Add job to pick up due links scheduled by other instances
+        scheduler.add_job(
+            reconcile_due_links,
+            IntervalTrigger(minutes=RECONCILE_MINUTES),
+            id="reconcile_job",
+            replace_existing=True
+        )
+        
+        # Add job to report refresh throughput every minute
+        scheduler.add_job(
+            report_refresh_throughput,
+            IntervalTrigger(minutes=1),
+            id="refresh_stats_job",
+            replace_existing=True
+        )
+        
+        # Add job to report per-user dispatch queue depth every minute
+        scheduler.add_job(
+            report_dispatch_queues,
+            IntervalTrigger(minutes=1),
+            id="dispatch_stats_job",
+            replace_existing=True
+        )
+        
+        # Add job to report chat cache hits and misses every minute
         scheduler.add_job(
-            process_link_updates,
-            IntervalTrigger(minutes=5),
-            args=[bot],
-            id="link_update_job",
+            report_chat_cache,
+            IntervalTrigger(minutes=1),
+            id="chat_cache_stats_job",
             replace_existing=True
         )
         
@@ -32,61 +77,220 @@ async def setup_scheduler(bot):
         scheduler.start()
         logger.info(f"Scheduler started with update interval of {UPDATE_INTERVAL_HOURS} hours")
     
-    # Run initial update check
-    await process_link_updates(bot)
+    # Load every link deadline once; overdue links fire immediately
+    await load_deadlines()
+    
+    start_refresh_workers(bot)
+    start_revocation_workers(bot)
+    
+    if dispatcher_task is None:
+        dispatcher_task = asyncio.create_task(process_link_updates(bot))
+
+# Load link deadlines from the database
+async def load_deadlines():
+    """Fill the deadline queue with the next update time of every linked channel"""
+    for attempt in range(1, LOAD_ATTEMPTS + 1):
+        try:
+            # Read everything first so a failed stream never leaves a partial schedule
+            entries = [entry async for entry in iter_schedule_entries()]
+            break
+        
+        except Exception as e:
+            if attempt == LOAD_ATTEMPTS:
+                raise
+            
+            logger.warning(f"Loading link deadlines failed ({attempt}/{LOAD_ATTEMPTS}), retrying: {e}")
+            await asyncio.sleep(2 ** attempt)
+    
+    deadline_queue.clear()
+    
+    for entry in entries:
+        key = (entry["user_id"], entry["main_channel_id"])
+        deadline_queue.schedule(key, entry.get("next_update_time"))
+    
+    logger.info(f"Loaded {len(deadline_queue)} link deadlines")
+
+# Start the refresh worker pool
+def start_refresh_workers(bot):
+    global refresh_queue, idle_workers
+    
+    if refresh_queue is not None:
+        return
+    
+    refresh_queue = asyncio.Queue()
+    idle_workers = asyncio.Semaphore(REFRESH_WORKERS)
+    
+    for worker_id in range(REFRESH_WORKERS):
+        task = asyncio.create_task(refresh_worker(bot, worker_id))
+        refresh_workers.append(task)
+    
+    logger.info(f"Started {REFRESH_WORKERS} refresh workers")
+
+# Refresh worker
+async def refresh_worker(bot, worker_id):
+    """Pull claimed links from the refresh queue and update their invite links"""
+    while True:
+        channel = await refresh_queue.get()
+        
+        try:
+            success = await refresh_due_link(bot, channel)
+            
+            if success:
+                refresh_stats["success"] += 1
+            else:
+                refresh_stats["failed"] += 1
+        
+        except Exception as e:
+            logger.error(f"Error in refresh worker {worker_id}: {e}")
+            refresh_stats["failed"] += 1
+        
+        finally:
+            refresh_queue.task_done()
+            idle_workers.release()
+
+# Refresh a link whose deadline has passed
+async def refresh_due_link(bot, channel):
+    """Refresh a claimed link, retrying it later if the refresh fails"""
+    key = (channel["user_id"], channel["main_channel_id"])
+    
+    success = await refresh_channel(bot, channel)
+    
+    # Retry failed links later; the stored deadline was not advanced
+    if not success and deadline_queue.get(key) is None:
+        deadline_queue.schedule(key, datetime.utcnow() + timedelta(minutes=FAILED_RETRY_MINUTES))
+    
+    return success
+
+# Reserve idle workers
+async def reserve_workers(limit):
+    """Wait for at least one idle worker and reserve up to limit of them, returning how many"""
+    await idle_workers.acquire()
+    reserved = 1
+    
+    while reserved < limit and not idle_workers.locked():
+        await idle_workers.acquire()
+        reserved += 1
+    
+    return reserved
+
+# Claim due links and hand them to the workers
+async def dispatch_due_links(keys):
+    """Claim due links as workers become idle, queueing the ones this instance won"""
+    while keys:
+        reserved = await reserve_workers(min(len(keys), CLAIM_BATCH_SIZE))
+        await claim_batch(keys[:reserved])
+        keys = keys[reserved:]
+
+async def claim_batch(keys):
+    """Claim a batch of due links for reserved workers and reschedule the ones this instance didn't win"""
+    claimed = []
+    
+    try:
+        claimed = await claim_links(keys)
+        
+        for channel in claimed:
+            refresh_queue.put_nowait(channel)
+    
+    finally:
+        # Workers reserved for links that weren't claimed stay idle
+        for _ in range(len(keys) - len(claimed)):
+            idle_workers.release()
+    
+    # The rest were removed, rescheduled or claimed by another instance
+    claimed_keys = {(channel["user_id"], channel["main_channel_id"]) for channel in claimed}
+    unclaimed = [key for key in keys if key not in claimed_keys]
+    
+    retry_at = datetime.utcnow() + timedelta(seconds=5)
+    for schedule in await get_link_schedules(unclaimed):
+        key = (schedule["user_id"], schedule["main_channel_id"])
+        
+        # Check again at the stored deadline or once another instance's lease runs out
+        candidates = [schedule.get("next_update_time"), schedule.get("lease_expires_at")]
+        candidates = [candidate for candidate in candidates if candidate]
+        deadline_queue.schedule(key, max(candidates + [retry_at]))
+
+# Refresh a single channel
+async def refresh_channel(bot, channel):
+    """Refresh the invite link of a single linked channel document"""
+    # Validate channel data
+    required_fields = ["user_id", "main_channel_id", "private_channel_id", "message_id"]
+    if not all(field in channel for field in required_fields):
+        logger.warning(f"Channel data missing required fields: {channel}")
+        return False
+    
+    # Extract channel data
+    user_id = channel["user_id"]
+    main_channel_id = channel["main_channel_id"]
+    private_channel_id = channel["private_channel_id"]
+    message_id = channel["message_id"]
+    
+    # Update invite link
+    success = await update_channel_invite_link(
+        bot,
+        user_id,
+        main_channel_id,
+        private_channel_id,
+        message_id,
+        channel_data=channel
+    )
+    
+    if success:
+        logger.info(f"Successfully updated invite link for user {user_id} and channel {main_channel_id}")
+    else:
+        logger.warning(f"Failed to update invite link for user {user_id} and channel {main_channel_id}")
+    
+    return success
 
 # Process link updates
 async def process_link_updates(bot):
-    try:
-        # Get channels that need to be updated
+    """Dispatch links to the worker pool as soon as their deadlines pass"""
+    while True:
         try:
-            channels = await get_channels_for_update()
-        except Exception as db_error:
-            logger.error(f"Database error when getting channels for update: {db_error}")
-            return
+            due_keys = await deadline_queue.wait_due()
+            
+            logger.info(f"{len(due_keys)} links reached their update deadline")
+            
+            # Claimed in batches as large as the number of idle workers
+            await dispatch_due_links(due_keys)
         
-        if not channels:
-            logger.debug("No channels need updating at this time")
-            return
+        except asyncio.CancelledError:
+            raise
         
-        logger.info(f"Found {len(channels)} channels that need updating")
+        except Exception as e:
+            logger.error(f"Error in process_link_updates: {e}")
+            # Continue running the bot even if there's an error in the update process
+            await asyncio.sleep(1)
+
+# Reconcile due links
+async def reconcile_due_links():
+    """Schedule due, unclaimed links this instance does not know about"""
+    found = 0
+    
+    async for channel in iter_channels_for_update():
+        key = (channel["user_id"], channel["main_channel_id"])
         
-        # Process each channel
-        for channel in channels:
-            try:
-                # Validate channel data
-                required_fields = ["user_id", "main_channel_id", "private_channel_id", "message_id"]
-                if not all(field in channel for field in required_fields):
-                    logger.warning(f"Channel data missing required fields: {channel}")
-                    continue
-                
-                # Extract channel data
-                user_id = channel["user_id"]
-                main_channel_id = channel["main_channel_id"]
-                private_channel_id = channel["private_channel_id"]
-                message_id = channel["message_id"]
-                
-                # Update invite link
-                success = await update_channel_invite_link(
-                    bot,
-                    user_id,
-                    main_channel_id,
-                    private_channel_id,
-                    message_id
-                )
-                
-                if success:
-                    logger.info(f"Successfully updated invite link for user {user_id} and channel {main_channel_id}")
-                else:
-                    logger.warning(f"Failed to update invite link for user {user_id} and channel {main_channel_id}")
-                
-                # Add a small delay between updates to avoid rate limits
-                await asyncio.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"Error processing channel update: {e}")
-                continue
-    
-    except Exception as e:
-        logger.error(f"Error in process_link_updates: {e}")
-        # Continue running the bot even if there's an error in the update process
\ No newline at end of file
+        if deadline_queue.get(key) is None:
+            deadline_queue.schedule(key, channel.get("next_update_time"))
+            found += 1
+    
+    if found:
+        logger.info(f"Instance {INSTANCE_ID} picked up {found} due links from the database")
+
+# Report refresh throughput
+async def report_refresh_throughput():
+    """Log how many refreshes finished since the last report"""
+    now = time.monotonic()
+    elapsed = now - refresh_stats["since"]
+    processed = refresh_stats["success"] + refresh_stats["failed"]
+    
+    if processed:
+        rate = processed / elapsed if elapsed > 0 else float(processed)
+        logger.info(
+            f"Refreshed {processed} links in the last {elapsed:.0f}s "
+            f"({rate:.2f}/s, {refresh_stats['success']} ok, {refresh_stats['failed']} failed, "
+            f"{refresh_queue.qsize() if refresh_queue else 0} queued, {REFRESH_WORKERS} workers)"
+        )
+    
+    refresh_stats["success"] = 0
+    refresh_stats["failed"] = 0
+    refresh_stats["since"] = now
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+from cache import TTLCache
+from database import get_conversation_state, set_conversation_state, delete_conversation_state
+from config import STATE_BACKEND, STATE_TTL_MINUTES, STATE_CACHE_SIZE
+
+# Conversation state record
+class ConversationState:
+    """Step of a multi-message command and the IDs collected so far"""
+    
+    __slots__ = ("state", "main_channel_id", "private_channel_id", "channel_ids")
+    
+    def __init__(self, state, main_channel_id=None, private_channel_id=None, channel_ids=()):
+        self.state = state
+        self.main_channel_id = main_channel_id
+        self.private_channel_id = private_channel_id
+        self.channel_ids = tuple(channel_ids)
+    
+    def to_document(self):
+        return {
+            "state": self.state,
+            "main_channel_id": self.main_channel_id,
+            "private_channel_id": self.private_channel_id,
+            "channel_ids": list(self.channel_ids)
+        }
+    
+    @classmethod
+    def from_document(cls, document):
+        return cls(
+            document["state"],
+            document.get("main_channel_id"),
+            document.get("private_channel_id"),
+            document.get("channel_ids") or ()
+        )
+
+# In-memory backend
+class MemoryStateStore:
+    """Keeps conversation states in this process, expiring idle ones and capping their number"""
+    
+    def __init__(self, max_size, ttl):
+        self.states = TTLCache(max_size, ttl)
+    
+    async def get(self, user_id):
+        return self.states.get(user_id, None)
+    
+    async def set(self, user_id, state):
+        # Every step restarts the expiry
+        self.states.set(user_id, state)
+    
+    async def delete(self, user_id):
+        found = self.states.get(user_id, None) is not None
+        self.states.delete(user_id)
+        return found
+
+# MongoDB backend
+class MongoStateStore:
+    """Keeps conversation states in MongoDB so any instance can continue a conversation"""
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+    
+    async def get(self, user_id):
+        document = await get_conversation_state(user_id)
+        return ConversationState.from_document(document) if document else None
+    
+    async def set(self, user_id, state):
+        # A TTL index on expires_at removes abandoned conversations
+        document = state.to_document()
+        document["expires_at"] = datetime.utcnow() + timedelta(seconds=self.ttl)
+        await set_conversation_state(user_id, document)
+    
+    async def delete(self, user_id):
+        return await delete_conversation_state(user_id)
+
+# Create the configured state store
+def create_state_store(backend=STATE_BACKEND):
+    ttl = STATE_TTL_MINUTES * 60
+    
+    if backend == "mongo":
+        return MongoStateStore(ttl)
+    
+    if backend != "memory":
+        raise ValueError(f"Unknown state backend: {backend}")
+    
+    return MemoryStateStore(STATE_CACHE_SIZE, ttl)
+
+# Global state store instance
+state_store = create_state_store()
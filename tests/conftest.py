@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The bot's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Point the database module at an in-memory MongoDB and an empty deadline queue"""
+    from mongomock_motor import AsyncMongoMockClient
+    
+    import database
+    from deadline_queue import deadline_queue
+    
+    db = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(database, "db", db)
+    write_buffer = database.WriteBuffer(database.WRITE_BATCH_SIZE, database.WRITE_FLUSH_SECONDS, database.WRITE_COMMIT_SECONDS)
+    monkeypatch.setattr(database, "write_buffer", write_buffer)
+    deadline_queue.clear()
+    
+    yield db
+    
+    deadline_queue.clear()
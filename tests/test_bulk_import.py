@@ -0,0 +1,181 @@
+import asyncio
+import json
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+import bulk_import
+import database
+import refresh_jobs
+from bulk_import import ImportFileError, parse_import_file
+from config import COLLECTION_CHANNELS
+from database import add_linked_channels, import_linked_channels
+
+def test_csv_rows_skip_the_header_and_blank_lines():
+    content = b"main,private,message_id\n@news, -1001 ,42\n\n@other,-1002\n"
+    
+    assert parse_import_file("links.csv", content) == [
+        (2, "@news", "-1001", "42"),
+        (4, "@other", "-1002", "")
+    ]
+
+def test_csv_without_a_header_keeps_the_first_row():
+    assert parse_import_file("links.txt", "﻿@news,-1001,7".encode()) == [(1, "@news", "-1001", "7")]
+
+def test_json_objects_and_lists():
+    content = json.dumps([
+        {"main_channel": "@news", "private_channel": -1001, "message_id": 42},
+        ["@other", "-1002"],
+        "garbage"
+    ]).encode()
+    
+    assert parse_import_file("links.JSON", content) == [
+        (1, "@news", "-1001", "42"),
+        (2, "@other", "-1002", ""),
+        (3, "", "", "")
+    ]
+
+@pytest.mark.parametrize("file_name, content", [
+    ("links.csv", b"\xff\xfe"),
+    ("links.csv", b"main,private,message_id\n"),
+    ("links.json", b"{not json"),
+    ("links.json", b'{"main_channel": "@news"}'),
+    ("links.json", b"[]")
+])
+def test_unusable_files_are_rejected(file_name, content):
+    with pytest.raises(ImportFileError):
+        parse_import_file(file_name, content)
+
+def test_row_limit(monkeypatch):
+    monkeypatch.setattr(bulk_import, "IMPORT_MAX_ROWS", 2)
+    
+    with pytest.raises(ImportFileError):
+        parse_import_file("links.csv", b"@a,-1,1\n@b,-2,2\n@c,-3,3\n")
+
+class FakeBot:
+    """Records the progress edits and documents an import job sends"""
+    
+    def __init__(self):
+        self.edits = []
+        self.documents = []
+    
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        self.edits.append(text)
+    
+    async def send_document(self, chat_id, document):
+        self.documents.append(document.name)
+
+def valid_row(row):
+    line, main_text, private_text, message_id_text = row
+    return {
+        "line": line,
+        "link": {
+            "main_channel_id": int(main_text),
+            "private_channel_id": int(private_text),
+            "message_id": int(message_id_text),
+            "main_chat": None,
+            "private_chat": None
+        }
+    }
+
+def stored_links(mongo):
+    return asyncio.run(mongo[COLLECTION_CHANNELS].find({}, {"_id": 0}).to_list(None))
+
+def test_import_job_reports_progress_without_blocking_the_caller(mongo, monkeypatch):
+    monkeypatch.setattr(refresh_jobs, "JOB_PROGRESS_SECONDS", 0.01)
+    release = asyncio.Event()
+    
+    async def slow_validate(client, user_id, row):
+        if row[0] > 1:
+            await release.wait()
+        return valid_row(row)
+    
+    monkeypatch.setattr(bulk_import, "validate_row", slow_validate)
+    bot = FakeBot()
+    message = SimpleNamespace(id=5, chat=SimpleNamespace(id=1))
+    rows = [(1, "-101", "-201", "1"), (2, "-102", "-202", "2")]
+    
+    async def scenario():
+        job, started = bulk_import.submit_import_job(bot, 1, message, rows)
+        assert started
+        assert bulk_import.submit_import_job(bot, 1, message, rows) == (job, False)
+        
+        await asyncio.sleep(0.05)
+        assert job.checked == 1 and not job.finished
+        
+        release.set()
+        await job.task
+        return job
+    
+    job = asyncio.run(scenario())
+    
+    assert any("Progress: 1/2 row(s)" in text for text in bot.edits)
+    assert bot.edits[-1].startswith("📥 **Import finished:** 2 of 2 row(s) linked")
+    assert 1 not in bulk_import.import_jobs
+    assert {link["main_channel_id"] for link in stored_links(mongo)} == {-101, -102}
+
+def test_long_import_reports_go_out_as_a_file(mongo, monkeypatch):
+    async def invalid(client, user_id, row):
+        return {"line": row[0], "error": "x" * 100}
+    
+    monkeypatch.setattr(bulk_import, "validate_row", invalid)
+    bot = FakeBot()
+    job = bulk_import.ImportJob(1, 1, 5, [(line, "", "", "") for line in range(1, 60)])
+    
+    asyncio.run(bulk_import.run_import_job(bot, job))
+    
+    assert bot.edits[-1] == "📥 **Import finished:** 0 of 59 row(s) linked"
+    assert bot.documents == ["import_report.txt"]
+
+def test_import_keeps_the_link_of_unchanged_pairs(mongo):
+    asyncio.run(add_linked_channels(1, -100, -200, 10))
+    asyncio.run(mongo[COLLECTION_CHANNELS].update_one({"main_channel_id": -100}, {"$set": {"current_invite_link": "https://t.me/+live"}}))
+    before = stored_links(mongo)[0]["next_update_time"]
+    
+    saved = asyncio.run(import_linked_channels(1, [valid_row((1, "-100", "-200", "10"))["link"]], 30))
+    
+    assert saved == {-100}
+    document = stored_links(mongo)[0]
+    assert document["current_invite_link"] == "https://t.me/+live"
+    assert document["next_update_time"] == before
+
+def test_import_repoints_changed_pairs_on_the_staggered_schedule(mongo):
+    asyncio.run(add_linked_channels(1, -100, -200, 10))
+    
+    saved = asyncio.run(import_linked_channels(1, [
+        valid_row((1, "-100", "-200", "11"))["link"],
+        valid_row((2, "-101", "-201", "1"))["link"]
+    ], 30))
+    
+    assert saved == {-100, -101}
+    documents = {document["main_channel_id"]: document for document in stored_links(mongo)}
+    assert documents[-100]["message_id"] == 11
+    assert documents[-101]["current_invite_link"] is None
+    
+    # The two imported pairs are spread over the stagger window
+    deadlines = sorted(document["next_update_time"] for document in documents.values())
+    assert deadlines[1] - deadlines[0] >= timedelta(seconds=20)
+
+def test_import_reports_only_the_rows_that_were_written(mongo, monkeypatch):
+    class SecondWriteFails:
+        def __init__(self, collection):
+            self.collection = collection
+        
+        def __getattr__(self, name):
+            return getattr(self.collection, name)
+        
+        async def bulk_write(self, operations, ordered=True):
+            await self.collection.bulk_write(operations[:1], ordered=ordered)
+            raise BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"}]})
+    
+    monkeypatch.setattr(database, "db", {COLLECTION_CHANNELS: SecondWriteFails(mongo[COLLECTION_CHANNELS])})
+    
+    saved = asyncio.run(import_linked_channels(1, [
+        valid_row((1, "-100", "-200", "1"))["link"],
+        valid_row((2, "-101", "-201", "1"))["link"]
+    ], 30))
+    
+    assert saved == {-100}
+    assert [document["main_channel_id"] for document in stored_links(mongo)] == [-100]
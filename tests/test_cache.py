@@ -0,0 +1,107 @@
+import asyncio
+
+from cache import TTLCache, SingleFlight, MISSING
+
+def test_get_returns_cached_values_including_none():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("chat", None)
+    
+    assert cache.get("chat") is None
+    assert cache.get("other") is MISSING
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+def test_expired_entries_are_dropped(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: clock[0])
+    
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("short", 1, ttl=5)
+    cache.set("long", 2)
+    
+    clock[0] += 5
+    assert cache.get("short", "expired") == "expired"
+    assert cache.get("long") == 2
+    assert len(cache) == 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_delete_and_clear():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    
+    cache.delete("a")
+    cache.delete("missing")
+    assert cache.get("a") is MISSING
+    
+    cache.clear()
+    assert len(cache) == 0
+
+def test_single_flight_shares_one_call():
+    calls = []
+    
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+    
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.run("key", fetch, 21) for _ in range(5)))
+        return flight, results
+    
+    flight, results = asyncio.run(scenario())
+    
+    assert results == [42] * 5
+    assert calls == [21]
+    assert not flight.in_flight("key")
+
+def test_single_flight_survives_a_cancelled_caller():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        return "done"
+    
+    async def scenario():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.run("key", fetch))
+        second = asyncio.create_task(flight.run("key", fetch))
+        await asyncio.sleep(0)
+        
+        first.cancel()
+        return await second
+    
+    assert asyncio.run(scenario()) == "done"
+
+def test_single_flight_propagates_errors_and_forgets_the_key():
+    async def fail():
+        raise RuntimeError("boom")
+    
+    async def scenario():
+        flight = SingleFlight()
+        try:
+            await flight.run("key", fail)
+        except RuntimeError as e:
+            return flight, str(e)
+    
+    flight, error = asyncio.run(scenario())
+    
+    assert error == "boom"
+    assert not flight.in_flight("key")
+
+def test_stats_can_start_the_counters_over():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    
+    assert cache.stats(reset=True)["hits"] == 1
+    assert cache.stats() == {"size": 1, "hits": 0, "misses": 0, "hit_rate": 0.0}
@@ -0,0 +1,21 @@
+import pytest
+
+from utils import classify_channel_input
+
+@pytest.mark.parametrize("text, expected", [
+    ("-1001234567890", ("chat_id", -1001234567890)),
+    ("1001234567890", ("chat_id", -1001234567890)),
+    ("1234567890", ("chat_id", -1001234567890)),
+    ("https://t.me/c/1234567890/7", ("chat_id", -1001234567890)),
+    ("  @News_Chan ", ("username", "news_chan")),
+    ("news_chan", ("username", "news_chan")),
+    ("https://t.me/News_Chan/5", ("username", "news_chan")),
+    ("t.me/+AbC_d", ("invite", "AbC_d")),
+    ("https://t.me/joinchat/XyZ", ("invite", "XyZ"))
+])
+def test_channel_input_forms(text, expected):
+    assert classify_channel_input(text) == expected
+
+@pytest.mark.parametrize("text", [None, "", "   ", "not a channel!", "ab"])
+def test_unusable_input(text):
+    assert classify_channel_input(text) == (None, None)
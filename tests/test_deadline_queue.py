@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from deadline_queue import DeadlineQueue, minute_of
+
+NOW = datetime(2024, 1, 1, 12, 0, 30)
+
+def test_pop_due_returns_keys_in_deadline_order():
+    queue = DeadlineQueue()
+    queue.schedule("late", NOW + timedelta(minutes=2))
+    queue.schedule("early", NOW - timedelta(minutes=2))
+    queue.schedule("middle", NOW)
+    
+    assert queue.next_deadline() == NOW - timedelta(minutes=2)
+    assert queue.pop_due(NOW) == ["early", "middle"]
+    assert len(queue) == 1
+    assert queue.get("late") == NOW + timedelta(minutes=2)
+
+def test_rescheduling_moves_a_key():
+    queue = DeadlineQueue()
+    queue.schedule("link", NOW - timedelta(minutes=1))
+    queue.schedule("link", NOW + timedelta(minutes=1))
+    
+    assert queue.pop_due(NOW) == []
+    assert queue.next_deadline() == NOW + timedelta(minutes=1)
+    assert len(queue) == 1
+
+def test_removed_keys_are_skipped():
+    queue = DeadlineQueue()
+    queue.schedule("kept", NOW)
+    queue.schedule("removed", NOW - timedelta(minutes=1))
+    queue.remove("removed")
+    
+    assert queue.get("removed") is None
+    assert queue.pop_due(NOW) == ["kept"]
+    assert queue.next_deadline() is None
+
+def test_minute_load_follows_schedule_and_remove():
+    queue = DeadlineQueue()
+    queue.schedule("a", NOW)
+    queue.schedule("b", NOW + timedelta(seconds=10))
+    
+    assert minute_of(NOW) == datetime(2024, 1, 1, 12, 0)
+    assert queue.load_at(NOW) == 2
+    
+    queue.schedule("b", NOW + timedelta(minutes=5))
+    assert queue.load_at(NOW) == 1
+    assert queue.load_at(NOW + timedelta(minutes=5)) == 1
+    
+    queue.remove("a")
+    assert queue.load_at(NOW) == 0
+    
+    queue.pop_due(NOW + timedelta(minutes=5))
+    assert queue.minute_load == {}
+
+def test_heap_is_compacted_when_stale_entries_pile_up():
+    queue = DeadlineQueue()
+    for i in range(1500):
+        queue.schedule("link", NOW + timedelta(seconds=i))
+    
+    assert len(queue) == 1
+    assert len(queue.heap) <= 2 * len(queue) + 1000
+
+def test_wait_due_returns_keys_that_are_already_due():
+    queue = DeadlineQueue()
+    queue.schedule("due", datetime.utcnow() - timedelta(seconds=1))
+    
+    assert asyncio.run(asyncio.wait_for(queue.wait_due(), 1)) == ["due"]
+
+def test_wait_due_wakes_up_for_new_schedules():
+    async def scenario():
+        queue = DeadlineQueue()
+        waiter = asyncio.create_task(queue.wait_due())
+        await asyncio.sleep(0)
+        
+        queue.schedule("new", None)
+        return await asyncio.wait_for(waiter, 1)
+    
+    assert asyncio.run(scenario()) == ["new"]
@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import database
+from config import COLLECTION_CHANNELS, INSTANCE_ID
+from database import claim_link, claim_links, renew_lease, update_invite_link, record_refresh_failure
+
+def insert_link(mongo, main_channel_id, **fields):
+    document = {
+        "user_id": 1,
+        "main_channel_id": main_channel_id,
+        "private_channel_id": -main_channel_id,
+        "message_id": 10,
+        "current_invite_link": None,
+        "next_update_time": datetime.utcnow() - timedelta(minutes=1),
+        **fields
+    }
+    asyncio.run(mongo[COLLECTION_CHANNELS].insert_one(document))
+
+def expire_lease(mongo, main_channel_id):
+    asyncio.run(mongo[COLLECTION_CHANNELS].update_one(
+        {"main_channel_id": main_channel_id},
+        {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}}
+    ))
+
+def flush_after(write):
+    async def scenario():
+        write()
+        await database.write_buffer.flush()
+    
+    asyncio.run(scenario())
+
+def stored(mongo, main_channel_id):
+    return asyncio.run(mongo[COLLECTION_CHANNELS].find_one({"main_channel_id": main_channel_id}))
+
+def test_claim_links_takes_only_due_free_unpaused_links(mongo):
+    insert_link(mongo, 100)
+    insert_link(mongo, 101, next_update_time=datetime.utcnow() + timedelta(hours=1))
+    insert_link(mongo, 102, lease_expires_at=datetime.utcnow() + timedelta(minutes=5))
+    insert_link(mongo, 103, paused_chats=[-103])
+    
+    claimed = asyncio.run(claim_links([(1, 100), (1, 101), (1, 102), (1, 103)]))
+    
+    assert [channel["main_channel_id"] for channel in claimed] == [100]
+    assert claimed[0]["lease_token"]
+    assert stored(mongo, 100)["lease_owner"] == INSTANCE_ID
+    
+    # Already leased, so a second claim gets nothing
+    assert asyncio.run(claim_links([(1, 100)])) == []
+
+def test_expired_leases_are_reclaimed(mongo):
+    insert_link(mongo, 100)
+    first = asyncio.run(claim_links([(1, 100)]))[0]
+    
+    expire_lease(mongo, 100)
+    second = asyncio.run(claim_links([(1, 100)]))[0]
+    
+    assert second["lease_token"] != first["lease_token"]
+
+def test_a_reclaimed_link_rejects_the_old_claims_result(mongo):
+    insert_link(mongo, 100)
+    first = asyncio.run(claim_links([(1, 100)]))[0]
+    expire_lease(mongo, 100)
+    second = asyncio.run(claim_links([(1, 100)]))[0]
+    
+    assert not asyncio.run(renew_lease(first))
+    flush_after(lambda: update_invite_link(1, 100, "https://t.me/+old", first["lease_token"]))
+    assert stored(mongo, 100)["lease_token"] == second["lease_token"]
+    assert stored(mongo, 100)["current_invite_link"] is None
+    
+    flush_after(lambda: update_invite_link(1, 100, "https://t.me/+new", second["lease_token"]))
+    document = stored(mongo, 100)
+    assert document["current_invite_link"] == "https://t.me/+new"
+    assert "lease_owner" not in document and "lease_token" not in document
+
+def test_renew_lease_extends_a_held_claim(mongo):
+    insert_link(mongo, 100)
+    channel = asyncio.run(claim_links([(1, 100)]))[0]
+    expire_lease(mongo, 100)
+    
+    assert asyncio.run(renew_lease(channel))
+    assert stored(mongo, 100)["lease_expires_at"] > datetime.utcnow()
+    assert channel["lease_expires_at"] > datetime.utcnow()
+
+def test_manual_claims_carry_a_token_and_ignore_the_deadline(mongo):
+    insert_link(mongo, 100, next_update_time=datetime.utcnow() + timedelta(hours=1))
+    
+    asyncio.run(claim_link(1, 100))
+    assert "lease_token" not in stored(mongo, 100)
+    
+    asyncio.run(claim_link(1, 100, due_only=False))
+    token = stored(mongo, 100)["lease_token"]
+    assert token
+    
+    # Held, so claiming again leaves the first claim in place
+    asyncio.run(claim_link(1, 100, due_only=False))
+    assert stored(mongo, 100)["lease_token"] == token
+
+def test_failures_are_recorded_only_by_the_claim_holder(mongo):
+    insert_link(mongo, 100)
+    channel = asyncio.run(claim_links([(1, 100)]))[0]
+    
+    flush_after(lambda: record_refresh_failure(1, 100, "boom", 1, "someone-else"))
+    assert "last_error" not in stored(mongo, 100)
+    
+    flush_after(lambda: record_refresh_failure(1, 100, "boom", 1, channel["lease_token"]))
+    document = stored(mongo, 100)
+    assert document["last_error"] == "boom"
+    assert "lease_token" not in document
+    assert abs(database.deadline_queue.get((1, 100)) - document["next_update_time"]) < timedelta(milliseconds=1)
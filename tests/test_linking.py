@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from config import COLLECTION_CHANNELS, COLLECTION_REVOCATIONS
+from database import add_linked_channels, import_linked_channels, pause_links, claim_links, iter_schedule_entries
+from deadline_queue import deadline_queue
+
+def paused_link(mongo):
+    asyncio.run(add_linked_channels(1, -100, -200, 10))
+    asyncio.run(pause_links(-200))
+    asyncio.run(mongo[COLLECTION_CHANNELS].update_one(
+        {"main_channel_id": -100},
+        {"$set": {
+            "failure_count": 7,
+            "quarantined": True,
+            "lease_owner": "crashed",
+            "lease_token": "stale",
+            "lease_expires_at": datetime.utcnow() + timedelta(minutes=5),
+            "next_update_time": datetime.utcnow() - timedelta(minutes=1)
+        }}
+    ))
+
+def stored(mongo):
+    return asyncio.run(mongo[COLLECTION_CHANNELS].find_one({"main_channel_id": -100}))
+
+def schedule_entries():
+    async def collect():
+        return [entry async for entry in iter_schedule_entries()]
+    
+    return asyncio.run(collect())
+
+def test_relinking_with_add_starts_the_pair_over(mongo):
+    paused_link(mongo)
+    assert deadline_queue.get((1, -100)) is None
+    
+    asyncio.run(add_linked_channels(1, -100, -300, 10))
+    
+    document = stored(mongo)
+    for field in ("paused_chats", "paused_at", "failure_count", "quarantined", "lease_owner", "lease_token"):
+        assert field not in document
+    
+    assert [entry["main_channel_id"] for entry in schedule_entries()] == [-100]
+    assert deadline_queue.get((1, -100)) is not None
+    
+    # Due right away, the pair can be claimed again
+    asyncio.run(mongo[COLLECTION_CHANNELS].update_one({"main_channel_id": -100}, {"$set": {"next_update_time": datetime.utcnow()}}))
+    assert len(asyncio.run(claim_links([(1, -100)]))) == 1
+
+def test_relinking_with_import_starts_the_pair_over(mongo):
+    paused_link(mongo)
+    
+    saved = asyncio.run(import_linked_channels(1, [{"main_channel_id": -100, "private_channel_id": -200, "message_id": 10}], 30))
+    
+    assert saved == {-100}
+    document = stored(mongo)
+    assert "paused_chats" not in document and "failure_count" not in document and "lease_token" not in document
+    assert deadline_queue.get((1, -100)) is not None
+
+def test_import_pointing_elsewhere_retires_the_old_links(mongo):
+    asyncio.run(add_linked_channels(1, -100, -200, 10))
+    asyncio.run(mongo[COLLECTION_CHANNELS].update_one(
+        {"main_channel_id": -100},
+        {"$set": {"current_invite_link": "https://t.me/+current", "pending_invite_links": ["https://t.me/+pending"]}}
+    ))
+    
+    asyncio.run(import_linked_channels(1, [{"main_channel_id": -100, "private_channel_id": -300, "message_id": 10}], 30))
+    
+    document = stored(mongo)
+    assert document["private_channel_id"] == -300
+    assert document["current_invite_link"] is None
+    assert "pending_invite_links" not in document
+    
+    queued = asyncio.run(mongo[COLLECTION_REVOCATIONS].find({}).to_list(None))
+    assert sorted(entry["_id"] for entry in queued) == ["https://t.me/+current", "https://t.me/+pending"]
+    assert {entry["private_channel_id"] for entry in queued} == {-200}
@@ -0,0 +1,29 @@
+import pytest
+from bson import ObjectId
+
+from listings import parse_page_callback, page_buttons
+
+CURSOR = ObjectId()
+
+def test_next_and_prev_cursors():
+    assert parse_page_callback(f"status_next_{CURSOR}") == ("status", CURSOR, None)
+    assert parse_page_callback(f"remove_prev_{CURSOR}") == ("remove", None, CURSOR)
+
+@pytest.mark.parametrize("data", [
+    "status",
+    "status_next",
+    "status_next_not-an-id",
+    f"status_sideways_{CURSOR}",
+    f"status_next_{CURSOR}extra"
+])
+def test_malformed_cursors_are_rejected(data):
+    assert parse_page_callback(data) is None
+
+def test_page_buttons_round_trip():
+    channels = [{"_id": ObjectId()}, {"_id": ObjectId()}]
+    
+    prev_button, next_button = page_buttons("status", channels, True, True)
+    
+    assert parse_page_callback(prev_button.callback_data) == ("status", None, channels[0]["_id"])
+    assert parse_page_callback(next_button.callback_data) == ("status", channels[1]["_id"], None)
+    assert page_buttons("status", channels, False, False) == []
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+from pyrogram import errors
+
+import rate_limiter
+from rate_limiter import TokenBucket, RateLimiter, SlidingWindowQuota
+
+class FakeClient:
+    """Client whose send_message raises the queued errors before succeeding"""
+    
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.calls = []
+    
+    async def send_message(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.failures:
+            raise self.failures.pop(0)
+        return "sent"
+
+def test_bucket_hands_out_its_burst_then_waits():
+    async def scenario():
+        bucket = TokenBucket(rate=1, capacity=3)
+        for _ in range(3):
+            await bucket.acquire()
+        return bucket.tokens
+    
+    assert asyncio.run(scenario()) < 1
+
+def test_pause_empties_the_bucket():
+    bucket = TokenBucket(rate=1, capacity=5)
+    bucket.pause(30)
+    
+    assert bucket.tokens == 0
+    assert bucket.paused_until > rate_limiter.time.monotonic() + 29
+    
+    # A shorter pause never cuts a longer one short
+    paused_until = bucket.paused_until
+    bucket.pause(1)
+    assert bucket.paused_until == paused_until
+
+def test_chat_buckets_evict_the_least_recently_used(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "MAX_CHAT_BUCKETS", 2)
+    limiter = RateLimiter(10, 10, 10, 10, 0, 30)
+    
+    first = limiter._chat_bucket(1)
+    limiter._chat_bucket(2)
+    assert limiter._chat_bucket(1) is first
+    limiter._chat_bucket(3)
+    
+    assert list(limiter.chat_buckets) == [1, 3]
+
+def test_call_retries_after_flood_wait():
+    client = FakeClient([errors.FloodWait(value=0)])
+    limiter = RateLimiter(100, 10, 100, 10, 2, 30)
+    
+    result = asyncio.run(limiter.call(client, "send_message", chat_id=5, text="hi"))
+    
+    assert result == "sent"
+    assert len(client.calls) == 2
+    assert 5 in limiter.chat_buckets
+
+def test_call_gives_up_after_the_retry_budget():
+    client = FakeClient([errors.FloodWait(value=0) for _ in range(3)])
+    limiter = RateLimiter(100, 10, 100, 10, 1, 30)
+    
+    with pytest.raises(errors.FloodWait):
+        asyncio.run(limiter.call(client, "send_message", chat_id=5, text="hi"))
+    
+    assert len(client.calls) == 2
+
+def test_long_flood_wait_pauses_the_bucket_without_sleeping():
+    client = FakeClient([errors.FloodWait(value=3600)])
+    limiter = RateLimiter(100, 10, 100, 10, 2, 30)
+    
+    async def scenario():
+        with pytest.raises(errors.FloodWait):
+            await asyncio.wait_for(limiter.call(client, "send_message", chat_id=5, text="hi"), 1)
+        
+        # Later calls for the paused chat fail fast too instead of waiting out the hour
+        with pytest.raises(errors.FloodWait) as raised:
+            await asyncio.wait_for(limiter.call(client, "send_message", chat_id=5, text="again"), 1)
+        
+        return raised.value.value
+    
+    assert asyncio.run(scenario()) > 3500
+    assert len(client.calls) == 1
+
+def test_sliding_window_quota(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: clock[0])
+    quota = SlidingWindowQuota(limit=2, window=60)
+    
+    quota.hit("user")
+    clock[0] += 10
+    quota.hit("user")
+    assert quota.retry_after("user") == 50
+    assert quota.retry_after("other") == 0
+    
+    # The first hit leaves the window
+    clock[0] += 50
+    assert quota.retry_after("user") == 0
+
+def test_sliding_window_quota_prunes_expired_keys(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(rate_limiter, "MAX_QUOTA_KEYS", 2)
+    quota = SlidingWindowQuota(limit=1, window=60)
+    
+    quota.hit("a")
+    quota.hit("b")
+    clock[0] += 60
+    quota.hit("c")
+    
+    assert list(quota.hits) == ["c"]
@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import database
+import utils
+from config import COLLECTION_CHANNELS, COLLECTION_REVOCATIONS
+from database import claim_links
+
+OLD_LINK = "https://t.me/+old"
+
+class FakeTelegram:
+    """Stands in for link creation and the message edit, recording what was published"""
+    
+    def __init__(self, edit_succeeds=True):
+        self.edit_succeeds = edit_succeeds
+        self.on_publish = None
+        self.created = []
+        self.published = []
+    
+    async def create_invite_link(self, bot, private_channel_id):
+        link = f"https://t.me/+new{len(self.created)}"
+        self.created.append(link)
+        return link
+    
+    async def update_main_message(self, bot, main_channel_id, message_id, invite_link):
+        if not self.edit_succeeds:
+            return None
+        
+        self.published.append(invite_link)
+        if self.on_publish:
+            await self.on_publish()
+        return SimpleNamespace(chat=None)
+
+@pytest.fixture
+def telegram(monkeypatch, mongo):
+    fake = FakeTelegram()
+    monkeypatch.setattr(utils, "create_invite_link", fake.create_invite_link)
+    monkeypatch.setattr(utils, "update_main_message", fake.update_main_message)
+    monkeypatch.setattr(utils, "known_missing_privileges", lambda bot, channel_id, privileges: [])
+    return fake
+
+def claimed_link(mongo, **fields):
+    asyncio.run(mongo[COLLECTION_CHANNELS].insert_one({
+        "user_id": 1,
+        "main_channel_id": 100,
+        "private_channel_id": -100,
+        "message_id": 10,
+        "current_invite_link": OLD_LINK,
+        "next_update_time": datetime.utcnow() - timedelta(minutes=1),
+        **fields
+    }))
+    return asyncio.run(claim_links([(1, 100)]))[0]
+
+def rotate(channel):
+    async def scenario():
+        rotated = await utils.rotate_invite_link(None, 1, 100, -100, 10, channel_data=channel)
+        await database.write_buffer.flush()
+        return rotated
+    
+    return asyncio.run(scenario())
+
+def stored(mongo):
+    return asyncio.run(mongo[COLLECTION_CHANNELS].find_one({"main_channel_id": 100}))
+
+def revocations(mongo):
+    return asyncio.run(mongo[COLLECTION_REVOCATIONS].find().to_list(length=None))
+
+def due_revocations(mongo):
+    now = datetime.utcnow()
+    return sorted(revocation["_id"] for revocation in revocations(mongo) if revocation["next_attempt_at"] <= now)
+
+def test_a_lost_lease_stops_the_rotation_before_anything_is_created(mongo, telegram):
+    channel = claimed_link(mongo)
+    
+    # Another instance reclaimed the link after this claim expired
+    channel["lease_expires_at"] = datetime.utcnow() - timedelta(seconds=1)
+    asyncio.run(mongo[COLLECTION_CHANNELS].update_one({"main_channel_id": 100}, {"$set": {"lease_token": "other"}}))
+    
+    assert not rotate(channel)
+    assert telegram.created == []
+    assert telegram.published == []
+    assert revocations(mongo) == []
+    assert stored(mongo)["lease_token"] == "other"
+
+def test_a_lease_running_low_is_renewed(mongo, telegram):
+    channel = claimed_link(mongo)
+    channel["lease_expires_at"] = datetime.utcnow() + timedelta(seconds=5)
+    
+    assert rotate(channel)
+    assert telegram.published == ["https://t.me/+new0"]
+    assert stored(mongo)["current_invite_link"] == "https://t.me/+new0"
+
+def test_a_successful_rotation_revokes_the_old_link_right_away(mongo, telegram):
+    assert rotate(claimed_link(mongo))
+    
+    document = stored(mongo)
+    assert document["current_invite_link"] == "https://t.me/+new0"
+    assert document["pending_invite_links"] == []
+    assert "lease_token" not in document
+    assert due_revocations(mongo) == [OLD_LINK]
+
+def test_a_failed_edit_keeps_the_old_link_and_revokes_the_new_one(mongo, telegram):
+    telegram.edit_succeeds = False
+    
+    assert not rotate(claimed_link(mongo))
+    
+    document = stored(mongo)
+    assert document["current_invite_link"] == OLD_LINK
+    assert document["last_error"] == "Could not update message in public channel"
+    assert due_revocations(mongo) == ["https://t.me/+new0"]
+    assert [revocation["_id"] for revocation in revocations(mongo)] == ["https://t.me/+new0"]
+
+def test_links_left_pending_by_a_crash_are_revoked_by_the_next_rotation(mongo, telegram):
+    # A rotation published this link and died before storing it
+    channel = claimed_link(mongo, pending_invite_links=["https://t.me/+crashed"])
+    
+    assert rotate(channel)
+    
+    assert stored(mongo)["pending_invite_links"] == []
+    assert due_revocations(mongo) == ["https://t.me/+crashed", OLD_LINK]
+
+def test_a_failed_rotation_keeps_links_left_pending_valid(mongo, telegram):
+    telegram.edit_succeeds = False
+    channel = claimed_link(mongo, pending_invite_links=["https://t.me/+crashed"])
+    
+    assert not rotate(channel)
+    
+    # Either link may still be the published one
+    ids = [revocation["_id"] for revocation in revocations(mongo)]
+    assert "https://t.me/+crashed" not in ids and OLD_LINK not in ids
+    assert "https://t.me/+crashed" in stored(mongo)["pending_invite_links"]
+
+def test_a_published_link_stays_pending_when_the_lease_is_lost_before_it_is_stored(mongo, telegram):
+    async def reclaim():
+        await mongo[COLLECTION_CHANNELS].update_one({"main_channel_id": 100}, {"$set": {"lease_token": "other"}})
+    
+    telegram.on_publish = reclaim
+    rotate(claimed_link(mongo))
+    
+    document = stored(mongo)
+    assert document["current_invite_link"] == OLD_LINK
+    assert document["lease_token"] == "other"
+    assert document["pending_invite_links"] == ["https://t.me/+new0"]
+    assert due_revocations(mongo) == [OLD_LINK]
+    
+    # Whoever rotates the link next retires the stranded link with the rest
+    asyncio.run(mongo[COLLECTION_CHANNELS].update_one({"main_channel_id": 100}, {"$unset": {"lease_token": "", "lease_expires_at": ""}}))
+    telegram.on_publish = None
+    assert rotate(asyncio.run(claim_links([(1, 100)]))[0])
+    assert "https://t.me/+new0" in due_revocations(mongo)
@@ -0,0 +1,94 @@
+import asyncio
+
+import scheduler
+
+def test_links_are_claimed_only_for_idle_workers(monkeypatch):
+    batches = []
+    
+    async def fake_claim_links(keys):
+        batches.append(list(keys))
+        return [{"user_id": user_id, "main_channel_id": main_channel_id} for user_id, main_channel_id in keys]
+    
+    async def fake_get_link_schedules(keys):
+        return []
+    
+    monkeypatch.setattr(scheduler, "claim_links", fake_claim_links)
+    monkeypatch.setattr(scheduler, "get_link_schedules", fake_get_link_schedules)
+    
+    async def scenario():
+        monkeypatch.setattr(scheduler, "refresh_queue", asyncio.Queue())
+        monkeypatch.setattr(scheduler, "idle_workers", asyncio.Semaphore(2))
+        
+        dispatch = asyncio.create_task(scheduler.dispatch_due_links([(1, i) for i in range(5)]))
+        await asyncio.sleep(0.01)
+        
+        # Two idle workers, so only two links are leased
+        assert batches == [[(1, 0), (1, 1)]]
+        assert scheduler.refresh_queue.qsize() == 2
+        
+        # A worker finishing frees room for one more claim
+        scheduler.refresh_queue.get_nowait()
+        scheduler.idle_workers.release()
+        await asyncio.sleep(0.01)
+        assert batches[1:] == [[(1, 2)]]
+        
+        for _ in range(2):
+            scheduler.idle_workers.release()
+        await asyncio.wait_for(dispatch, 1)
+    
+    asyncio.run(scenario())
+    
+    assert [key for batch in batches for key in batch] == [(1, i) for i in range(5)]
+
+def test_unclaimed_links_hand_their_workers_back(monkeypatch):
+    async def fake_claim_links(keys):
+        return []
+    
+    async def fake_get_link_schedules(keys):
+        return []
+    
+    monkeypatch.setattr(scheduler, "claim_links", fake_claim_links)
+    monkeypatch.setattr(scheduler, "get_link_schedules", fake_get_link_schedules)
+    
+    async def scenario():
+        monkeypatch.setattr(scheduler, "refresh_queue", asyncio.Queue())
+        monkeypatch.setattr(scheduler, "idle_workers", asyncio.Semaphore(2))
+        
+        await asyncio.wait_for(scheduler.dispatch_due_links([(1, i) for i in range(5)]), 1)
+        return scheduler.idle_workers.locked()
+    
+    assert asyncio.run(scenario()) is False
+
+def test_refresh_workers_count_outcomes_and_free_themselves(monkeypatch):
+    async def fake_refresh_due_link(bot, channel):
+        if channel["main_channel_id"] == 3:
+            raise RuntimeError("boom")
+        return channel["main_channel_id"] == 1
+    
+    monkeypatch.setattr(scheduler, "refresh_due_link", fake_refresh_due_link)
+    monkeypatch.setattr(scheduler, "REFRESH_WORKERS", 2)
+    monkeypatch.setattr(scheduler, "refresh_queue", None)
+    monkeypatch.setattr(scheduler, "refresh_workers", [])
+    monkeypatch.setattr(scheduler, "refresh_stats", {"success": 0, "failed": 0, "since": 0})
+    
+    async def scenario():
+        scheduler.start_refresh_workers(None)
+        scheduler.start_refresh_workers(None)
+        assert len(scheduler.refresh_workers) == 2
+        
+        # Each link is handed over with a worker reserved for it, as dispatch_due_links does
+        for main_channel_id in (1, 2, 3):
+            await scheduler.idle_workers.acquire()
+            scheduler.refresh_queue.put_nowait({"user_id": 1, "main_channel_id": main_channel_id})
+        
+        await asyncio.wait_for(scheduler.refresh_queue.join(), 1)
+        assert not scheduler.idle_workers.locked()
+        assert await scheduler.reserve_workers(5) == 2
+        
+        for worker in scheduler.refresh_workers:
+            worker.cancel()
+    
+    asyncio.run(scenario())
+    
+    assert scheduler.refresh_stats["success"] == 1
+    assert scheduler.refresh_stats["failed"] == 2
@@ -0,0 +1,87 @@
+import asyncio
+
+from user_dispatcher import UserDispatcher
+
+def test_one_users_updates_run_in_order_and_never_overlap():
+    log = []
+    running = set()
+    
+    async def handle(user_id, update):
+        assert user_id not in running
+        running.add(user_id)
+        await asyncio.sleep(0.01 if update == 0 else 0)
+        log.append((user_id, update))
+        running.discard(user_id)
+    
+    async def scenario():
+        dispatcher = UserDispatcher(4)
+        for update in range(3):
+            dispatcher.submit(1, handle, 1, update)
+            dispatcher.submit(2, handle, 2, update)
+        
+        while dispatcher.pending:
+            await asyncio.sleep(0.01)
+        
+        for worker in dispatcher.workers:
+            worker.cancel()
+    
+    asyncio.run(scenario())
+    
+    assert [update for user_id, update in log if user_id == 1] == [0, 1, 2]
+    assert [update for user_id, update in log if user_id == 2] == [0, 1, 2]
+
+def test_a_slow_user_does_not_hold_up_others():
+    release = asyncio.Event()
+    done = []
+    
+    async def slow():
+        await release.wait()
+        done.append("slow")
+    
+    async def quick(name):
+        done.append(name)
+    
+    async def scenario():
+        dispatcher = UserDispatcher(2)
+        dispatcher.submit(1, slow)
+        dispatcher.submit(1, quick, "after slow")
+        dispatcher.submit(2, quick, "other user")
+        
+        await asyncio.sleep(0.01)
+        assert done == ["other user"]
+        assert dispatcher.stats()["queued"] == 1
+        
+        release.set()
+        while dispatcher.pending:
+            await asyncio.sleep(0.01)
+        
+        for worker in dispatcher.workers:
+            worker.cancel()
+    
+    asyncio.run(scenario())
+    
+    assert done == ["other user", "slow", "after slow"]
+
+def test_a_failing_update_does_not_stop_the_users_queue():
+    done = []
+    
+    async def fail():
+        raise RuntimeError("boom")
+    
+    async def record():
+        done.append(True)
+    
+    async def scenario():
+        dispatcher = UserDispatcher(1)
+        dispatcher.submit(1, fail)
+        dispatcher.submit(1, record)
+        
+        while dispatcher.pending:
+            await asyncio.sleep(0.01)
+        
+        assert dispatcher.busy == 0
+        dispatcher.workers[0].cancel()
+    
+    asyncio.run(scenario())
+    
+    assert done == [True]
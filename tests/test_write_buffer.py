@@ -0,0 +1,105 @@
+import asyncio
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import database
+from database import WriteBuffer
+
+class ScriptedCollection:
+    """Collection whose bulk_write raises the queued outcomes before succeeding"""
+    
+    def __init__(self, outcomes=()):
+        self.outcomes = list(outcomes)
+        self.batches = []
+    
+    async def bulk_write(self, operations, ordered=True):
+        self.batches.append(list(operations))
+        if self.outcomes:
+            raise self.outcomes.pop(0)
+        
+        class Result:
+            modified_count = len(operations)
+        
+        return Result()
+
+def write_errors(*errors):
+    return BulkWriteError({"writeErrors": [{"index": index, "code": code, "errmsg": "failed"} for index, code in errors]})
+
+def operation(name):
+    return UpdateOne({"_id": name}, {"$set": {"seen": True}})
+
+def use_collection(monkeypatch, collection):
+    monkeypatch.setattr(database, "db", {"links": collection})
+
+def test_commits_share_one_bulk_write(monkeypatch):
+    collection = ScriptedCollection()
+    use_collection(monkeypatch, collection)
+    
+    async def scenario():
+        buffer = WriteBuffer(100, 60, 0.01)
+        buffer.add("links", operation("queued"))
+        return await asyncio.gather(*(buffer.commit("links", operation(i)) for i in range(3)))
+    
+    assert asyncio.run(scenario()) == [True, True, True]
+    assert len(collection.batches) == 1
+    assert len(collection.batches[0]) == 4
+
+def test_failed_writes_are_retried_or_reported(monkeypatch):
+    collection = ScriptedCollection([write_errors((0, 11600), (1, 11000), (2, 11600))])
+    use_collection(monkeypatch, collection)
+    
+    async def scenario():
+        buffer = WriteBuffer(100, 60, 0.01)
+        buffer.add("links", operation("transient"))
+        buffer.add("links", operation("duplicate"))
+        committed = asyncio.create_task(buffer.commit("links", operation("committed")))
+        await asyncio.sleep(0)
+        buffer.add("links", operation("fine"))
+        result = await committed
+        
+        # The transient failure is put back for the next flush; the committed one is left to its waiter
+        assert [op._filter for op, _ in buffer.operations["links"]] == [{"_id": "transient"}]
+        assert buffer.timer is not None
+        
+        await buffer.flush()
+        return buffer, result
+    
+    buffer, committed = asyncio.run(scenario())
+    
+    assert committed is False
+    assert buffer.failed == 2
+    assert buffer.size == 0
+    assert len(collection.batches) == 2
+
+def test_an_unreachable_database_keeps_buffered_writes_and_fails_commits(monkeypatch):
+    collection = ScriptedCollection([ConnectionError("down")])
+    use_collection(monkeypatch, collection)
+    
+    async def scenario():
+        buffer = WriteBuffer(100, 60, 0.01)
+        buffer.add("links", operation("buffered"))
+        committed = await buffer.commit("links", operation("committed"))
+        return buffer, committed
+    
+    buffer, committed = asyncio.run(scenario())
+    
+    assert committed is False
+    assert [op._filter for op, _ in buffer.operations["links"]] == [{"_id": "buffered"}]
+    assert buffer.size == 1
+
+def test_the_size_threshold_flushes_without_waiting(monkeypatch):
+    collection = ScriptedCollection()
+    use_collection(monkeypatch, collection)
+    
+    async def scenario():
+        buffer = WriteBuffer(2, 60, 60)
+        buffer.add("links", operation("a"))
+        buffer.add("links", operation("b"))
+        await asyncio.sleep(0.01)
+        return buffer
+    
+    buffer = asyncio.run(scenario())
+    
+    assert len(collection.batches) == 1
+    assert buffer.size == 0
@@ -0,0 +1,106 @@
+import asyncio
+from collections import deque
+from functools import wraps
+from loguru import logger
+
+from config import DISPATCH_WORKERS
+
+# Per-user serialized dispatcher
+class UserDispatcher:
+    """Runs updates of one user in order while different users run in parallel"""
+    
+    def __init__(self, workers):
+        self.worker_count = workers
+        self.pending = {}
+        self.ready = None
+        self.workers = []
+        self.busy = 0
+        self.peak_queued = 0
+    
+    def start(self):
+        if self.workers:
+            return
+        
+        self.ready = asyncio.Queue()
+        
+        for worker_id in range(self.worker_count):
+            self.workers.append(asyncio.create_task(self.worker(worker_id)))
+        
+        logger.info(f"Started {self.worker_count} update dispatch workers")
+    
+    def submit(self, user_id, func, *args):
+        """Queue func(*args) behind the user's earlier updates"""
+        self.start()
+        
+        queue = self.pending.get(user_id)
+        
+        # A user is in the ready queue at most once, so their updates never run concurrently
+        if queue is None:
+            queue = deque()
+            self.pending[user_id] = queue
+            self.ready.put_nowait(user_id)
+        
+        queue.append((func, args))
+        self.peak_queued = max(self.peak_queued, self.queued())
+    
+    async def worker(self, worker_id):
+        while True:
+            user_id = await self.ready.get()
+            queue = self.pending[user_id]
+            func, args = queue.popleft()
+            
+            self.busy += 1
+            try:
+                await func(*args)
+            
+            except Exception as e:
+                logger.error(f"Error handling update for user {user_id} in dispatch worker {worker_id}: {e}")
+            
+            finally:
+                self.busy -= 1
+                
+                # Go to the back of the line so one busy user can't starve the others
+                if queue:
+                    self.ready.put_nowait(user_id)
+                else:
+                    del self.pending[user_id]
+    
+    def queued(self):
+        return sum(len(queue) for queue in self.pending.values())
+    
+    def stats(self):
+        """Get queue-depth metrics and reset the peak"""
+        stats = {
+            "workers": self.worker_count,
+            "busy": self.busy,
+            "users": len(self.pending),
+            "queued": self.queued(),
+            "deepest_user_queue": max((len(queue) for queue in self.pending.values()), default=0),
+            "peak_queued": self.peak_queued
+        }
+        self.peak_queued = stats["queued"]
+        return stats
+
+# Global dispatcher instance
+dispatcher = UserDispatcher(DISPATCH_WORKERS)
+
+# Handler decorator
+def per_user(handler):
+    """Hand an update to the per-user dispatcher instead of running it on Pyrogram's worker"""
+    @wraps(handler)
+    async def submit(client, update):
+        user = getattr(update, "from_user", None)
+        dispatcher.submit(user.id if user else None, handler, client, update)
+    
+    return submit
+
+# Report dispatch queues
+async def report_dispatch_queues():
+    """Log how deep the per-user dispatch queues got since the last report"""
+    stats = dispatcher.stats()
+    
+    if stats["peak_queued"] or stats["busy"]:
+        logger.info(
+            f"Dispatch: {stats['busy']}/{stats['workers']} workers busy, {stats['queued']} updates queued "
+            f"for {stats['users']} users (peak {stats['peak_queued']}, deepest user queue {stats['deepest_user_queue']})"
+        )
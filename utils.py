@@ -1,25 +1,44 @@
+import re
 import asyncio
 from datetime import datetime, timedelta
 from pyrogram import errors
-from pyrogram.raw import functions
+from pyrogram.enums import ChatType, ChatMemberStatus
 from loguru import logger
-from pyrogram.errors import UsernameInvalid, UsernameNotOccupied, PeerIdInvalid, ChannelInvalid
 
-from database import update_invite_link, get_channel_by_ids
+from database import stage_rotation, update_invite_link, claim_link, renew_lease, record_refresh_failure
+from database import enqueue_revocation, expedite_revocation, cancel_revocation
+from database import store_invite_hash, get_invite_hash_chat_id, store_username, get_username_chat_id
+from rate_limiter import api_call
+from chat_cache import get_chat, remember_chat
+from member_cache import get_member, cached_member
+from cache import TTLCache, SingleFlight, MISSING
+from config import NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL_SECONDS, INVITE_HASH_CACHE_SIZE, INVITE_HASH_TTL_DAYS
+from config import LEASE_SECONDS, USERNAME_CACHE_SIZE, USERNAME_CACHE_TTL_HOURS, CHAT_CACHE_TTL_SECONDS
 
 # Create new invite link for private channel
 async def create_invite_link(bot, private_channel_id):
     """Create a new invite link for the private channel"""
     try:
         # Create new invite link
-        invite_link = await bot.create_chat_invite_link(
+        invite_link = await api_call(
+            bot,
+            "create_chat_invite_link",
             chat_id=private_channel_id,
             creates_join_request=False,  # Direct join
             member_limit=0  # No limit
         )
         
+        # Index the new link so pasting it back resolves locally
+        invite_hash = invite_hash_of(invite_link.invite_link)
+        if invite_hash:
+            remember_invite_hash(invite_hash, private_channel_id)
+        
         return invite_link.invite_link
     
+    except errors.FloodWait as e:
+        logger.warning(f"Flood limit hit while creating invite link for channel {private_channel_id}, retry in {e.value}s")
+        return None
+    
     except errors.ChatAdminRequired:
         return None
     
@@ -38,7 +57,9 @@ async def revoke_invite_link(bot, private_channel_id, invite_link):
     
     try:
         # Revoke the old invite link
-        await bot.revoke_chat_invite_link(
+        await api_call(
+            bot,
+            "revoke_chat_invite_link",
             chat_id=private_channel_id,
             invite_link=invite_link
         )
@@ -67,13 +88,16 @@ async def update_main_message(bot, main_channel_id, message_id, invite_link):
         message_text = f"🔗 **New Invite Link:**\n{invite_link}\n\n🤖 Powered by @LinkGuardRobot"
         
         # Edit the message
-        await bot.edit_message_text(
+        message = await api_call(
+            bot,
+            "edit_message_text",
             chat_id=main_channel_id,
             message_id=message_id,
             text=message_text
         )
         
-        return True
+        # Return the edited message so callers can reuse its chat info
+        return message or True
     
     except errors.MessageNotModified:
         return True  # Consider it a success
@@ -85,238 +109,363 @@ async def update_main_message(bot, main_channel_id, message_id, invite_link):
         logger.error(f"Error updating message: {e}")
         return False
 
+# Bot privileges each side of a link needs (main chats are always broadcast channels)
+MAIN_CHANNEL_PRIVILEGES = ("can_edit_messages",)
+PRIVATE_CHANNEL_PRIVILEGES = ("can_invite_users",)
+
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+# Get the privileges a member lacks
+def missing_privileges(member, privileges):
+    """Get the privileges from the list the member lacks (all of them if not an admin)"""
+    if member is None or member.status not in ADMIN_STATUSES:
+        return list(privileges)
+    
+    if member.status == ChatMemberStatus.OWNER:
+        return []
+    
+    return [name for name in privileges if not getattr(member.privileges, name, False)]
+
 # Check if user is admin in channel
 async def is_user_admin(bot, user_id, channel_id):
     """Check if the user is an admin in the channel"""
-    # Bypass admin check - always return True
-    # This is a temporary solution to fix the admin permission issue
-    logger.info(f"Bypassing admin check for user {user_id} in channel {channel_id}")
-    return True
-
+    try:
+        member = await get_member(bot, channel_id, user_id)
+        return member is not None and member.status in ADMIN_STATUSES
+    
+    except Exception as e:
+        logger.warning(f"Could not check admin status of user {user_id} in channel {channel_id}: {e}")
+        return False
 
 # Check if bot is admin in channel with required permissions
-async def is_bot_admin_with_permissions(bot, channel_id):
-    """Check if the bot is an admin in the channel with required permissions"""
-    # Bypass bot admin check - always return True
-    # This is a temporary solution to fix the admin permission issue
-    logger.info(f"Bypassing bot admin check for channel {channel_id}")
-    return True
+async def is_bot_admin_with_permissions(bot, channel_id, privileges=()):
+    """Check if the bot is an admin in the channel with the given privileges"""
+    try:
+        member = await get_member(bot, channel_id, bot.me.id)
+        return not missing_privileges(member, privileges)
+    
+    except Exception as e:
+        logger.warning(f"Could not check bot permissions in channel {channel_id}: {e}")
+        return False
+
+# Check cached snapshots for privileges the bot is known to lack
+def known_missing_privileges(bot, channel_id, privileges):
+    """Get the privileges the bot's cached snapshot lacks, without calling Telegram"""
+    member = cached_member(channel_id, bot.me.id)
+    
+    if member is MISSING:
+        return []
+    
+    return missing_privileges(member, privileges)
+
+# Patterns for the kinds of channel input users send
+TELEGRAM_LINK = r"(?:https?://)?(?:www\.)?(?:t|telegram)\.me/"
+INVITE_LINK_PATTERN = re.compile(TELEGRAM_LINK + r"(?:\+|joinchat/)([\w-]+)/?$", re.IGNORECASE)
+PRIVATE_LINK_PATTERN = re.compile(TELEGRAM_LINK + r"c/(\d+)(?:/\d+)?/?$", re.IGNORECASE)
+PUBLIC_LINK_PATTERN = re.compile(TELEGRAM_LINK + r"([a-z][\w]{3,31})(?:/\d+)?/?$", re.IGNORECASE)
+USERNAME_PATTERN = re.compile(r"@?([a-z][\w]{3,31})$", re.IGNORECASE)
+CHAT_ID_PATTERN = re.compile(r"-?\d+$")
+
+# Errors meaning the input doesn't name any chat; only these are negative-cached
+DEFINITIVE_RESOLVE_ERRORS = (
+    errors.UsernameNotOccupied,
+    errors.UsernameInvalid,
+    errors.PeerIdInvalid,
+    errors.InviteHashInvalid,
+    errors.InviteHashExpired
+)
+
+# Inputs that recently turned out not to name a channel
+failed_inputs = TTLCache(NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL_SECONDS)
+
+# Classify channel input
+def classify_channel_input(text):
+    """Classify channel input as ("chat_id", id), ("username", name) or ("invite", hash)"""
+    if not text or not text.strip():
+        return None, None
+    
+    text = text.strip()
+    
+    # Numeric IDs: negative IDs as is, bare numbers as channel IDs (with or without the 100 prefix)
+    if CHAT_ID_PATTERN.match(text):
+        if text.startswith("-"):
+            return "chat_id", int(text)
+        if text.startswith("100") and len(text) >= 13:
+            return "chat_id", -int(text)
+        return "chat_id", int(f"-100{text}")
+    
+    # Invite links (t.me/+hash or t.me/joinchat/hash)
+    match = INVITE_LINK_PATTERN.match(text)
+    if match:
+        return "invite", match.group(1)
+    
+    # Private message links (t.me/c/<id>/<msg>)
+    match = PRIVATE_LINK_PATTERN.match(text)
+    if match:
+        return "chat_id", int(f"-100{match.group(1)}")
+    
+    # Public channel or message links (t.me/<username>/<msg>)
+    match = PUBLIC_LINK_PATTERN.match(text)
+    if match:
+        return "username", match.group(1).lower()
+    
+    # Plain usernames, with or without @
+    match = USERNAME_PATTERN.match(text)
+    if match:
+        return "username", match.group(1).lower()
+    
+    return None, None
+
+# Check if a chat is a channel or supergroup
+def is_channel(chat):
+    return chat is not None and getattr(chat, "id", None) is not None and chat.type in (ChatType.CHANNEL, ChatType.SUPERGROUP)
+
+# Public (main) chats must be broadcast channels: supergroups have no 'Edit Messages' right
+def is_broadcast_channel(chat):
+    return chat is not None and getattr(chat, "type", None) == ChatType.CHANNEL
+
+# Invite hash -> chat ID front cache for the persistent index
+invite_hashes = TTLCache(INVITE_HASH_CACHE_SIZE, INVITE_HASH_TTL_DAYS * 24 * 3600)
+
+# Extract the hash from an invite link
+def invite_hash_of(invite_link):
+    match = INVITE_LINK_PATTERN.match(invite_link or "")
+    return match.group(1) if match else None
+
+# Record which chat an invite hash belongs to
+def remember_invite_hash(invite_hash, chat_id):
+    invite_hashes.set(invite_hash, chat_id)
+    store_invite_hash(invite_hash, chat_id)
+
+# Find the chat an invite hash belongs to without calling Telegram
+async def lookup_invite_hash(invite_hash):
+    chat_id = invite_hashes.get(invite_hash, None)
+    if chat_id is not None:
+        return chat_id
+    
+    chat_id = await get_invite_hash_chat_id(invite_hash)
+    if chat_id is not None:
+        invite_hashes.set(invite_hash, chat_id)
+    
+    return chat_id
+
+# Username -> chat ID front cache for the shared resolution cache
+resolved_usernames = TTLCache(USERNAME_CACHE_SIZE, min(CHAT_CACHE_TTL_SECONDS, USERNAME_CACHE_TTL_HOURS * 3600))
+
+# Record which chat a username resolved to
+def remember_username(username, chat_id):
+    resolved_usernames.set(username, chat_id)
+    store_username(username, chat_id)
+
+# Find the chat a username resolved to without calling Telegram
+async def lookup_username(username):
+    chat_id = resolved_usernames.get(username, None)
+    if chat_id is not None:
+        return chat_id
+    
+    chat_id = await get_username_chat_id(username)
+    if chat_id is not None:
+        resolved_usernames.set(username, chat_id)
+    
+    return chat_id
 
 # Helper function to resolve channel ID from text input
 async def resolve_channel_id(client, text):
-    """Resolve a channel ID from text input using multiple strategies"""
-    if not text or not text.strip():
+    """Resolve a channel ID from text input with a single API call for its input type"""
+    kind, value = classify_channel_input(text)
+    
+    if kind is None:
         return None
     
-    text = text.strip()
+    # Don't hit the network again for input that just failed
+    if failed_inputs.get((kind, value), None) is not None:
+        return None
     
-    # Strategy 0: Check if it's a message link or invite link and extract channel username/ID
-    if "t.me/" in text:
-        try:
-            # Handle message links like https://t.me/channelname/123 or t.me/c/123456789/123
-            parts = text.split("t.me/")
-            if len(parts) > 1:
-                path_parts = parts[1].split("/")
-                channel_part = path_parts[0]
-                
-                # If it's a private channel link (t.me/c/123456789/123)
-                if channel_part == "c" and len(path_parts) >= 3:
-                    channel_id_str = path_parts[1]
-                    if channel_id_str.isdigit():
-                        # Convert to proper channel ID format
-                        channel_id = int(f"-100{channel_id_str}")
-                        try:
-                            chat = await client.get_chat(channel_id)
-                            if chat and (chat.type == "channel" or chat.type == "supergroup"):
-                                return chat.id
-                        except Exception as e:
-                            logger.error(f"Error resolving channel from link (private): {e}")
-                
-                # If it's a public channel link (t.me/channelname/123)
-                else:
-                    try:
-                        chat = await client.get_chat(f"@{channel_part}")
-                        if chat and (chat.type == "channel" or chat.type == "supergroup"):
-                            return chat.id
-                    except Exception as e:
-                        logger.error(f"Error resolving channel from link (public): {e}")
-                        
-                # If it's an invite link (t.me/joinchat/XXXX or t.me/+XXXX)
-                if channel_part == "joinchat" and len(path_parts) >= 2:
-                    try:
-                        # Try to get chat by invite link
-                        invite_hash = path_parts[1]
-                        invite_link = f"https://t.me/joinchat/{invite_hash}"
-                        
-                        # Try to join the chat using the invite link
-                        try:
-                            chat = await client.join_chat(invite_link)
-                            if chat and (chat.type == "channel" or chat.type == "supergroup"):
-                                return chat.id
-                        except Exception as e:
-                            # If we're already in the chat, we can get it directly
-                            if "ALREADY_PARTICIPANT" in str(e):
-                                # We need to extract the chat ID from the error message
-                                # or try to get it from the client's dialogs
-                                try:
-                                    async for dialog in client.get_dialogs():
-                                        if dialog.chat and dialog.chat.type in ["channel", "supergroup"]:
-                                            # Try to match by checking if this chat has the same invite link
-                                            try:
-                                                chat_invite_link = await client.export_chat_invite_link(dialog.chat.id)
-                                                if invite_hash in chat_invite_link:
-                                                    return dialog.chat.id
-                                            except Exception:
-                                                pass
-                                except Exception as e2:
-                                    logger.error(f"Error searching for chat by invite link: {e2}")
-                            else:
-                                logger.error(f"Error joining chat with invite link: {e}")
-                    except Exception as e:
-                        logger.error(f"Error resolving channel from invite link: {e}")
-                
-                # If it's a new-style invite link (t.me/+XXXX)
-                elif channel_part.startswith("+") and len(channel_part) > 1:
-                    try:
-                        # Try to get chat by invite link
-                        invite_hash = channel_part[1:]
-                        invite_link = f"https://t.me/+{invite_hash}"
-                        
-                        # Try to join the chat using the invite link
-                        try:
-                            chat = await client.join_chat(invite_link)
-                            if chat and (chat.type == "channel" or chat.type == "supergroup"):
-                                return chat.id
-                        except Exception as e:
-                            # If we're already in the chat, we can get it directly
-                            if "ALREADY_PARTICIPANT" in str(e):
-                                # We need to extract the chat ID from the error message
-                                # or try to get it from the client's dialogs
-                                try:
-                                    async for dialog in client.get_dialogs():
-                                        if dialog.chat and dialog.chat.type in ["channel", "supergroup"]:
-                                            # Try to match by checking if this chat has the same invite link
-                                            try:
-                                                chat_invite_link = await client.export_chat_invite_link(dialog.chat.id)
-                                                if invite_hash in chat_invite_link:
-                                                    return dialog.chat.id
-                                            except Exception:
-                                                pass
-                                except Exception as e2:
-                                    logger.error(f"Error searching for chat by invite link: {e2}")
-                            else:
-                                logger.error(f"Error joining chat with invite link: {e}")
-                    except Exception as e:
-                        logger.error(f"Error resolving channel from invite link: {e}")
-        except Exception as e:
-            logger.error(f"Error parsing message link: {e}")
-    
-    # Strategy 1: Try direct resolution with text as is
     try:
-        chat = await client.get_chat(text)
-        if chat and (chat.type == "channel" or chat.type == "supergroup"):
+        if kind == "invite":
+            # Links the bot created (or resolved before) are a local lookup
+            chat_id = await lookup_invite_hash(value)
+            if chat_id is not None:
+                return chat_id
+            
+            # Check the invite: the full chat if the bot is a member, otherwise only a preview
+            chat = await api_call(client, "get_chat", chat_id=f"https://t.me/+{value}")
+            if is_channel(chat):
+                remember_chat(chat)
+                remember_invite_hash(value, chat.id)
+        elif kind == "username":
+            # Usernames resolved by any instance are shared through the database
+            chat_id = await lookup_username(value)
+            if chat_id is not None:
+                return chat_id
+            
+            chat = await get_chat(client, value)
+            if is_channel(chat):
+                remember_username(value, chat.id)
+        else:
+            chat = await get_chat(client, value)
+        
+        if is_channel(chat):
             return chat.id
-    except Exception:
-        pass
-    
-    # Strategy 2: If text starts with @, try without @
-    if text.startswith('@'):
-        try:
-            username = text[1:]
-            chat = await client.get_chat(username)
-            if chat and (chat.type == "channel" or chat.type == "supergroup"):
-                return chat.id
-        except Exception:
-            pass
-    
-    # Strategy 3: If text doesn't start with @, try with @
-    else:
-        try:
-            chat = await client.get_chat(f"@{text}")
-            if chat and (chat.type == "channel" or chat.type == "supergroup"):
-                return chat.id
-        except Exception:
-            pass
-    
-    # Strategy 4: Try to parse as numeric ID
-    if text.isdigit() or (text.startswith('-') and text[1:].isdigit()):
-        try:
-            chat_id = int(text)
-            chat = await client.get_chat(chat_id)
-            if chat and (chat.type == "channel" or chat.type == "supergroup"):
-                return chat.id
-        except Exception:
-            pass
-    
-    # Strategy 5: Try to resolve as a peer
-    try:
-        peer = await client.resolve_peer(text)
-        if peer and hasattr(peer, 'channel_id'):
-            return int(f"-100{peer.channel_id}")
-    except Exception:
-        pass
-    
-    # Strategy 6: If text doesn't start with @, try peer resolution with @
-    if not text.startswith('@'):
-        try:
-            peer = await client.resolve_peer(f"@{text}")
-            if peer and hasattr(peer, 'channel_id'):
-                return int(f"-100{peer.channel_id}")
-        except Exception:
-            pass
-    
-    # Strategy 7: Last resort - force consider any text as a potential channel
-    # This is useful when Telegram API has inconsistencies
-    try:
-        result = await client.invoke(
-            functions.channels.GetChannels(
-                id=[text.lstrip('@')]
-            )
-        )
-        if result and hasattr(result, 'chats') and len(result.chats) > 0:
-            return result.chats[0].id
-    except Exception:
-        pass
+        
+        # Resolved to something that isn't a channel (a user, bot or basic group). An invite
+        # preview has no ID and only means the bot isn't a member yet, so it isn't cached
+        if getattr(chat, "id", None) is not None:
+            failed_inputs.set((kind, value), True)
+    
+    except DEFINITIVE_RESOLVE_ERRORS as e:
+        logger.debug(f"Could not resolve {kind} {value}: {e}")
+        failed_inputs.set((kind, value), True)
+    
+    except Exception as e:
+        # Transient and permission errors may clear up on the user's next try
+        logger.debug(f"Could not resolve {kind} {value}: {e}")
     
     return None
 
+# Concurrent refreshes of the same link share one rotation
+link_refreshes = SingleFlight()
+
+# Make sure a claimed link is still ours before acting on it
+async def hold_lease(channel_data):
+    """Renew the lease of a claimed link once less than half of it is left, returning False if it was lost"""
+    expires_at = channel_data.get("lease_expires_at")
+    
+    if expires_at is not None and expires_at - datetime.utcnow() > timedelta(seconds=LEASE_SECONDS / 2):
+        return True
+    
+    return await renew_lease(channel_data)
+
 # Main function to update channel invite link
-async def update_channel_invite_link(bot, user_id, main_channel_id, private_channel_id, message_id):
+async def update_channel_invite_link(bot, user_id, main_channel_id, private_channel_id, message_id, channel_data=None):
+    """Update the invite link for a channel, joining a refresh of the same link that is already running"""
+    return await link_refreshes.run(
+        (user_id, main_channel_id),
+        rotate_invite_link,
+        bot,
+        user_id,
+        main_channel_id,
+        private_channel_id,
+        message_id,
+        channel_data
+    )
+
+async def rotate_invite_link(bot, user_id, main_channel_id, private_channel_id, message_id, channel_data=None):
     """Update the invite link for a channel and update the message in the main channel"""
+    db_updated = False
+    published = False
+    queued_revocations = []
+    lease_lost = False
+    error = None
+    
+    # Only scheduled refreshes (which arrive with their claimed document) escalate failures
+    scheduled = channel_data is not None
+    
     try:
-        # Get current channel data
-        channel_data = await get_channel_by_ids(user_id, main_channel_id)
+        # Claim the link unless the caller already holds its lease
+        if channel_data is None:
+            channel_data = await claim_link(user_id, main_channel_id, due_only=False)
+            
+            if not channel_data:
+                logger.info(f"Link for user {user_id} and channel {main_channel_id} is missing or being refreshed elsewhere")
+                return False
+        
+        # Skip the API calls if the bot is already known to lack a privilege
+        missing = (
+            known_missing_privileges(bot, main_channel_id, MAIN_CHANNEL_PRIVILEGES)
+            + known_missing_privileges(bot, private_channel_id, PRIVATE_CHANNEL_PRIVILEGES)
+        )
         
-        if not channel_data:
+        if missing:
+            error = f"Bot is missing privileges: {', '.join(missing)}"
             return False
         
-        # Get current invite link
-        current_invite_link = channel_data.get("current_invite_link")
+        # The claim may have run low while it waited; never rotate a link another instance can claim
+        if not await hold_lease(channel_data):
+            lease_lost = True
+            logger.warning(f"Lost the refresh lease for user {user_id} and channel {main_channel_id}, skipping the rotation")
+            return False
         
         # Create new invite link
         new_invite_link = await create_invite_link(bot, private_channel_id)
         
         if not new_invite_link:
+            error = "Could not create invite link in private channel"
+            return False
+        
+        # Check again right before publishing, since creating the link may have waited on the rate limiter
+        if not await hold_lease(channel_data):
+            lease_lost = True
+            error = "Lost the refresh lease"
+            await enqueue_revocation(private_channel_id, new_invite_link)
+            return False
+        
+        # The current link, plus any left pending by a rotation that crashed or lost its lease
+        # (one of them may be the published link, so they are all retired the same way)
+        current_invite_link = channel_data.get("current_invite_link")
+        retiring_links = [current_invite_link] if current_invite_link else []
+        retiring_links += [link for link in channel_data.get("pending_invite_links") or [] if link != current_invite_link]
+        
+        # Before anything is published, persist the retiring links' revocations (deferred by one lease
+        # so a crash mid-rotation still revokes them after the link is refreshed again) and the new link
+        queued_revocations = retiring_links
+        if not await stage_rotation(user_id, main_channel_id, private_channel_id, new_invite_link, retiring_links, LEASE_SECONDS):
+            error = "Could not record new invite link"
+            await enqueue_revocation(private_channel_id, new_invite_link)
             return False
         
         # Update message in main channel
         message_updated = await update_main_message(bot, main_channel_id, message_id, new_invite_link)
         
         if not message_updated:
+            error = "Could not update message in public channel"
+            
+            # The new link was never shown, so it can go
+            await enqueue_revocation(private_channel_id, new_invite_link)
             return False
         
-        # Revoke old invite link (if exists)
-        if current_invite_link:
-            await revoke_invite_link(bot, private_channel_id, current_invite_link)
+        published = True
         
-        # Update database with new invite link
-        db_updated = await update_invite_link(user_id, main_channel_id, new_invite_link)
+        # The old links are no longer published, so revoke them right away
+        for link in retiring_links:
+            expedite_revocation(link)
         
-        if not db_updated:
-            return False
+        # The edited message carries the public channel's current title
+        main_chat = getattr(message_updated, "chat", None)
+        if main_chat is not None:
+            remember_chat(main_chat)
+        
+        # Queue the new invite link with the other refresh outcomes (this also releases the lease)
+        update_invite_link(
+            user_id,
+            main_channel_id,
+            new_invite_link,
+            channel_data.get("lease_token"),
+            main_chat=main_chat,
+            retired_links=retiring_links
+        )
+        db_updated = True
         
         return True
     
     except Exception as e:
         logger.error(f"Error updating invite link: {e}")
-        return False
\ No newline at end of file
+        error = str(e)
+        return False
+    
+    finally:
+        # One of the old links is still the published one, so keep them valid
+        if not published:
+            for link in queued_revocations:
+                await cancel_revocation(link)
+        
+        # Back off and let another attempt claim the link if this one failed (a lost claim is no longer ours to record)
+        if channel_data and not db_updated and not lease_lost:
+            failure_count = (channel_data.get("failure_count") or 0) + (1 if scheduled else 0)
+            record_refresh_failure(
+                user_id,
+                main_channel_id,
+                error or "Unknown error",
+                failure_count,
+                channel_data.get("lease_token")
+            )
\ No newline at end of file